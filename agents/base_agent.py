@@ -1,11 +1,26 @@
-from typing import Dict, Any, Optional
-from langchain_core.language_models import BaseChatModel
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from typing import TYPE_CHECKING, Dict, Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from agents.llm_cache import ResponseCache, cache_key
+from agents.metrics import LLM_CALLS, LLM_TOKENS, STAGE_SECONDS
+from config.config import get_config
+import logging
 import os
-import yaml
-from dotenv import load_dotenv
+import threading
+
+if TYPE_CHECKING:
+    # langchain_core.language_models (con tracer e langsmith) costa quasi un
+    # secondo di import: serve solo quando si crea davvero un client
+    from langchain_core.language_models import BaseChatModel
+
+logger = logging.getLogger(__name__)
+
+# Politiche di contesto supportate (vedi la sezione "context" in config.yaml)
+CONTEXT_MODES = ("full", "stateless", "window", "budget")
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Rough token estimate (~4 chars per token plus per-message overhead)."""
+    return sum(len(str(msg.content)) // 4 + 4 for msg in messages)
 
 
 class LangChainAgent:
@@ -14,48 +29,127 @@ class LangChainAgent:
         provider: str = "groq",
         system: str = "",
         config: Optional[Dict[str, Any]] = None,
+        llm: Optional["BaseChatModel"] = None,
+        response_cache: Optional[ResponseCache] = None,
     ):
-        self.config = config or self.load_config()
+        # llm e response_cache possono essere condivisi tra più agenti (es. shard)
+        self.config = config or get_config()
         self.provider = provider.lower()
         self.system_message = system
         self.messages = []
-        self.llm = self._initialize_llm()
+        # Il client (e l'SDK del provider) si crea alla prima chiamata; la
+        # chiave mancante però va segnalata subito, all'avvio
+        self._llm = llm
+        self._llm_lock = threading.Lock()
+        # Opzioni passate a ogni chiamata (es. response_format per l'output JSON)
+        self.llm_kwargs: Dict[str, Any] = {}
+        if llm is None:
+            self._check_api_key(self.provider)
+
+        context = self.config.get("context") or {}
+        self.context_mode = context.get("mode", "full")
+        if self.context_mode not in CONTEXT_MODES:
+            raise ValueError(f"Context mode {self.context_mode} non supportato")
+        self.context_max_turns = int(context.get("max_turns", 2))
+        self.context_max_tokens = int(context.get("max_tokens", 2000))
+        self.context_max_facts = int(context.get("max_facts", 50))
+        # Fatti riassunti dai turni più vecchi (dict usato come set ordinato)
+        self.context_facts: Dict[str, None] = {}
+
+        self.token_usage = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "last_prompt_tokens": 0,
+        }
+
+        cache = self.config.get("cache") or {}
+        self.response_cache: Optional[ResponseCache] = response_cache
+        if response_cache is None and cache.get("enabled"):
+            directory = (cache.get("disk") or {}).get("directory", "data/llm_cache")
+            self.response_cache = ResponseCache.from_config(
+                cache, directory=self._resolve_path(directory)
+            )
 
         if self.system_message:
             self.messages.append(SystemMessage(content=system))
 
     @staticmethod
-    def load_config() -> Dict[str, Any]:
+    def _resolve_path(path: str) -> str:
+        """Resolve a config path relative to the project root."""
+        if os.path.isabs(path):
+            return path
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        load_dotenv(os.path.join(project_root, ".env"))
-        config_path = os.path.join(project_root, "config", "config.yaml")
-        with open(config_path, "r") as file:
-            config = yaml.safe_load(file)
-        config["api_keys"] = {
-            "groq": os.getenv("GROQ_API_KEY"),
-            "openai": os.getenv("OPENAI_API_KEY"),
-        }
-        return config
+        return os.path.join(project_root, path)
+
+    @staticmethod
+    def load_config() -> Dict[str, Any]:
+        """The shared configuration (parsed once per process, do not modify)."""
+        return get_config()
+
+    @property
+    def llm(self) -> "BaseChatModel":
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    self._llm = self._initialize_llm()
+        return self._llm
+
+    def _check_api_key(self, provider: str) -> None:
+        if provider in ("groq", "openai") and not self.config["api_keys"][provider]:
+            raise ValueError(f"{provider.upper()}_API_KEY mancante")
+
+    def _initialize_llm(self) -> "BaseChatModel":
+        scheduler = self.config.get("scheduler") or {}
+        if not scheduler.get("enabled"):
+            return self._build_client(self.provider)
+
+        from agents.scheduler import ProviderScheduler
+
+        # Il provider scelto è il preferito, gli altri seguono l'ordine in config
+        names = [self.provider] + [
+            p for p in scheduler.get("providers", []) if p != self.provider
+        ]
+        llm = ProviderScheduler.from_config(
+            names,
+            self.config["providers"],
+            scheduler,
+            # I retry li gestisce lo scheduler, non il client del provider
+            lambda name: self._build_client(name, max_retries=0),
+        )
+        logger.info(f"Provider scheduler: {' -> '.join(llm.provider_names)}")
+        return llm
+
+    def _build_client(self, provider: str, **overrides: Any) -> "BaseChatModel":
+        # Gli SDK dei provider si importano solo per il provider scelto
+        options = self.config["providers"].get(provider) or {}
+        if provider == "groq":
+            self._check_api_key(provider)
+            from langchain_groq import ChatGroq
 
-    def _initialize_llm(self) -> BaseChatModel:
-        if self.provider == "groq":
-            if not self.config["api_keys"]["groq"]:
-                raise ValueError("GROQ_API_KEY mancante")
             return ChatGroq(
                 api_key=self.config["api_keys"]["groq"],
-                model_name=self.config["providers"]["groq"]["model"],
-                temperature=self.config["providers"]["groq"].get("temperature", 0),
+                model_name=options["model"],
+                temperature=options.get("temperature", 0),
+                **overrides,
             )
-        elif self.provider == "openai":
-            if not self.config["api_keys"]["openai"]:
-                raise ValueError("OPENAI_API_KEY mancante")
+        elif provider == "openai":
+            self._check_api_key(provider)
+            from langchain_openai import ChatOpenAI
+
             return ChatOpenAI(
                 api_key=self.config["api_keys"]["openai"],
-                model_name=self.config["providers"]["openai"]["model"],
-                temperature=self.config["providers"]["openai"].get("temperature", 0),
+                model_name=options["model"],
+                temperature=options.get("temperature", 0),
+                **overrides,
             )
+        elif provider == "fake":
+            # Provider locale deterministico, per benchmark e prove senza API key
+            from agents.fake_llm import FakeExtractionChatModel
+
+            return FakeExtractionChatModel(**options)
         else:
-            raise ValueError(f"Provider {self.provider} non supportato")
+            raise ValueError(f"Provider {provider} non supportato")
 
     def add_message(self, message: str, role: str = "human") -> None:
         if role == "human":
@@ -66,9 +160,194 @@ class LangChainAgent:
             self.messages.append(SystemMessage(content=message))
 
     def get_response(self) -> str:
-        response = self.llm.invoke(self.messages)
+        with STAGE_SECONDS.time(stage="prompt_build"):
+            context = self._build_context()
+        with STAGE_SECONDS.time(stage="llm_call"):
+            response = self.llm.invoke(context, **self.llm_kwargs)
+        self._record_usage(context, response)
         self.messages.append(AIMessage(content=response.content))
         return response.content
 
+    async def arespond(self, message: str) -> str:
+        """Async counterpart of add_message() + get_response() built on ainvoke.
+
+        The turn is appended to the history only once the reply arrives, so
+        concurrent calls never interleave a prompt with someone else's answer.
+        """
+        prompt = HumanMessage(content=message)
+        with STAGE_SECONDS.time(stage="prompt_build"):
+            context = self._build_context(prompt)
+        with STAGE_SECONDS.time(stage="llm_call"):
+            response = await self.llm.ainvoke(context, **self.llm_kwargs)
+        self._record_usage(context, response)
+        self.messages.extend([prompt, AIMessage(content=response.content)])
+        return response.content
+
+    def stream_response(self) -> Iterator[str]:
+        """Streaming counterpart of get_response(): yield the reply as it is generated.
+
+        The full reply is appended to the history (and its usage recorded)
+        once the stream is exhausted.
+        """
+        with STAGE_SECONDS.time(stage="prompt_build"):
+            context = self._build_context()
+        response = None
+        with STAGE_SECONDS.time(stage="llm_call"):
+            for chunk in self.llm.stream(context, **self.llm_kwargs):
+                response = chunk if response is None else response + chunk
+                if chunk.content:
+                    yield chunk.content
+        content = response.content if response is not None else ""
+        self._record_usage(context, response)
+        self.messages.append(AIMessage(content=content))
+
+    async def astream_respond(self, message: str) -> AsyncIterator[str]:
+        """Streaming counterpart of arespond(), built on astream."""
+        prompt = HumanMessage(content=message)
+        with STAGE_SECONDS.time(stage="prompt_build"):
+            context = self._build_context(prompt)
+        response = None
+        with STAGE_SECONDS.time(stage="llm_call"):
+            async for chunk in self.llm.astream(context, **self.llm_kwargs):
+                response = chunk if response is None else response + chunk
+                if chunk.content:
+                    yield chunk.content
+        content = response.content if response is not None else ""
+        self._record_usage(context, response)
+        self.messages.extend([prompt, AIMessage(content=content)])
+
+    def response_cache_key(self, content: str) -> str:
+        """Cache key for a request whose variable part is `content`."""
+        settings = self.config["providers"].get(self.provider, {})
+        return cache_key(
+            self.provider,
+            settings.get("model", ""),
+            settings.get("temperature", 0),
+            self.system_message,
+            content,
+        )
+
     def get_conversation_history(self) -> list:
         return [{"role": msg.type, "content": msg.content} for msg in self.messages]
+
+    def get_token_usage(self) -> Dict[str, Any]:
+        """Return cumulative token counters for the LLM calls made so far."""
+        return {"context_mode": self.context_mode, **self.token_usage}
+
+    def reset_context(self) -> None:
+        """Drop the conversation turns and the folded facts, keeping the system prompt."""
+        self.messages = self.messages[: self._system_offset()]
+        self.context_facts = {}
+
+    def extract_context_facts(self, turn: List[BaseMessage]) -> List[str]:
+        """Summarize a turn that is being dropped from the context.
+
+        Subclasses override this to keep the useful part of old turns as
+        compact one-line facts; the default keeps nothing.
+        """
+        return []
+
+    def _system_offset(self) -> int:
+        return 1 if self.system_message else 0
+
+    def _split_turns(self, history: List[BaseMessage]) -> List[List[BaseMessage]]:
+        """Group the history into turns, each starting with a human message."""
+        turns: List[List[BaseMessage]] = []
+        for msg in history:
+            if isinstance(msg, HumanMessage) or not turns:
+                turns.append([msg])
+            else:
+                turns[-1].append(msg)
+        return turns
+
+    def _compact_history(self, pending: Optional[HumanMessage] = None) -> None:
+        """Apply the context policy, dropping (or folding) turns out of self.messages.
+
+        `pending` is a prompt not yet in the history (async calls append it
+        only with the reply): it counts as the current turn, as in the sync
+        path, but is not added to self.messages.
+        """
+        if self.context_mode == "full":
+            return
+
+        offset = self._system_offset()
+        turns = self._split_turns(self.messages[offset:])
+        if pending is not None:
+            turns.append([pending])
+
+        if self.context_mode == "stateless":
+            kept = turns[-1:]
+        elif self.context_mode == "window":
+            kept = turns[-(self.context_max_turns + 1) :]
+        else:
+            kept = list(turns)
+            while len(kept) > 1 and self._context_tokens(kept) > self.context_max_tokens:
+                self._fold_turn(kept.pop(0))
+
+        if pending is not None:
+            kept.pop()
+        self.messages = self.messages[:offset] + [msg for turn in kept for msg in turn]
+
+    def _context_tokens(self, turns: List[List[BaseMessage]]) -> int:
+        system = self.messages[: self._system_offset()] + self._facts_messages()
+        return estimate_tokens(system) + sum(estimate_tokens(turn) for turn in turns)
+
+    def _fold_turn(self, turn: List[BaseMessage]) -> None:
+        for fact in self.extract_context_facts(turn):
+            self.context_facts.pop(fact, None)
+            self.context_facts[fact] = None
+        while len(self.context_facts) > self.context_max_facts:
+            del self.context_facts[next(iter(self.context_facts))]
+
+    def _facts_messages(self) -> List[BaseMessage]:
+        if not self.context_facts:
+            return []
+        facts = "\n".join(f"- {fact}" for fact in self.context_facts)
+        return [SystemMessage(content=f"Known graph facts:\n{facts}")]
+
+    def _build_context(self, pending: Optional[HumanMessage] = None) -> List[BaseMessage]:
+        """Return the messages to send to the model for the next call.
+
+        With `pending`, the context ends with that prompt (see _compact_history).
+        """
+        self._compact_history(pending)
+        offset = self._system_offset()
+        return (
+            self.messages[:offset]
+            + self._facts_messages()
+            + self.messages[offset:]
+            + ([pending] if pending is not None else [])
+        )
+
+    def _record_usage(self, context: List[BaseMessage], response: Any) -> None:
+        estimated = estimate_tokens(context)
+        usage = getattr(response, "usage_metadata", None) or {}
+        token_usage = (getattr(response, "response_metadata", None) or {}).get(
+            "token_usage"
+        ) or {}
+        prompt_tokens = usage.get("input_tokens") or token_usage.get(
+            "prompt_tokens", estimated
+        )
+        completion_tokens = usage.get("output_tokens") or token_usage.get(
+            "completion_tokens", 0
+        )
+
+        self.token_usage["calls"] += 1
+        self.token_usage["prompt_tokens"] += prompt_tokens
+        self.token_usage["completion_tokens"] += completion_tokens
+        self.token_usage["last_prompt_tokens"] = prompt_tokens
+        # Con lo scheduler la risposta indica quale provider ha risposto davvero
+        provider = (getattr(response, "response_metadata", None) or {}).get(
+            "provider", self.provider
+        )
+        LLM_CALLS.inc(provider=provider)
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, provider=provider, kind="completion")
+        logger.debug(
+            "LLM call %d: prompt_tokens=%d (estimated %d, %d messages, context_mode=%s)",
+            self.token_usage["calls"],
+            prompt_tokens,
+            estimated,
+            len(context),
+            self.context_mode,
+        )
@@ -1,47 +1,66 @@
-from typing import Dict, List, Optional, Set, Tuple
-from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
 from agents.base_agent import LangChainAgent
+from agents.entity_resolution import EntityResolver
+from agents.graph_store import GraphStore, decode_cursor, encode_cursor
+from agents.llm_cache import ResponseCache
+from agents.metrics import (
+    GRAPH_ITEMS_SERVED,
+    GRAPH_VIEW_CACHE,
+    MESSAGES_PROCESSED,
+    STAGE_SECONDS,
+    timed,
+)
+from agents.models import Entity, Relation, from_micros, get_utc_now, to_micros
+from agents.persistence import GraphJournal
+from agents.retention import RetentionPolicy
+from agents.response_parser import (
+    OUTPUT_FORMATS,
+    decode_json_reply,
+    parse_extraction,
+    parse_json_extraction,
+    stream_parser,
+)
+from agents.rollups import BUCKETS
+from agents.triage import PASS, MessageTriage, TriageDecision
+from langchain_core.messages import AIMessage, BaseMessage
 import logging
 from datetime import datetime, timedelta, timezone
+import asyncio
+import json
 import re
+from dataclasses import replace
+import threading
+import time
 
-# Configurazione del logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
-
-
-def get_utc_now() -> datetime:
-    """Helper function to get current UTC time."""
-    return datetime.now(timezone.utc)
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
 
+logger = logging.getLogger(__name__)
 
-@dataclass(frozen=True)
-class Entity:
-    name: str
-    type: str
-    attributes: Dict[str, str] = field(default_factory=dict)
-    timestamp: datetime = field(default_factory=get_utc_now)
-
-    def __hash__(self):
-        return hash((self.name, self.type))
-
-    def __eq__(self, other):
-        if not isinstance(other, Entity):
-            return NotImplemented
-        return self.name == other.name and self.type == other.type
+# Formati di get_graph_data (msgpack è una codifica del backend sopra "columnar")
+GRAPH_FORMATS = ("json", "columnar")
 
+# Intestazione di sezione nelle risposte in modalità batch ("### MESSAGE 3")
+BATCH_SECTION_RE = re.compile(r"^\s*#+\s*MESSAGE\s+(\d+)\s*:?\s*$", re.MULTILINE)
 
-@dataclass
-class Relation:
-    source: str
-    target: str
-    type: str
-    weight: float = 1.0
-    timestamp: datetime = field(default_factory=get_utc_now)
+# Formato di output della modalità JSON: sostituisce quello ENTITIES/RELATIONS
+# nel system prompt. Chiavi corte e relazioni per indice riducono i token generati
+JSON_OUTPUT_FORMAT = """Output must be a single JSON object in this exact compact format:
+        {"e": [{"n": "entity_name", "t": "entity_type", "a": {"key1": "value1"}}],
+         "r": [{"s": 0, "o": 1, "t": "relationship_type", "w": 0.8}]}
+        "e" lists the entities, the sender included. In "r", "s" and "o" are the
+        positions (counting from 0) of the source and target entities in "e".
+        """
 
 
 class EntityExtractionAgent(LangChainAgent):
-    def __init__(self):
+    def __init__(
+        self,
+        provider: Optional[str] = None,
+        config: Optional[Dict] = None,
+        llm: Optional["BaseChatModel"] = None,
+        response_cache: Optional[ResponseCache] = None,
+    ):
         system_prompt = """You are an expert at analyzing conversations and extracting a person-centered knowledge graph. Your goal is to build a rich network of information around the person sending the message, including their interests, skills, knowledge, and connections.
 
         Follow these rules:
@@ -104,25 +123,516 @@ class EntityExtractionAgent(LangChainAgent):
           weight: 0.8
         """
 
-        super().__init__(provider="groq", system=system_prompt)
-        self.entities: Dict[str, Entity] = {}
-        self.relations: List[Relation] = []
+        config = config or self.load_config()
+        settings = config.get("agent") or {}
+        provider = provider or settings.get("provider", "groq")
+        output_format = settings.get("output_format", "text")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Output format {output_format} non supportato")
+        if output_format == "json":
+            system_prompt = system_prompt.split("Output must be")[0] + JSON_OUTPUT_FORMAT
+        super().__init__(
+            provider=provider,
+            system=system_prompt,
+            config=config,
+            llm=llm,
+            response_cache=response_cache,
+        )
+        # Con lo streaming ogni blocco viene unito al grafo appena è completo
+        self.streaming = bool(settings.get("streaming", False))
+        self.output_format = output_format
+        if output_format == "json":
+            # JSON mode del provider: la risposta è sempre un oggetto JSON valido
+            self.llm_kwargs = {"response_format": {"type": "json_object"}}
+        batch = self.config.get("batch") or {}
+        self.batch_max_messages = batch.get("max_messages", 20)
+        self.batch_max_prompt_tokens = batch.get("max_prompt_tokens", 3000)
+        self.batch_size = self.batch_max_messages
+
+        graph_settings = self.config.get("graph_settings") or {}
+        relations = graph_settings.get("relations") or {}
+        retention = graph_settings.get("retention") or {}
+        self.graph = GraphStore(
+            aggregate=relations.get("aggregate", "mean"),
+            decay_alpha=relations.get("decay_alpha", 0.3),
+            retention=(
+                RetentionPolicy.from_config(retention)
+                if retention.get("enabled")
+                else None
+            ),
+            history=graph_settings.get("history"),
+        )
+        persistence = self.config.get("persistence") or {}
+        if persistence.get("enabled"):
+            self.graph.attach_journal(
+                GraphJournal(
+                    self._resolve_path(persistence.get("directory", "data/graph")),
+                    snapshot_every=persistence.get("snapshot_every", 10000),
+                    fsync=persistence.get("fsync", False),
+                )
+            )
+        # Serializza le modifiche al grafo quando più estrazioni girano in parallelo
+        self._graph_lock = threading.Lock()
+
+        resolution = self.config.get("entity_resolution") or {}
+        self.resolver: Optional[EntityResolver] = None
+        if resolution.get("enabled"):
+            self.resolver = EntityResolver.from_config(resolution)
+            self.resolver.rebuild(self.graph.entities)
+
+        triage = self.config.get("triage") or {}
+        self.triage: Optional[MessageTriage] = (
+            MessageTriage.from_config(triage) if triage.get("enabled") else None
+        )
+
+    @property
+    def entities(self) -> Mapping[str, Entity]:
+        return self.graph.entities
+
+    @property
+    def relations(self) -> List[Relation]:
+        return self.graph.relations
 
     def process_message(
         self, message: str, timestamp: Optional[datetime] = None
     ) -> Tuple[List[Entity], List[Relation]]:
         """Process a message and extract entities and relations, focusing on the sender."""
-        if timestamp is None:
-            timestamp = datetime.now(timezone.utc)
-        elif timestamp.tzinfo is None:
-            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        if self.streaming:
+            return self._collect(self.process_message_stream(message, timestamp))
+        timestamp = self._normalize_timestamp(timestamp)
 
         try:
             # Extract sender and message content
             sender, content = self._parse_message(message)
+            new_entities, new_relations = self._extract(sender, content, timestamp)
+            return self._merge_extraction(sender, timestamp, new_entities, new_relations)
+
+        except Exception as e:
+            logging.error(f"Error processing message: {str(e)}")
+            logging.error(f"Message: {message}")
+            logging.error(f"Timestamp: {timestamp}")
+            raise e
+
+    async def aprocess_message(
+        self, message: str, timestamp: Optional[datetime] = None
+    ) -> Tuple[List[Entity], List[Relation]]:
+        """Async version of process_message: the LLM call does not block the event loop.
+
+        Several calls can be in flight at once; only the final merge into the
+        graph is serialized.
+        """
+        if self.streaming:
+            return self._collect(
+                [item async for item in self.aprocess_message_stream(message, timestamp)]
+            )
+        timestamp = self._normalize_timestamp(timestamp)
+
+        try:
+            sender, content = self._parse_message(message)
+            new_entities, new_relations = await self._aextract(
+                sender, content, timestamp
+            )
+            return self._merge_extraction(sender, timestamp, new_entities, new_relations)
+
+        except Exception as e:
+            logging.error(f"Error processing message: {str(e)}")
+            logging.error(f"Message: {message}")
+            logging.error(f"Timestamp: {timestamp}")
+            raise e
+
+    def process_message_stream(
+        self, message: str, timestamp: Optional[datetime] = None
+    ) -> Iterator[Union[Entity, Relation]]:
+        """Stream the extraction of one message, merging each block as it arrives.
+
+        Yields every entity and every accepted relation right after it has
+        been merged into the graph, so callers can push partial results
+        before the model has finished answering.
+        """
+        timestamp = self._normalize_timestamp(timestamp)
+        sender, content = self._parse_message(message)
+        decision = self._triage_check(content)
+        if decision.skip:
+            self._merge_extraction(sender, timestamp, [], [])
+            return
+        cache_key = self.response_cache_key(f"{sender}: {content}")
+        response = self._cached_response(cache_key)
+        if response is not None:
+            chunks: Iterable[str] = [response]
+        else:
+            with STAGE_SECONDS.time(stage="prompt_build"):
+                prompt = self._build_analysis_prompt(sender, content)
+            self.add_message(prompt)
+            chunks = self.stream_response()
+
+        parser = stream_parser(self.output_format, timestamp)
+        clock = {"start": time.perf_counter()}
+        mentioned: Set[str] = set()
+        self._merge_parsed([self._sender_entity(sender, timestamp)], mentioned)
+        received = []
+        for chunk in chunks:
+            received.append(chunk)
+            yield from self._merge_parsed(parser.feed(chunk), mentioned, clock)
+        yield from self._merge_parsed(parser.close(), mentioned, clock)
+        self._store_response(cache_key, "".join(received))
+        self._record_audit(decision, sender, content, parser.entities)
+        MESSAGES_PROCESSED.inc()
+
+    async def aprocess_message_stream(
+        self, message: str, timestamp: Optional[datetime] = None
+    ) -> AsyncIterator[Union[Entity, Relation]]:
+        """Async version of process_message_stream, built on astream."""
+        timestamp = self._normalize_timestamp(timestamp)
+        sender, content = self._parse_message(message)
+        decision = self._triage_check(content)
+        if decision.skip:
+            self._merge_extraction(sender, timestamp, [], [])
+            return
+        cache_key = self.response_cache_key(f"{sender}: {content}")
+        response = self._cached_response(cache_key)
+
+        parser = stream_parser(self.output_format, timestamp)
+        clock = {"start": time.perf_counter()}
+        mentioned: Set[str] = set()
+        self._merge_parsed([self._sender_entity(sender, timestamp)], mentioned)
+        if response is not None:
+            for item in self._merge_parsed(parser.feed(response), mentioned, clock):
+                yield item
+        else:
+            with STAGE_SECONDS.time(stage="prompt_build"):
+                prompt = self._build_analysis_prompt(sender, content)
+            received = []
+            async for chunk in self.astream_respond(prompt):
+                received.append(chunk)
+                for item in self._merge_parsed(parser.feed(chunk), mentioned, clock):
+                    yield item
+            response = "".join(received)
+            self._store_response(cache_key, response)
+        for item in self._merge_parsed(parser.close(), mentioned, clock):
+            yield item
+        self._record_audit(decision, sender, content, parser.entities)
+        MESSAGES_PROCESSED.inc()
+
+    def _merge_parsed(
+        self,
+        items: List[Union[Entity, Relation]],
+        mentioned: Set[str],
+        clock: Optional[Dict] = None,
+    ) -> List[Union[Entity, Relation]]:
+        """Merge streamed blocks into the graph; return the ones accepted.
+
+        `mentioned` holds the entities of this message already merged, which
+        count once in the history rollups. `clock` records the time to the
+        first accepted block of a message.
+        """
+        if not items:
+            return []
+        accepted = []
+        with self._graph_lock:
+            version = self.graph.version
+            for item in items:
+                item = self._canonical(item)
+                if isinstance(item, Entity):
+                    self.graph.add_entity(item, mention=item.name not in mentioned)
+                    mentioned.add(item.name)
+                elif item.source in self.graph and item.target in self.graph:
+                    self.graph.add_relation(item)
+                else:
+                    continue
+                accepted.append(item)
+            self._commit_graph(version)
+        if clock is not None and accepted and "first_item" not in clock:
+            clock["first_item"] = time.perf_counter() - clock["start"]
+            STAGE_SECONDS.observe(clock["first_item"], stage="first_item")
+        return accepted
+
+    @staticmethod
+    def _collect(
+        items: Iterable[Union[Entity, Relation]]
+    ) -> Tuple[List[Entity], List[Relation]]:
+        entities, relations = [], []
+        for item in items:
+            (entities if isinstance(item, Entity) else relations).append(item)
+        return entities, relations
+
+    def process_messages(
+        self,
+        messages: List[str],
+        timestamps: Optional[List[Optional[datetime]]] = None,
+    ) -> List[Tuple[List[Entity], List[Relation]]]:
+        """Process many messages, packing several of them into each LLM call.
+
+        Returns one (entities, relations) pair per input message, in order.
+        Messages whose section cannot be found in the batched reply are
+        retried one at a time.
+        """
+        items = self._prepare_batch(messages, timestamps)
+        for batch in self._plan_batches([i for i in items if i["response"] is None]):
+            self.add_message(self._build_batch_prompt(batch))
+            self._attribute_batch(batch, self.get_response())
+        for item in items:
+            if item["response"] is None:
+                item["extraction"] = self._extract(
+                    item["sender"], item["content"], item["timestamp"], item["triage"]
+                )
+        return self._merge_batch(items)
+
+    async def aprocess_messages(
+        self,
+        messages: List[str],
+        timestamps: Optional[List[Optional[datetime]]] = None,
+    ) -> List[Tuple[List[Entity], List[Relation]]]:
+        """Async version of process_messages (batches are sent concurrently)."""
+        items = self._prepare_batch(messages, timestamps)
+        batches = self._plan_batches([i for i in items if i["response"] is None])
+        responses = await asyncio.gather(
+            *(self.arespond(self._build_batch_prompt(batch)) for batch in batches)
+        )
+        for batch, response in zip(batches, responses):
+            self._attribute_batch(batch, response)
+        fallbacks = [item for item in items if item["response"] is None]
+        extractions = await asyncio.gather(
+            *(
+                self._aextract(
+                    item["sender"], item["content"], item["timestamp"], item["triage"]
+                )
+                for item in fallbacks
+            )
+        )
+        for item, extraction in zip(fallbacks, extractions):
+            item["extraction"] = extraction
+        return self._merge_batch(items)
+
+    def _extract(
+        self,
+        sender: str,
+        content: str,
+        timestamp: datetime,
+        decision: Optional[TriageDecision] = None,
+    ) -> Tuple[List[Entity], List[Relation]]:
+        """Run (or fetch from cache) the extraction for one message, without merging.
+
+        Messages rejected by the triage return no entities without an LLM call.
+        """
+        decision = decision or self._triage_check(content)
+        if decision.skip:
+            return [], []
+        cache_key = self.response_cache_key(f"{sender}: {content}")
+        response = self._cached_response(cache_key)
+        if response is None:
+            with STAGE_SECONDS.time(stage="prompt_build"):
+                prompt = self._build_analysis_prompt(sender, content)
+            self.add_message(prompt)
+            response = self.get_response()
+            self._store_response(cache_key, response)
+        entities, relations = self._parse_response(response, timestamp)
+        self._record_audit(decision, sender, content, entities)
+        return entities, relations
+
+    async def _aextract(
+        self,
+        sender: str,
+        content: str,
+        timestamp: datetime,
+        decision: Optional[TriageDecision] = None,
+    ) -> Tuple[List[Entity], List[Relation]]:
+        decision = decision or self._triage_check(content)
+        response = await self.afetch_response(sender, content, decision)
+        if response is None:
+            return [], []
+        entities, relations = self._parse_response(response, timestamp)
+        self._record_audit(decision, sender, content, entities)
+        return entities, relations
+
+    async def afetch_response(
+        self, sender: str, content: str, decision: TriageDecision = PASS
+    ) -> Optional[str]:
+        """Raw extraction reply for one message (cache, then LLM), without parsing.
+
+        Returns None when the triage `decision` skips the message.
+        """
+        if decision.skip:
+            return None
+        cache_key = self.response_cache_key(f"{sender}: {content}")
+        response = self._cached_response(cache_key)
+        if response is None:
+            with STAGE_SECONDS.time(stage="prompt_build"):
+                prompt = self._build_analysis_prompt(sender, content)
+            response = await self.arespond(prompt)
+            self._store_response(cache_key, response)
+        return response
+
+    def _prepare_batch(
+        self,
+        messages: List[str],
+        timestamps: Optional[List[Optional[datetime]]],
+    ) -> List[Dict]:
+        timestamps = timestamps or [None] * len(messages)
+        items = []
+        for message, timestamp in zip(messages, timestamps):
+            sender, content = self._parse_message(message)
+            decision = self._triage_check(content)
+            cache_key = self.response_cache_key(f"{sender}: {content}")
+            items.append(
+                {
+                    "sender": sender,
+                    "content": content,
+                    "timestamp": self._normalize_timestamp(timestamp),
+                    "cache_key": cache_key,
+                    # Stringa vuota: scartato dal triage, nessuna chiamata LLM
+                    "response": "" if decision.skip else self._cached_response(cache_key),
+                    "extraction": ([], []) if decision.skip else None,
+                    "triage": decision,
+                }
+            )
+        return items
+
+    def _plan_batches(self, items: List[Dict]) -> List[List[Dict]]:
+        """Split items into batches that fit the token budget.
+
+        The batch size adapts to the model: it grows by one after every fully
+        attributed batch and halves after a batch that needed fallbacks.
+        """
+        batches: List[List[Dict]] = []
+        current: List[Dict] = []
+        tokens = 0
+        for item in items:
+            item_tokens = len(item["content"]) // 4 + 16
+            if current and (
+                len(current) >= self.batch_size
+                or tokens + item_tokens > self.batch_max_prompt_tokens
+            ):
+                batches.append(current)
+                current, tokens = [], 0
+            current.append(item)
+            tokens += item_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    @timed("prompt_build")
+    def _build_batch_prompt(self, batch: List[Dict]) -> str:
+        sections = "\n".join(
+            f'### MESSAGE {i}\nFrom {item["sender"]}: "{item["content"]}"'
+            for i, item in enumerate(batch, 1)
+        )
+        if self.output_format == "json":
+            return f"""Analyze each of the following {len(batch)} messages independently, focusing on each sender.
+            Answer with one JSON object whose keys are the message numbers ("1", "2", ...) and whose
+            values are the extraction for that message only, in the exact JSON format specified.
+            Include every message, even when it has no relevant entities.
+
+{sections}"""
+        return f"""Analyze each of the following {len(batch)} messages independently, focusing on each sender.
+            For every message write a section that starts with the line "### MESSAGE <number>",
+            followed by the ENTITIES and RELATIONS for that message only, in the exact YAML format specified.
+            Write a section for every message, even when it has no relevant entities.
+
+{sections}"""
+
+    def _attribute_batch(self, batch: List[Dict], response: str) -> None:
+        """Split a batched reply into per-message responses (missing ones stay None)."""
+        sections = self._batch_sections(response)
+        attributed = 0
+        for i, item in enumerate(batch, 1):
+            section = sections.get(i, "")
+            if self._is_extraction(section):
+                item["response"] = section
+                self._store_response(item["cache_key"], section)
+                attributed += 1
+
+        if attributed == len(batch):
+            self.batch_size = min(self.batch_size + 1, self.batch_max_messages)
+        else:
+            self.batch_size = max(1, self.batch_size // 2)
+        logger.info(
+            f"Batch of {len(batch)} messages: {attributed} attributed, "
+            f"{len(batch) - attributed} falling back to single calls"
+        )
 
-            # Create the analysis prompt
-            analysis_prompt = f"""Analyze this message from {sender}:
+    def _batch_sections(self, response: str) -> Dict[int, str]:
+        """Per-message sections of a batched reply, keyed by message number."""
+        if self.output_format == "json":
+            data = decode_json_reply(response)
+            if not isinstance(data, dict):
+                return {}
+            # Ogni sezione torna una risposta singola (è anche ciò che va in cache)
+            return {
+                int(key): json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+                for key, value in data.items()
+                if key.isdigit() and isinstance(value, dict)
+            }
+        sections = {}
+        matches = list(BATCH_SECTION_RE.finditer(response))
+        for match, following in zip(matches, matches[1:] + [None]):
+            end = following.start() if following else len(response)
+            sections[int(match.group(1))] = response[match.end() : end]
+        return sections
+
+    def _merge_batch(
+        self, items: List[Dict]
+    ) -> List[Tuple[List[Entity], List[Relation]]]:
+        results = []
+        for item in items:
+            if item["extraction"] is None:
+                item["extraction"] = self._parse_response(
+                    item["response"], item["timestamp"]
+                )
+                self._record_audit(
+                    item["triage"], item["sender"], item["content"], item["extraction"][0]
+                )
+            new_entities, new_relations = item["extraction"]
+            results.append(
+                self._merge_extraction(
+                    item["sender"], item["timestamp"], new_entities, new_relations
+                )
+            )
+        return results
+
+    def _triage_check(self, content: str) -> TriageDecision:
+        return self.triage.check(content) if self.triage is not None else PASS
+
+    def _record_audit(
+        self,
+        decision: TriageDecision,
+        sender: str,
+        content: str,
+        entities: List[Entity],
+    ) -> None:
+        """For audited messages, report what the triage would have thrown away."""
+        if decision.audit:
+            extracted = [e.name for e in entities if e.name != sender]
+            self.triage.record_audit(decision, f"{sender}: {content}", extracted)
+
+    def _cached_response(self, cache_key: str) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        response = self.response_cache.get(cache_key)
+        if response is not None:
+            logger.debug("Response cache hit, skipping LLM call")
+        return response
+
+    def _store_response(self, cache_key: str, response: str) -> None:
+        # Non memorizziamo risposte non valide: sarebbero errori da ripetere
+        if self.response_cache is not None and self._is_extraction(response):
+            self.response_cache.put(cache_key, response)
+
+    def _is_extraction(self, response: str) -> bool:
+        """Whether `response` is a well-formed reply in the output format."""
+        if self.output_format == "json":
+            return isinstance(decode_json_reply(response), dict)
+        return "ENTITIES:" in response
+
+    def _normalize_timestamp(self, timestamp: Optional[datetime]) -> datetime:
+        if timestamp is None:
+            return datetime.now(timezone.utc)
+        elif timestamp.tzinfo is None:
+            return timestamp.replace(tzinfo=timezone.utc)
+        return timestamp
+
+    def _build_analysis_prompt(self, sender: str, content: str) -> str:
+        """Create the analysis prompt for a single message."""
+        return f"""Analyze this message from {sender}:
             "{content}"
             
             Focus on understanding {sender}'s relationship with the topics, skills, and concepts mentioned.
@@ -134,42 +644,83 @@ class EntityExtractionAgent(LangChainAgent):
             3. What skills or expertise {sender} demonstrates
             4. How different topics or concepts connect through {sender}'s perspective
 
-            Remember to use the exact YAML format specified."""
-
-            self.add_message(analysis_prompt)
-            response = self.get_response()
-            new_entities, new_relations = self._parse_response(response, timestamp)
+            Remember to use the exact {"JSON" if self.output_format == "json" else "YAML"} format specified."""
 
+    @timed("merge")
+    def _merge_extraction(
+        self,
+        sender: str,
+        timestamp: datetime,
+        new_entities: List[Entity],
+        new_relations: List[Relation],
+    ) -> Tuple[List[Entity], List[Relation]]:
+        """Merge the parsed extraction into the graph (serialized across callers)."""
+        with self._graph_lock:
+            version = self.graph.version
             # Ensure the sender exists as an entity
-            sender_entity = Entity(
-                name=sender,
-                type="person",
-                attributes={"first_seen": timestamp.isoformat()},
-                timestamp=timestamp,
-            )
-            self.entities[sender] = sender_entity
+            sender_entity = self._canonical(self._sender_entity(sender, timestamp))
+            self.graph.add_entity(sender_entity)
 
-            # Update internal state
+            # Update internal state; an entity (e.g. the sender, which the
+            # extraction lists too) counts once per message in the rollups
+            mentioned = {sender_entity.name}
+            new_entities = [self._canonical(entity) for entity in new_entities]
             for entity in new_entities:
-                self.entities[entity.name] = entity
+                self.graph.add_entity(entity, mention=entity.name not in mentioned)
+                mentioned.add(entity.name)
 
             # Filter valid relations and add them
             valid_relations = []
             for relation in new_relations:
+                relation = self._canonical(relation)
                 if (
                     relation.source in self.entities
                     and relation.target in self.entities
                 ):
                     valid_relations.append(relation)
+                    self.graph.add_relation(relation)
 
-            self.relations.extend(valid_relations)
-            return new_entities, valid_relations
+            self._commit_graph(version)
+        MESSAGES_PROCESSED.inc()
+        return new_entities, valid_relations
 
-        except Exception as e:
-            logging.error(f"Error processing message: {str(e)}")
-            logging.error(f"Message: {message}")
-            logging.error(f"Timestamp: {timestamp}")
-            raise e
+    def _canonical(self, item: Union[Entity, Relation]) -> Union[Entity, Relation]:
+        """Rewrite the names of an entity or relation to their canonical form.
+
+        An entity's name is registered with the resolver; relation endpoints
+        are only looked up, so a relation to an unknown name is still
+        dropped by the caller.
+        """
+        if self.resolver is None:
+            return item
+        if isinstance(item, Entity):
+            name = self.resolver.resolve(item.name)
+            return item if name == item.name else replace(item, name=name)
+        source = self.resolver.lookup(item.source) or item.source
+        target = self.resolver.lookup(item.target) or item.target
+        if source == item.source and target == item.target:
+            return item
+        return replace(item, source=source, target=target)
+
+    @staticmethod
+    def _sender_entity(sender: str, timestamp: datetime) -> Entity:
+        return Entity(
+            name=sender,
+            type="person",
+            attributes={"first_seen": timestamp.isoformat()},
+            timestamp=timestamp,
+        )
+
+    def extract_context_facts(self, turn: List[BaseMessage]) -> List[str]:
+        """Fold an old turn into "known graph facts" lines for the context summary."""
+        facts = []
+        for msg in turn:
+            if not isinstance(msg, AIMessage):
+                continue
+            entities, relations = self._parse_response(msg.content, get_utc_now())
+            facts.extend(f"{e.name} ({e.type})" for e in entities)
+            facts.extend(f"{r.source} -{r.type}-> {r.target}" for r in relations)
+        return facts
 
     def _parse_message(self, message: str) -> Tuple[str, str]:
         """Extract sender and content from a message."""
@@ -182,86 +733,18 @@ class EntityExtractionAgent(LangChainAgent):
             logging.warning("No sender specified in message, using 'Unknown'")
             return "Unknown", message.strip()
 
+    @timed("parse")
     def _parse_response(
         self, response: str, timestamp: datetime
     ) -> Tuple[List[Entity], List[Relation]]:
-        """Parse the YAML response into Entity and Relation objects with the specified timestamp."""
+        """Parse the response into Entity and Relation objects with the specified timestamp."""
         try:
-            # Split response into entities and relations sections
-            if "ENTITIES:" not in response:
-                logging.warning("No ENTITIES section found in response")
-                return [], []
-
-            parts = response.split("ENTITIES:")
-            entities_section = (
-                parts[1].split("RELATIONS:")[0]
-                if "RELATIONS:" in response
-                else parts[1]
-            )
-            relations_section = (
-                response.split("RELATIONS:")[1] if "RELATIONS:" in response else ""
-            )
-
-            # Parse entities with explicit timestamp
-            entities = []
-            current_entity = {}
-            in_attributes = False
-
-            for line in entities_section.strip().split("\n"):
-                line = line.strip()
-                if not line:
-                    continue
-
-                if line.startswith("- name:"):
-                    if current_entity:
-                        entities.append(Entity(**current_entity, timestamp=timestamp))
-                    current_entity = {"attributes": {}}
-                    current_entity["name"] = line.split(":", 1)[1].strip()
-                    in_attributes = False
-                elif line.startswith("type:"):
-                    current_entity["type"] = line.split(":", 1)[1].strip()
-                elif line.startswith("attributes:"):
-                    in_attributes = True
-                elif in_attributes and ":" in line:
-                    key, value = [x.strip() for x in line.split(":", 1)]
-                    current_entity["attributes"][key] = value
-
-            if current_entity:
-                entities.append(Entity(**current_entity, timestamp=timestamp))
-
-            # Parse relations with explicit timestamp
-            relations = []
-            if relations_section:
-                current_relation = {}
-                for line in relations_section.strip().split("\n"):
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    if line.startswith("- source:"):
-                        if current_relation:
-                            relations.append(
-                                Relation(**current_relation, timestamp=timestamp)
-                            )
-                        current_relation = {}
-                        current_relation["source"] = line.split(":", 1)[1].strip()
-                    elif line.startswith("target:"):
-                        current_relation["target"] = line.split(":", 1)[1].strip()
-                    elif line.startswith("type:"):
-                        current_relation["type"] = line.split(":", 1)[1].strip()
-                    elif line.startswith("weight:"):
-                        try:
-                            current_relation["weight"] = float(
-                                line.split(":", 1)[1].strip()
-                            )
-                        except ValueError:
-                            current_relation["weight"] = 1.0
-
-                if current_relation:
-                    relations.append(Relation(**current_relation, timestamp=timestamp))
-
-            logging.info(
-                f"Parsed {len(entities)} entities and {len(relations)} relations"
+            if self.output_format == "json":
+                entities, relations = parse_json_extraction(response, timestamp)
+            else:
+                entities, relations = parse_extraction(response, timestamp)
+            logger.debug(
+                "Parsed %d entities and %d relations", len(entities), len(relations)
             )
             return entities, relations
 
@@ -270,84 +753,364 @@ class EntityExtractionAgent(LangChainAgent):
             logging.error(f"Response was:\n{response}")
             return [], []
 
-    def get_graph_data(self, time_filter: str = "now") -> Dict:
-        """Return the current graph state filtered by time."""
-        cutoff_time = self._get_cutoff_time(time_filter)
+    def get_graph_data(
+        self,
+        time_filter: str = "now",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        format: str = "json",
+        attributes: bool = True,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Dict:
+        """Return the current graph state filtered by time.
 
-        logging.debug(f"Filtering graph data with time_filter: {time_filter}")
-        logging.debug(f"Cutoff time: {cutoff_time}")
+        `start`/`end` select an arbitrary range (edges last seen in it, with
+        endpoints seen since `start`) and take precedence over `time_filter`.
 
-        # Filter entities and relations by timestamp
-        filtered_entities = {}
-        for name, entity in self.entities.items():
-            logging.debug(f"Entity {name} timestamp: {entity.timestamp}")
-            if entity.timestamp >= cutoff_time:
-                filtered_entities[name] = entity
-                logging.debug(f"Including entity {name}")
-            else:
-                logging.debug(f"Excluding entity {name} (too old)")
+        Only the relations inside the time window are visited (bisect on the
+        time index), and a node is returned only if it is an endpoint of a
+        returned edge.
+
+        With `limit` the edges are returned in pages: the reply carries a
+        "next_cursor" to pass back as `cursor` (None on the last page).
+        `format="columnar"` returns parallel arrays with a string table and
+        epoch-millisecond timestamps (see GraphStore.columns) instead of one
+        dict per node and edge; `attributes=False` leaves out node attributes.
 
-        filtered_relations = []
-        for relation in self.relations:
-            logging.debug(
-                f"Relation {relation.source}->{relation.target} timestamp: {relation.timestamp}"
+        Reads go to the store's current snapshot, never to the live columns,
+        so they need no lock and see a single version even while messages
+        are merged. An unpaged result is memoized on the snapshot and reused
+        until the next write, or until the time filter's cutoff passes its
+        oldest item. The returned dict must not be modified.
+        """
+        if format not in GRAPH_FORMATS:
+            raise ValueError(f"Formato {format} non supportato")
+        cutoff_time = start or self._get_cutoff_time(time_filter)
+        snapshot = self.graph.snapshot
+        memo_key = None
+        if cursor is None and limit is None and start is None and end is None:
+            memo_key = (time_filter, format, attributes)
+            cached = snapshot.views.get(memo_key)
+            # Il cutoff avanza col tempo: finché non supera l'elemento più vecchio
+            # del risultato, sulla stessa versione il risultato è identico
+            if cached is not None and (
+                cached[0] is None or cached[0] >= to_micros(cutoff_time)
+            ):
+                _, data, node_count, edge_count = cached
+                GRAPH_VIEW_CACHE.inc(result="hit")
+                GRAPH_ITEMS_SERVED.inc(node_count, kind="node")
+                GRAPH_ITEMS_SERVED.inc(edge_count, kind="edge")
+                return data
+            GRAPH_VIEW_CACHE.inc(result="miss")
+
+        after = decode_cursor(cursor) if cursor else None
+        with STAGE_SECONDS.time(stage="graph_filter"):
+            node_ids, edge_ids, next_page = snapshot.window_ids(
+                cutoff_time, after, limit, end
             )
-            if relation.timestamp >= cutoff_time:
-                filtered_relations.append(relation)
-                logging.debug(
-                    f"Including relation {relation.source}->{relation.target}"
-                )
+        with STAGE_SECONDS.time(stage="graph_serialize"):
+            if format == "columnar":
+                data = snapshot.columns(node_ids, edge_ids, attributes)
             else:
-                logging.debug(
-                    f"Excluding relation {relation.source}->{relation.target} (too old)"
-                )
+                nodes = [
+                    self._node_data(snapshot.entity_at(i), attributes)
+                    for i in node_ids
+                ]
+                edges = [self._edge_data(snapshot.relation_at(e)) for e in edge_ids]
+                data = {"nodes": nodes, "edges": edges}
+        GRAPH_ITEMS_SERVED.inc(len(node_ids), kind="node")
+        GRAPH_ITEMS_SERVED.inc(len(edge_ids), kind="edge")
 
-        # Only include nodes that have valid connections
-        used_entities = set()
-        for relation in filtered_relations:
-            if (
-                relation.source in filtered_entities
-                and relation.target in filtered_entities
-            ):
-                used_entities.add(relation.source)
-                used_entities.add(relation.target)
-
-        nodes = [
-            {
-                "id": e.name,
-                "name": e.name,
-                "type": e.type,
-                "attributes": e.attributes,
-                "timestamp": e.timestamp.isoformat(),
-            }
-            for e in filtered_entities.values()
-            if e.name in used_entities
-        ]
-
-        edges = [
-            {
-                "source": r.source,
-                "target": r.target,
-                "type": r.type,
-                "weight": r.weight,
-                "timestamp": r.timestamp.isoformat(),
-            }
-            for r in filtered_relations
-            if r.source in used_entities and r.target in used_entities
-        ]
+        # Il dettaglio per elemento si costruisce solo se il DEBUG è attivo
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Graph data for time_filter=%s (cutoff %s): %d nodes, %d edges",
+                time_filter,
+                cutoff_time,
+                len(node_ids),
+                len(edge_ids),
+            )
+            for i in node_ids:
+                logger.debug("node %s", snapshot.entity_at(i))
+            for e in edge_ids:
+                logger.debug("edge %s", snapshot.relation_at(e))
+        data["version"] = snapshot.version
+        if limit is not None:
+            data["next_cursor"] = encode_cursor(next_page)
+        if memo_key is not None:
+            snapshot.views[memo_key] = (
+                snapshot.oldest(node_ids, edge_ids), data, len(node_ids), len(edge_ids)
+            )
+        return data
+
+    def enforce_retention(self, max_steps: Optional[int] = None) -> int:
+        """Run retention steps outside of a write (e.g. from a background task).
+
+        Returns the number of entities and relations removed.
+        """
+        if self.graph.retention is None:
+            return 0
+        with self._graph_lock:
+            version = self.graph.version
+            removed = self.graph.evict(max_steps=max_steps)
+            self._commit_graph(version)
+        return removed
+
+    def _commit_graph(self, version: int) -> None:
+        """Commit the graph (under the graph lock) and drop from the resolver
+        the entities removed since `version`, e.g. evicted by retention."""
+        self.graph.commit()
+        if self.resolver is None:
+            return
+        removed, _ = self.graph.removals_since(version)
+        for name in removed:
+            if name not in self.graph:
+                self.resolver.forget(name)
+
+    def get_graph_delta(self, since: int, time_filter: str = "now") -> Dict:
+        """Return the nodes and edges added, updated or removed after version `since`.
+
+        The cost is proportional to the number of changes, not to the graph
+        size. When the change log no longer covers `since` the full graph is
+        returned with "full": true, and the client should replace its state.
+        Otherwise "removed_nodes" (names) and "removed_edges" (source, target,
+        type) list what was deleted; clients apply them before the upserts.
+        """
+        cutoff_time = self._get_cutoff_time(time_filter)
+        version = self.graph.version
+        changes = self.graph.changes_since(since)
+        if changes is None:
+            return {**self.get_graph_data(time_filter), "since": since, "full": True}
+
+        changed_entities, changed_relations = changes
+        removed_nodes, removed_edges = self.graph.removals_since(since)
+        entities = self.graph.entities
+        nodes = {
+            e.name: e
+            for e in changed_entities
+            if e.timestamp >= cutoff_time and self.graph.degree(e.name)
+        }
+        edges = []
+        for r in changed_relations:
+            if r.timestamp < cutoff_time:
+                continue
+            endpoints = [nodes.get(n) or entities.get(n) for n in (r.source, r.target)]
+            if any(e is None or e.timestamp < cutoff_time for e in endpoints):
+                continue
+            edges.append(self._edge_data(r))
+            for e in endpoints:
+                nodes[e.name] = e
 
-        logging.info(f"Returning {len(nodes)} nodes and {len(edges)} edges")
         return {
+            "nodes": [self._node_data(e) for e in nodes.values()],
+            "edges": edges,
+            "removed_nodes": removed_nodes,
+            "removed_edges": [
+                {"source": s, "target": t, "type": ty} for s, t, ty in removed_edges
+            ],
+            "version": version,
+            "since": since,
+            "full": False,
+        }
+
+    def get_history(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        bucket: str = "hour",
+        entity_type: Optional[str] = None,
+        relation_type: Optional[str] = None,
+        edge: Optional[Tuple[str, str, str]] = None,
+    ) -> Dict:
+        """Activity per time bucket, answered from the store's rollups.
+
+        `end` defaults to now and `start` to 24 buckets before `end`.
+        """
+        end = end or datetime.now(timezone.utc)
+        if start is None:
+            start = end - 24 * timedelta(microseconds=BUCKETS.get(bucket, 0))
+        with STAGE_SECONDS.time(stage="graph_filter"):
+            buckets = self.graph.history(
+                start, end, bucket, entity_type, relation_type, edge
+            )
+        for item in buckets:
+            item["start"] = from_micros(item["start"]).isoformat()
+        return {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "bucket": bucket,
+            "buckets": buckets,
+            "version": self.graph.version,
+        }
+
+    def get_neighbors(
+        self,
+        name: str,
+        depth: int = 1,
+        min_weight: float = 0.0,
+        limit: Optional[int] = None,
+        direction: str = "both",
+        time_filter: Optional[str] = None,
+    ) -> Optional[Dict]:
+        """Return the k-hop neighborhood of an entity (None if it does not exist).
+
+        The cost depends on the edges of the visited nodes, not on the size
+        of the graph.
+        """
+        cutoff_time = self._get_cutoff_time(time_filter) if time_filter else None
+        version = self.graph.version
+        with STAGE_SECONDS.time(stage="graph_filter"):
+            result = self.graph.neighbors(
+                name, depth, min_weight, limit, direction, cutoff_time
+            )
+        if result is None:
+            return None
+        entities, relations = result
+        with STAGE_SECONDS.time(stage="graph_serialize"):
+            nodes = [self._node_data(e) for e in entities]
+            edges = [self._edge_data(r) for r in relations]
+        GRAPH_ITEMS_SERVED.inc(len(nodes), kind="node")
+        GRAPH_ITEMS_SERVED.inc(len(edges), kind="edge")
+        return {"center": name, "nodes": nodes, "edges": edges, "version": version}
+
+    def get_top(
+        self,
+        relation_type: Optional[str] = None,
+        entity_type: Optional[str] = None,
+        source: Optional[str] = None,
+        target: Optional[str] = None,
+        limit: int = 20,
+        min_weight: float = 0.0,
+        time_filter: Optional[str] = None,
+    ) -> Dict:
+        """Return the strongest relations, or the most connected entities.
+
+        With `entity_type` the result is the entities of that type ranked by
+        degree; otherwise it is the relations (optionally of one type, from
+        `source` and/or to `target`) ranked by weight, with their endpoints.
+        """
+        version = self.graph.version
+        if entity_type is not None:
+            ranked = self.graph.top_entities(entity_type, limit)
+            nodes = [{**self._node_data(e), "degree": d} for e, d in ranked]
+            GRAPH_ITEMS_SERVED.inc(len(nodes), kind="node")
+            return {"nodes": nodes, "edges": [], "version": version}
+
+        cutoff_time = self._get_cutoff_time(time_filter) if time_filter else None
+        with STAGE_SECONDS.time(stage="graph_filter"):
+            relations = self.graph.top_relations(
+                relation_type, source, target, limit, min_weight, cutoff_time
+            )
+        entities = self.graph.entities
+        names = dict.fromkeys(n for r in relations for n in (r.source, r.target))
+        nodes = [self._node_data(entities[n]) for n in names]
+        edges = [self._edge_data(r) for r in relations]
+        GRAPH_ITEMS_SERVED.inc(len(nodes), kind="node")
+        GRAPH_ITEMS_SERVED.inc(len(edges), kind="edge")
+        return {"nodes": nodes, "edges": edges, "version": version}
+
+    def get_graph_lod(
+        self,
+        center: Optional[str] = None,
+        max_nodes: int = 200,
+        rank: str = "degree",
+        depth: int = 2,
+        min_weight: float = 0.0,
+        time_filter: Optional[str] = None,
+    ) -> Optional[Dict]:
+        """Return a bounded view of the graph for rendering (None if `center` does not exist).
+
+        At most `max_nodes` entities, the most central ones around `center`
+        (or overall), each with its `score`. The neighbors left out are
+        shown as one "N more <type>" cluster node per entity and type,
+        linked to it by a `cluster` edge.
+        """
+        cutoff_time = self._get_cutoff_time(time_filter) if time_filter else None
+        version = self.graph.version
+        with STAGE_SECONDS.time(stage="graph_filter"):
+            result = self.graph.lod(
+                center, max_nodes, rank, depth, min_weight, cutoff_time
+            )
+        if result is None:
+            return None
+        ranked, relations, clusters = result
+        with STAGE_SECONDS.time(stage="graph_serialize"):
+            nodes = [{**self._node_data(e), "score": score} for e, score in ranked]
+            edges = [self._edge_data(r) for r in relations]
+            for owner, type, count, weight in clusters:
+                cluster_id = f"{owner}::more::{type}"
+                nodes.append({
+                    "id": cluster_id,
+                    "name": f"{count} more {self._plural(type, count)}",
+                    "type": type,
+                    "cluster": True,
+                    "count": count,
+                    "parent": owner,
+                })
+                edges.append({
+                    "source": owner,
+                    "target": cluster_id,
+                    "type": "cluster",
+                    "weight": weight,
+                    "count": count,
+                })
+        GRAPH_ITEMS_SERVED.inc(len(nodes), kind="node")
+        GRAPH_ITEMS_SERVED.inc(len(edges), kind="edge")
+        return {
+            "center": center,
+            "rank": rank,
             "nodes": nodes,
             "edges": edges,
+            "hidden": sum(c[2] for c in clusters),
+            "version": version,
+        }
+
+    @staticmethod
+    def _plural(word: str, count: int) -> str:
+        if count == 1 or word.endswith("s"):
+            return word
+        if word.endswith("y") and word[-2:-1] not in "aeiou":
+            return word[:-1] + "ies"
+        return word + "s"
+
+    @staticmethod
+    def _node_data(e: Entity, attributes: bool = True) -> Dict:
+        data = {"id": e.name, "name": e.name, "type": e.type}
+        if attributes:
+            data["attributes"] = e.attributes
+        data["timestamp"] = e.timestamp.isoformat()
+        return data
+
+    @staticmethod
+    def _edge_data(r: Relation) -> Dict:
+        return {
+            "source": r.source,
+            "target": r.target,
+            "type": r.type,
+            "weight": r.weight,
+            "count": r.count,
+            "first_seen": r.first_seen.isoformat(),
+            "timestamp": r.timestamp.isoformat(),
         }
 
     def reset(self):
         """Reset the agent's state."""
-        self.entities = {}
-        self.relations = []
+        with self._graph_lock:
+            self.graph.clear()
+            if self.resolver is not None:
+                self.resolver.clear()
+        self.reset_context()
         logger.info("Agent state reset")
 
+    def close(self):
+        """Write a final snapshot and close the journal, if persistence is on."""
+        journal = self.graph.journal
+        if journal is not None:
+            with self._graph_lock:
+                journal.snapshot(self.graph)
+                journal.close()
+
     def _get_cutoff_time(self, time_filter: str) -> datetime:
         """Calculate cutoff time based on filter."""
         now = datetime.now(timezone.utc)
@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import random
+import re
+import struct
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Separatori trattati come spazi: "machine_learning" e "machine-learning" coincidono
+SEPARATORS_RE = re.compile(r"[\s_\-/.]+")
+# Punteggiatura e virgolette ai bordi del nome ("Python!", "'Rust'")
+EDGE_PUNCTUATION = "\"'`«»“”‘’.,;:!?()[]{}"
+
+MERSENNE = (1 << 61) - 1
+
+
+def normalize_name(name: str, drop_tokens: Iterable[str] = ()) -> str:
+    """Normalized key of an entity name.
+
+    NFKC, case folding, accents removed, separators collapsed to single
+    spaces, edge punctuation stripped, and `drop_tokens` (generic words like
+    "programming") removed unless they are the whole name.
+    """
+    text = unicodedata.normalize("NFKD", name.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = unicodedata.normalize("NFKC", text)
+    tokens = SEPARATORS_RE.sub(" ", text).strip().strip(EDGE_PUNCTUATION).split()
+    kept = [t for t in tokens if t not in drop_tokens]
+    return " ".join(kept or tokens)
+
+
+def shingles(key: str, n: int = 3) -> Set[str]:
+    padded = f" {key} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i : i + n] for i in range(len(padded) - n + 1)}
+
+
+class MinHashLSH:
+    """MinHash signatures over character n-grams, bucketed by bands.
+
+    Two keys share a bucket (and become candidates) with high probability
+    when their n-gram Jaccard similarity is above roughly
+    (1 / bands) ** (1 / rows); the caller verifies candidates exactly.
+    """
+
+    def __init__(self, num_perm: int = 30, bands: int = 10, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm deve essere un multiplo di bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Permutazioni (a * h + b) mod p con parametri fissi: firme stabili tra riavvii
+        rng = random.Random(seed)
+        self._a = [rng.randrange(1, MERSENNE) for _ in range(num_perm)]
+        self._b = [rng.randrange(0, MERSENNE) for _ in range(num_perm)]
+        self._buckets: Dict[bytes, Set[str]] = {}
+
+    def signature(self, grams: Set[str]) -> List[int]:
+        hashes = [
+            struct.unpack("<Q", hashlib.blake2b(g.encode(), digest_size=8).digest())[0]
+            for g in grams
+        ]
+        return [
+            min((a * h + b) % MERSENNE for h in hashes)
+            for a, b in zip(self._a, self._b)
+        ]
+
+    def _band_keys(self, signature: List[int]) -> List[bytes]:
+        rows = self.rows
+        return [
+            struct.pack(f"<H{rows}Q", band, *signature[band * rows : (band + 1) * rows])
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: str, signature: List[int]) -> None:
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: str, signature: List[int]) -> None:
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def candidates(self, signature: List[int]) -> Set[str]:
+        found: Set[str] = set()
+        for band_key in self._band_keys(signature):
+            found |= self._buckets.get(band_key, set())
+        return found
+
+
+class EntityResolver:
+    """Maps every surface form of an entity name to one canonical name.
+
+    Lookups go through two dicts: the exact surface form seen before, then
+    the normalized key (see normalize_name), so "Python", "python " and
+    "PYTHON" resolve in O(1) to the first spelling seen. With `fuzzy`, a
+    key with no exact match is compared only with the candidates that share
+    a MinHash LSH bucket, and merged into the most similar one if their
+    n-gram Jaccard similarity is at least `threshold`.
+
+    The canonical names are the node names in the graph, so the index can
+    be rebuilt from the graph after a restart, and a node removed from the
+    graph is dropped with forget().
+    """
+
+    def __init__(
+        self,
+        drop_tokens: Iterable[str] = (),
+        aliases: Optional[Dict[str, str]] = None,
+        fuzzy: bool = False,
+        threshold: float = 0.8,
+        num_perm: int = 30,
+        bands: int = 10,
+        ngram: int = 3,
+    ):
+        self.drop_tokens = frozenset(t.casefold() for t in drop_tokens)
+        self.fuzzy = fuzzy
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.ngram = ngram
+        # Alias fissati da configurazione, ripristinati a ogni clear() e forget()
+        self.fixed_aliases = dict(aliases or {})
+        self.clear()
+
+    @classmethod
+    def from_config(cls, settings: Dict[str, Any]) -> "EntityResolver":
+        fuzzy = settings.get("fuzzy") or {}
+        return cls(
+            drop_tokens=settings.get("drop_tokens") or (),
+            aliases=settings.get("aliases"),
+            fuzzy=bool(fuzzy.get("enabled", False)),
+            threshold=fuzzy.get("threshold", 0.8),
+            num_perm=fuzzy.get("num_perm", 30),
+            bands=fuzzy.get("bands", 10),
+            ngram=fuzzy.get("ngram", 3),
+        )
+
+    def clear(self) -> None:
+        self.aliases: Dict[str, str] = {}  # forma di superficie -> nome canonico
+        self.keys: Dict[str, str] = {}  # chiave normalizzata -> nome canonico
+        self._grams: Dict[str, Set[str]] = {}  # chiave -> n-grammi (solo fuzzy)
+        self._lsh = MinHashLSH(self.num_perm, self.bands) if self.fuzzy else None
+        # Indici inversi per forget(): nome canonico -> forme e chiavi che lo risolvono
+        self._forms: Dict[str, Set[str]] = {}
+        self._keys_of: Dict[str, Set[str]] = {}
+        self.counters = {"exact": 0, "normalized": 0, "fuzzy": 0, "new": 0}
+        for name, canonical in self.fixed_aliases.items():
+            self.alias(name, canonical)
+
+    def rebuild(self, names: Iterable[str]) -> None:
+        """Index existing canonical names (e.g. the nodes of a loaded graph).
+
+        Names are taken in order, so of two stored variants the first one
+        becomes canonical for new mentions; existing nodes are not merged.
+        """
+        self.clear()
+        for name in names:
+            self.resolve(name)
+        self.counters = dict.fromkeys(self.counters, 0)
+
+    def lookup(self, name: str) -> Optional[str]:
+        """Canonical name for `name` if it is already known, without registering it."""
+        canonical = self.aliases.get(name)
+        if canonical is not None:
+            return canonical
+        key = normalize_name(name, self.drop_tokens)
+        canonical = self.keys.get(key)
+        if canonical is None and self._lsh is not None:
+            canonical = self._fuzzy_match(key, shingles(key, self.ngram))
+        return canonical
+
+    def resolve(self, name: str) -> str:
+        """Canonical name for `name`, making it canonical if it is new."""
+        canonical = self.aliases.get(name)
+        if canonical is not None:
+            self.counters["exact"] += 1
+            return canonical
+
+        key = normalize_name(name, self.drop_tokens)
+        canonical = self.keys.get(key)
+        if canonical is not None:
+            self.counters["normalized"] += 1
+        elif self._lsh is not None:
+            grams = shingles(key, self.ngram)
+            canonical = self._fuzzy_match(key, grams)
+            if canonical is not None:
+                self.counters["fuzzy"] += 1
+                logger.debug("Fuzzy match %r -> %r", name, canonical)
+            else:
+                self._index_key(key, grams)
+            self._set_key(key, canonical or name)
+        else:
+            self._set_key(key, name)
+
+        if canonical is None:
+            self.counters["new"] += 1
+            canonical = name
+        self._set_alias(name, canonical)
+        return canonical
+
+    def alias(self, name: str, canonical: str) -> None:
+        """Force `name` (and its normalized key) to resolve to `canonical`."""
+        self._set_alias(name, canonical)
+        self._set_key(normalize_name(name, self.drop_tokens), canonical)
+
+    def forget(self, canonical: str) -> None:
+        """Drop the forms, keys and LSH entries resolving to `canonical`.
+
+        Called when the node leaves the graph (e.g. evicted by retention), so
+        the index does not outgrow it; configured aliases are kept.
+        """
+        for name in self._forms.pop(canonical, ()):
+            if self.aliases.get(name) == canonical:
+                del self.aliases[name]
+        for key in self._keys_of.pop(canonical, ()):
+            if self.keys.get(key) != canonical:
+                continue
+            del self.keys[key]
+            grams = self._grams.pop(key, None)
+            if grams is not None:
+                self._lsh.remove(key, self._lsh.signature(grams))
+        for name, target in self.fixed_aliases.items():
+            if target == canonical:
+                self.alias(name, target)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "canonical": len(set(self.keys.values())),
+            "aliases": len(self.aliases),
+            "fuzzy": self.fuzzy,
+            **self.counters,
+        }
+
+    def _set_alias(self, name: str, canonical: str) -> None:
+        self.aliases[name] = canonical
+        self._forms.setdefault(canonical, set()).add(name)
+
+    def _set_key(self, key: str, canonical: str) -> None:
+        self.keys[key] = canonical
+        self._keys_of.setdefault(canonical, set()).add(key)
+
+    def _index_key(self, key: str, grams: Set[str]) -> None:
+        self._grams[key] = grams
+        self._lsh.add(key, self._lsh.signature(grams))
+
+    def _fuzzy_match(self, key: str, grams: Set[str]) -> Optional[str]:
+        best, best_score = None, self.threshold
+        for candidate in self._lsh.candidates(self._lsh.signature(grams)):
+            other = self._grams[candidate]
+            score = len(grams & other) / len(grams | other)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return self.keys.get(best) if best is not None else None
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import re
+import time
+import zlib
+from itertools import cycle
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+ENTITY_TYPES = ["topic", "skill", "tool", "concept", "activity"]
+RELATION_TYPES = ["interested_in", "knows", "uses", "learning", "expert_in"]
+
+SINGLE_RE = re.compile(r'message from (.+?):\s*"(.*?)"\s*$', re.MULTILINE | re.DOTALL)
+BATCH_RE = re.compile(r'^### MESSAGE (\d+)\nFrom (.+?): "(.*)"$', re.MULTILINE)
+
+
+def _stable_hash(value: str) -> int:
+    # hash() cambia a ogni processo: per risposte riproducibili usiamo crc32
+    return zlib.crc32(value.encode("utf-8"))
+
+
+def _topics(content: str, max_entities: int) -> List[str]:
+    topics = []
+    for word in content.split():
+        word = word.strip(".,;:!?\"'()").lower()
+        if len(word) >= 5 and word not in topics:
+            topics.append(word)
+        if len(topics) == max_entities:
+            break
+    return topics
+
+
+def fake_extraction(sender: str, content: str, max_entities: int = 3) -> str:
+    """Deterministic ENTITIES/RELATIONS answer built from the message words."""
+    topics = _topics(content, max_entities)
+    lines = ["ENTITIES:", f"- name: {sender}", "  type: person", "  attributes:"]
+    lines.append("    status: active")
+    for topic in topics:
+        h = _stable_hash(topic)
+        lines += [
+            f"- name: {topic.title()}",
+            f"  type: {ENTITY_TYPES[h % len(ENTITY_TYPES)]}",
+            "  attributes:",
+            "    relevance: high",
+        ]
+    lines += ["", "RELATIONS:"]
+    for topic in topics:
+        h = _stable_hash(sender + topic)
+        lines += [
+            f"- source: {sender}",
+            f"  target: {topic.title()}",
+            f"  type: {RELATION_TYPES[h % len(RELATION_TYPES)]}",
+            f"  weight: {0.5 + (h % 50) / 100:.2f}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def fake_extraction_json(sender: str, content: str, max_entities: int = 3) -> Dict:
+    """The same answer as fake_extraction, in the compact JSON format."""
+    topics = _topics(content, max_entities)
+    entities = [{"n": sender, "t": "person", "a": {"status": "active"}}]
+    relations = []
+    for i, topic in enumerate(topics, 1):
+        h = _stable_hash(topic)
+        entities.append(
+            {
+                "n": topic.title(),
+                "t": ENTITY_TYPES[h % len(ENTITY_TYPES)],
+                "a": {"relevance": "high"},
+            }
+        )
+        h = _stable_hash(sender + topic)
+        relations.append(
+            {
+                "s": 0,
+                "o": i,
+                "t": RELATION_TYPES[h % len(RELATION_TYPES)],
+                "w": round(0.5 + (h % 50) / 100, 2),
+            }
+        )
+    return {"e": entities, "r": relations}
+
+
+def _dumps(data: Dict) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class FakeExtractionChatModel(BaseChatModel):
+    """Offline stand-in provider for benchmarks and local runs.
+
+    Answers extraction prompts (single or batched) with deterministic
+    ENTITIES/RELATIONS blocks derived from the message text (compact JSON
+    when called with a `response_format`), or replays the canned responses
+    in `responses` in order, after `latency_ms` of simulated round-trip time.
+    When streamed, the reply is sent line by line with the latency spread
+    evenly across the lines.
+    """
+
+    latency_ms: float = 0.0
+    max_entities: int = 3
+    responses: Optional[List[str]] = None
+    _replay: Optional[Iterator[str]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-extraction"
+
+    def _answer(self, messages: List[BaseMessage], json_mode: bool = False) -> AIMessage:
+        prompt = str(messages[-1].content)
+        if self.responses:
+            if self._replay is None:
+                self._replay = cycle(self.responses)
+            content = next(self._replay)
+        elif json_mode:
+            batch = BATCH_RE.findall(prompt)
+            if batch:
+                content = _dumps(
+                    {
+                        i: fake_extraction_json(s, c, self.max_entities)
+                        for i, s, c in batch
+                    }
+                )
+            else:
+                match = SINGLE_RE.search(prompt)
+                sender, text = match.groups() if match else ("Unknown", prompt)
+                content = _dumps(fake_extraction_json(sender, text, self.max_entities))
+        else:
+            batch = BATCH_RE.findall(prompt)
+            if batch:
+                content = "".join(
+                    f"### MESSAGE {i}\n{fake_extraction(s, c, self.max_entities)}"
+                    for i, s, c in batch
+                )
+            else:
+                match = SINGLE_RE.search(prompt)
+                sender, text = match.groups() if match else ("Unknown", prompt)
+                content = fake_extraction(sender, text, self.max_entities)
+
+        input_tokens = sum(len(str(m.content)) // 4 + 4 for m in messages)
+        output_tokens = len(content) // 4
+        return AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        message = self._answer(messages, "response_format" in kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        message = self._answer(messages, "response_format" in kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(
+        self, messages: List[BaseMessage], json_mode: bool = False
+    ) -> List[ChatGenerationChunk]:
+        message = self._answer(messages, json_mode)
+        # Il JSON compatto è su una riga sola: lo spezziamo a pezzi di 64 caratteri
+        content = message.content
+        if json_mode:
+            lines = [content[i : i + 64] for i in range(0, len(content), 64)] or [""]
+        else:
+            lines = content.splitlines(keepends=True) or [""]
+        chunks = [
+            ChatGenerationChunk(message=AIMessageChunk(content=line)) for line in lines
+        ]
+        chunks[-1] = ChatGenerationChunk(
+            message=AIMessageChunk(
+                content=lines[-1], usage_metadata=message.usage_metadata
+            )
+        )
+        return chunks
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        chunks = self._chunks(messages, "response_format" in kwargs)
+        for chunk in chunks:
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000 / len(chunks))
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        chunks = self._chunks(messages, "response_format" in kwargs)
+        for chunk in chunks:
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000 / len(chunks))
+            yield chunk
@@ -0,0 +1,1412 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from agents.metrics import GRAPH_EVICTIONS
+from agents.models import Entity, Relation, from_micros, get_utc_now, to_micros
+from agents.persistence import GraphJournal
+from agents.retention import DAY, RetentionPolicy
+from agents.rollups import BUCKETS, TemporalRollups, bucket_start
+from agents.snapshot import EdgeRecord, EntityRecord, GraphSnapshot
+
+# Modi di aggregazione del peso per le relazioni ripetute
+AGGREGATE_MODES = ("mean", "max", "decay")
+
+# Bit per id nella chiave intera di un arco (source, target, type)
+ID_BITS = 24
+# Timestamp sentinella per gli id di nomi che non sono (ancora) entità
+ABSENT = -(2**63)
+# Numero massimo di modifiche tenute nel change log per le delta
+CHANGE_LOG_LIMIT = 100_000
+# Direzioni di attraversamento supportate da neighbors()
+DIRECTIONS = ("out", "in", "both")
+# Centralità mantenute in modo incrementale: grado e grado pesato (somma dei pesi)
+CENTRALITY = ("degree", "weight")
+
+
+def heap_delete(heap: List, pos: int) -> None:
+    """Remove heap[pos] in O(log n), keeping the heap invariant."""
+    last = heap.pop()
+    if pos < len(heap):
+        heap[pos] = last
+        # L'elemento spostato può dover salire (verso la radice) o scendere
+        if pos > 0 and last < heap[(pos - 1) >> 1]:
+            _sift_up(heap, pos)
+        else:
+            _sift_down(heap, pos)
+
+
+def _sift_up(heap: List, pos: int) -> None:
+    item = heap[pos]
+    while pos > 0:
+        parent = (pos - 1) >> 1
+        if not item < heap[parent]:
+            break
+        heap[pos] = heap[parent]
+        pos = parent
+    heap[pos] = item
+
+
+def _sift_down(heap: List, pos: int) -> None:
+    item = heap[pos]
+    end = len(heap)
+    child = 2 * pos + 1
+    while child < end:
+        if child + 1 < end and heap[child + 1] < heap[child]:
+            child += 1
+        if not heap[child] < item:
+            break
+        heap[pos] = heap[child]
+        pos = child
+        child = 2 * pos + 1
+    heap[pos] = item
+
+
+class TopIndex:
+    """Ids ranked by a score that changes on writes, for top-k without a scan.
+
+    A max-heap of (-score, id, stamp) entries: every score change pushes a
+    new entry and bumps the id's stamp, so only the latest entry of an id
+    is current; older ones (and those of ids no longer `alive`) are skipped
+    by top() and pruned a few per push once they outnumber the ids. top()
+    walks the heap best-first (the children of slot p are 2p+1 and 2p+2),
+    so it visits the k results plus the stale or rejected entries above them.
+
+    A partial ranking (e.g. one type) passes the global one as `shared`: it
+    reuses its stamps, so it must be pushed right after it for the same id,
+    and `size` (the ids it can hold) bounds its heap instead.
+    """
+
+    PRUNE_STEPS = 8
+
+    def __init__(
+        self,
+        alive: Callable[[int], bool],
+        shared: Optional["TopIndex"] = None,
+        size: Optional[Callable[[], int]] = None,
+    ):
+        self.alive = alive
+        self.heap: List[Tuple[float, int, int]] = []
+        self.shared = shared is not None
+        self.stamps = shared.stamps if shared is not None else array("Q")
+        self.size = size or self.stamps.__len__
+        self._scan = 0
+
+    def push(self, i: int, score: float) -> None:
+        stamps = self.stamps
+        if not self.shared:
+            while len(stamps) <= i:
+                stamps.append(0)
+            stamps[i] += 1
+        heapq.heappush(self.heap, (-score, i, stamps[i]))
+        if len(self.heap) > 2 * self.size() + 64:
+            self._prune()
+
+    def top(
+        self,
+        limit: int,
+        accept: Optional[Callable[[int], bool]] = None,
+        min_score: Optional[float] = None,
+    ) -> List[Tuple[int, float]]:
+        """The `limit` best (id, score) pairs among the ids passing `accept`."""
+        heap, stamps, alive = self.heap, self.stamps, self.alive
+        ranked: List[Tuple[int, float]] = []
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier and len(ranked) < limit:
+            (score, i, stamp), pos = heapq.heappop(frontier)
+            if min_score is not None and -score < min_score:
+                break
+            for child in (2 * pos + 1, 2 * pos + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            if stamps[i] == stamp and alive(i) and (accept is None or accept(i)):
+                ranked.append((i, -score))
+        return ranked
+
+    def _prune(self) -> None:
+        heap, stamps = self.heap, self.stamps
+        pos = self._scan
+        for _ in range(self.PRUNE_STEPS):
+            if pos >= len(heap):
+                pos = 0
+            _, i, stamp = heap[pos]
+            if stamps[i] == stamp and self.alive(i):
+                pos += 1
+            else:
+                heap_delete(heap, pos)
+        self._scan = pos
+
+
+def encode_cursor(cursor: Optional[Tuple[int, int]]) -> Optional[str]:
+    """Opaque page cursor for a (last seen, edge id) position."""
+    if cursor is None:
+        return None
+    return f"{cursor[0]}_{cursor[1]}"
+
+
+def decode_cursor(value: str) -> Tuple[int, int]:
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor."""
+    ts, sep, edge = value.partition("_")
+    if not sep:
+        raise ValueError(f"Invalid cursor: {value!r}")
+    return int(ts), int(edge)
+
+
+class StringTable:
+    """Interns strings to dense integer ids (released ids are reused).
+
+    With `limit`, interning a new string when `limit` ids are in use raises
+    OverflowError instead of handing out an id that does not fit.
+    """
+
+    __slots__ = ("ids", "strings", "free", "limit")
+
+    def __init__(self, limit: Optional[int] = None):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+        self.free: List[int] = []
+        self.limit = limit
+
+    def intern(self, value: str) -> int:
+        i = self.ids.get(value)
+        if i is None:
+            if self.free:
+                i = self.free.pop()
+                self.strings[i] = value
+            else:
+                i = len(self.strings)
+                if self.limit is not None and i >= self.limit:
+                    raise OverflowError(
+                        f"String table full: {self.limit} ids in use, cannot add {value!r}"
+                    )
+                self.strings.append(value)
+            self.ids[value] = i
+        return i
+
+    def release(self, i: int) -> None:
+        """Forget the string with id `i`; a later intern() may reuse the id."""
+        del self.ids[self.strings[i]]
+        self.strings[i] = ""
+        self.free.append(i)
+
+    def get(self, value: str) -> Optional[int]:
+        return self.ids.get(value)
+
+    def __getitem__(self, i: int) -> str:
+        return self.strings[i]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+
+class EntityMap(Mapping):
+    """Read-only name -> Entity mapping over the columnar store.
+
+    Entity objects are built on access; they are views, not the storage.
+    """
+
+    def __init__(self, store: "GraphStore"):
+        self._store = store
+
+    def __getitem__(self, name: str) -> Entity:
+        i = self._store._names.get(name)
+        if i is None or self._store._entity_ts[i] == ABSENT:
+            raise KeyError(name)
+        return self._store._entity(i)
+
+    def __contains__(self, name) -> bool:
+        i = self._store._names.get(name)
+        return i is not None and self._store._entity_ts[i] != ABSENT
+
+    def __iter__(self) -> Iterator[str]:
+        store = self._store
+        for i, ts in enumerate(store._entity_ts):
+            if ts != ABSENT:
+                yield store._names[i]
+
+    def __len__(self) -> int:
+        return self._store._entity_count
+
+
+class GraphStore:
+    """In-memory knowledge graph with interned ids and columnar storage.
+
+    Entity names and types/relation types are interned to ints. Entity
+    columns are indexed by name id; edges live in parallel arrays (source,
+    target, type, weight, last seen, first seen, count) indexed by edge id.
+    `Entity` and `Relation` objects are only built as views when read.
+
+    Entities and relations are kept in timestamp order, so a time-filtered
+    view is a bisect plus a slice instead of a full scan. Adjacency lists,
+    degree counts and per-type indexes of entities and edges are updated on
+    every insert, so neighborhood and top-k queries only visit the edges of
+    the nodes (or of the type) they ask about. When a journal is attached,
+    every mutation is also appended to it.
+
+    Relations are deduplicated on (source, target, type): restating an edge
+    updates its aggregated weight (running mean, max or exponentially
+    decayed), its count and its first/last-seen timestamps.
+
+    Every mutation bumps a monotonically increasing `version` and is recorded
+    in a bounded change log, so `changes_since(version)` costs O(changes)
+    rather than O(graph).
+
+    Every observation also updates hour/day/week rollups (mentions per
+    entity type, observations per relation type, count and weight sum per
+    edge), so `history()` answers from the rollups instead of the raw data.
+    `history` bounds them: days of buckets kept per granularity ("hour",
+    "day", "week"; 0 or missing = forever), older ones dropped on commit().
+
+    With a `retention` policy, edges and entities are also kept in heaps by
+    deadline (see RetentionPolicy) and every commit() evicts at most
+    `steps_per_write` of them from the top: expired ones, then the ones
+    closest to expiring while the graph is over budget. An entity left
+    without edges by an eviction is collected too. Freed edge and name ids
+    are reused, so the columns stop growing once the budget is reached.
+    Removals are journaled and listed by `removals_since(version)`.
+
+    Every commit() publishes `snapshot`, an immutable GraphSnapshot of the
+    committed version that shares all unchanged blocks with the previous
+    one. Readers on other threads use it instead of the live columns,
+    which only the writer (under the caller's lock) touches.
+    """
+
+    def __init__(
+        self,
+        journal: Optional[GraphJournal] = None,
+        aggregate: str = "mean",
+        decay_alpha: float = 0.3,
+        retention: Optional[RetentionPolicy] = None,
+        history: Optional[Dict[str, float]] = None,
+    ):
+        if aggregate not in AGGREGATE_MODES:
+            raise ValueError(f"Aggregation mode {aggregate} non supportato")
+        for bucket in history or {}:
+            if bucket not in BUCKETS:
+                raise ValueError(f"Bucket {bucket} non supportato")
+        self.history_keep = {
+            bucket: int(days * DAY) for bucket, days in (history or {}).items() if days
+        }
+        self.journal = journal
+        self.aggregate = aggregate
+        self.decay_alpha = decay_alpha
+        self.retention = retention
+        # La versione non riparte mai da zero, nemmeno dopo clear()
+        self.version = 0
+        # Spento mentre si carica uno snapshot: i rollup arrivano già calcolati
+        self.record_history = True
+        self._reset_indexes()
+        self.snapshot: Optional[GraphSnapshot] = None
+        self._publish()
+
+    def _reset_indexes(self) -> None:
+        # Change log: versione e riferimento (id * 2 + tipo: 0 entità, 1 arco)
+        self._change_versions = array("q")
+        self._change_refs = array("q")
+        self._change_floor = self.version
+        # Rimozioni per le delta: versione e nome o (sorgente, destinazione, tipo)
+        self._removal_versions = array("q")
+        self._removals: List[Union[str, Tuple[str, str, str]]] = []
+
+        # Gli id devono stare in ID_BITS bit, altrimenti le chiavi degli archi collidono
+        self._names = StringTable(limit=1 << ID_BITS)  # nomi delle entità
+        self._types = StringTable(limit=1 << ID_BITS)  # tipi di entità e di relazione
+
+        # Colonne delle entità, indicizzate per id del nome
+        self._entity_type = array("i")
+        self._entity_ts = array("q")
+        self._entity_attrs: List[Optional[Dict[str, str]]] = []
+        # Generazione dello slot: distingue le voci di heap di un id riusato
+        self._entity_gen = array("I")
+        self._entity_count = 0
+        # Indice temporale delle entità: timestamp e id in array paralleli
+        self._entity_time_keys = array("q")
+        self._entity_time_ids = array("i")
+
+        # Colonne degli archi, indicizzate per id dell'arco
+        self._source = array("i")
+        self._target = array("i")
+        self._edge_type = array("i")
+        self._weight = array("d")
+        self._last_seen = array("q")
+        self._first_seen = array("q")
+        self._count = array("I")  # 0 = slot libero
+        self._edge_gen = array("I")
+        self._edge_ids: Dict[int, int] = {}
+        self._free_edges: List[int] = []
+        self._edge_total = 0
+        # Indice temporale degli archi (per ultimo avvistamento)
+        self._time_keys = array("q")
+        self._time_edges = array("i")
+
+        # Adiacenza e gradi, indicizzati per id del nome
+        self._out_edges: Dict[int, array] = {}
+        self._in_edges: Dict[int, array] = {}
+        self._out_degree = array("i")
+        self._in_degree = array("i")
+        self._strength = array("d")  # somma dei pesi degli archi incidenti
+        # Classifiche globali aggiornate a ogni scrittura: archi per peso, entità
+        # per grado e per grado pesato (chiavi come in CENTRALITY)
+        self._edges_by_weight = TopIndex(self._count.__getitem__)
+        is_entity = lambda i: self._entity_ts[i] != ABSENT
+        self._rankings = {"degree": TopIndex(is_entity), "weight": TopIndex(is_entity)}
+        # Le stesse classifiche per tipo (archi per peso, entità per grado), create al primo uso
+        self._type_edge_rankings: Dict[int, TopIndex] = {}
+        self._type_entity_rankings: Dict[int, TopIndex] = {}
+        # Indici per tipo: archi per tipo di relazione, entità per tipo di entità
+        self._type_edges: Dict[int, Dict[int, None]] = {}
+        self._type_entities: Dict[int, Dict[int, None]] = {}
+        # Heap della retention: (scadenza, ultimo avvistamento, id, generazione)
+        self._edge_heap: List[Tuple[int, int, int, int]] = []
+        self._node_heap: List[Tuple[int, int, int, int]] = []
+        # Posizioni da cui riprende la pulizia delle voci morte negli heap
+        self._edge_scan = 0
+        self._node_scan = 0
+
+        self.rollups = TemporalRollups(self.history_keep)
+
+    @property
+    def entities(self) -> EntityMap:
+        return EntityMap(self)
+
+    @property
+    def relations(self) -> List[Relation]:
+        """All (aggregated) relations, least recently seen first."""
+        return [self._relation(e) for e in self._time_edges]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entities
+
+    def __len__(self) -> int:
+        return self._edge_total
+
+    def add_entity(self, entity: Entity, mention: bool = True) -> None:
+        """Insert or replace an entity, keeping the time index in sync.
+
+        `mention` counts it in the history rollups: False for a repeat of a
+        mention already counted (the same entity twice in one message).
+        """
+        i = self._intern_name(entity.name)
+        previous = self._entity_ts[i]
+        if previous != ABSENT:
+            self._unindex(self._entity_time_keys, self._entity_time_ids, previous, i)
+        else:
+            self._entity_count += 1
+            self._entity_gen[i] += 1
+
+        ts = to_micros(entity.timestamp)
+        type_id = self._types.intern(entity.type)
+        previous_type = self._entity_type[i]
+        if previous != ABSENT and previous_type != type_id:
+            self._type_entities[previous_type].pop(i, None)
+        self._type_entities.setdefault(type_id, {})[i] = None
+        self._entity_type[i] = type_id
+        self._entity_ts[i] = ts
+        self._entity_attrs[i] = entity.attributes or None
+        self._index(self._entity_time_keys, self._entity_time_ids, ts, i)
+        if previous == ABSENT or type_id != previous_type:
+            self._rank_entity(i)
+        if self.retention is not None and (previous == ABSENT or ts < previous):
+            self._push_node(i)
+        self._touch(i, 0)
+        if self.record_history and mention:
+            self.rollups.add_entity(ts, type_id)
+        if self.journal is not None:
+            self.journal.log_entity(entity, mention)
+
+    def add_relation(self, relation: Relation) -> None:
+        """Record an observation of an edge, aggregating it into the stored edge."""
+        source = self._intern_name(relation.source)
+        target = self._intern_name(relation.target)
+        type_id = self._types.intern(relation.type)
+        ts = to_micros(relation.timestamp)
+
+        e = self._edge_ids.get(self._edge_key(source, target, type_id))
+        if e is None:
+            e = self._insert_edge(source, target, type_id, relation.weight, ts, ts, 1)
+        else:
+            previous = self._weight[e]
+            policy = self.retention
+            if policy is not None:
+                key = self._edge_heap_key(e)
+                # Il peso salvato è quello all'ultimo avvistamento: lo si fa decadere
+                # fino a questa osservazione prima di aggregarla
+                self._weight[e] = policy.decay(self._weight[e], ts - self._last_seen[e])
+            self._weight[e] = self._aggregate_weight(e, relation.weight)
+            self._strength[source] += self._weight[e] - previous
+            self._strength[target] += self._weight[e] - previous
+            self._rank_edge(e)
+            self._rankings["weight"].push(source, self._strength[source])
+            self._rankings["weight"].push(target, self._strength[target])
+            self._count[e] += 1
+            self._first_seen[e] = min(self._first_seen[e], ts)
+            if ts > self._last_seen[e]:
+                self._unindex(self._time_keys, self._time_edges, self._last_seen[e], e)
+                self._last_seen[e] = ts
+                self._index(self._time_keys, self._time_edges, ts, e)
+            # Una scadenza posticipata si scopre all'estrazione dall'heap;
+            # una anticipata va inserita subito
+            if policy is not None and self._edge_heap_key(e) < key:
+                self._push_edge(e)
+
+        self._touch(e, 1)
+        if self.record_history:
+            self.rollups.add_relation(ts, type_id, e, relation.weight)
+        if self.journal is not None:
+            self.journal.log_relation(relation)
+
+    def restore_relation(self, edge: Relation) -> None:
+        """Insert an already aggregated edge as-is (used when loading snapshots)."""
+        source = self._intern_name(edge.source)
+        target = self._intern_name(edge.target)
+        type_id = self._types.intern(edge.type)
+        ts = to_micros(edge.timestamp)
+        first_seen = to_micros(edge.first_seen)
+
+        e = self._edge_ids.get(self._edge_key(source, target, type_id))
+        if e is None:
+            self._insert_edge(
+                source, target, type_id, edge.weight, ts, first_seen, edge.count
+            )
+            return
+        self._unindex(self._time_keys, self._time_edges, self._last_seen[e], e)
+        self._strength[source] += edge.weight - self._weight[e]
+        self._strength[target] += edge.weight - self._weight[e]
+        self._weight[e] = edge.weight
+        self._rank_edge(e)
+        self._rankings["weight"].push(source, self._strength[source])
+        self._rankings["weight"].push(target, self._strength[target])
+        self._last_seen[e] = ts
+        self._first_seen[e] = first_seen
+        self._count[e] = edge.count
+        self._index(self._time_keys, self._time_edges, ts, e)
+        if self.retention is not None:
+            self._push_edge(e)
+        self._touch(e, 1)
+
+    def get_relation(self, source: str, target: str, type: str) -> Optional[Relation]:
+        e = self._edge_id(source, target, type)
+        return self._relation(e) if e is not None else None
+
+    def out_relations(self, name: str) -> List[Relation]:
+        i = self._names.get(name)
+        return [self._relation(e) for e in self._out_edges.get(i, ())]
+
+    def in_relations(self, name: str) -> List[Relation]:
+        i = self._names.get(name)
+        return [self._relation(e) for e in self._in_edges.get(i, ())]
+
+    def entities_since(self, cutoff: datetime) -> List[Entity]:
+        """Entities whose timestamp is >= cutoff, oldest first."""
+        i = bisect_left(self._entity_time_keys, to_micros(cutoff))
+        return [self._entity(n) for n in self._entity_time_ids[i:]]
+
+    def relations_since(self, cutoff: datetime) -> List[Relation]:
+        """Relations last seen at or after cutoff, least recently seen first."""
+        i = bisect_left(self._time_keys, to_micros(cutoff))
+        return [self._relation(e) for e in self._time_edges[i:]]
+
+    def window(self, cutoff: datetime) -> Tuple[List[Entity], List[Relation]]:
+        """Edges seen since cutoff whose endpoints are also inside the window.
+
+        Returns (nodes, edges) where nodes are exactly the endpoints of the
+        returned edges; only the edges inside the window are visited.
+        """
+        nodes, edges, _ = self.window_ids(cutoff)
+        return [self._entity(i) for i in nodes], [self._relation(e) for e in edges]
+
+    def window_ids(
+        self,
+        cutoff: datetime,
+        after: Optional[Tuple[int, int]] = None,
+        limit: Optional[int] = None,
+        end: Optional[datetime] = None,
+    ) -> Tuple[List[int], List[int], Optional[Tuple[int, int]]]:
+        """Ids of a page of window(): (node ids, edge ids, cursor of the next page).
+
+        With `end`, only edges last seen up to `end` are returned.
+
+        Edges are paged in last-seen order; `after` is the (last seen, edge
+        id) cursor of the previous page and the returned cursor is None on
+        the last page. Each page carries the endpoints of its own edges, so
+        a node can appear on more than one page. An edge restated while a
+        client is paging moves to the end and is returned again later.
+        """
+        c = to_micros(cutoff)
+        keys, ids = self._time_keys, self._time_edges
+        start = bisect_left(keys, c)
+        if after is not None:
+            ts, edge = after
+            lo = max(start, bisect_left(keys, ts))
+            hi = bisect_right(keys, ts, lo=lo)
+            start = hi
+            # Tra gli archi con lo stesso timestamp si riparte dopo quello del cursore
+            for pos in range(lo, hi):
+                if ids[pos] == edge:
+                    start = pos + 1
+                    break
+
+        entity_ts = self._entity_ts
+        source, target = self._source, self._target
+        stop = bisect_right(keys, to_micros(end)) if end is not None else len(ids)
+        nodes: Dict[int, None] = {}
+        edges: List[int] = []
+        for pos in range(start, stop):
+            e = ids[pos]
+            s, t = source[e], target[e]
+            # ABSENT è minore di ogni cutoff: esclude anche gli estremi mancanti
+            if entity_ts[s] < c or entity_ts[t] < c:
+                continue
+            if limit is not None and len(edges) == limit:
+                last = edges[-1]
+                return list(nodes), edges, (self._last_seen[last], last)
+            edges.append(e)
+            nodes[s] = None
+            nodes[t] = None
+        return list(nodes), edges, None
+
+    def columns(
+        self, node_ids: List[int], edge_ids: List[int], attributes: bool = False
+    ) -> Dict:
+        """Columnar encoding of nodes and edges: parallel arrays plus a string table.
+
+        Names and types are indexes into "strings", edge endpoints are
+        positions in the node arrays and timestamps are epoch milliseconds.
+        Attributes are included only when asked for.
+        """
+        strings = StringTable()
+        position = {i: pos for pos, i in enumerate(node_ids)}
+        names, types = self._names, self._types
+        nodes = {
+            "name": [strings.intern(names[i]) for i in node_ids],
+            "type": [strings.intern(types[self._entity_type[i]]) for i in node_ids],
+            "timestamp": [self._entity_ts[i] // 1000 for i in node_ids],
+        }
+        if attributes:
+            nodes["attributes"] = [self._entity_attrs[i] or {} for i in node_ids]
+        edges = {
+            "source": [position[self._source[e]] for e in edge_ids],
+            "target": [position[self._target[e]] for e in edge_ids],
+            "type": [strings.intern(types[self._edge_type[e]]) for e in edge_ids],
+            "weight": [self._weight[e] for e in edge_ids],
+            "count": [self._count[e] for e in edge_ids],
+            "first_seen": [self._first_seen[e] // 1000 for e in edge_ids],
+            "timestamp": [self._last_seen[e] // 1000 for e in edge_ids],
+        }
+        return {"strings": strings.strings, "nodes": nodes, "edges": edges}
+
+    def entity_at(self, i: int) -> Entity:
+        return self._entity(i)
+
+    def relation_at(self, e: int) -> Relation:
+        return self._relation(e)
+
+    def changes_since(
+        self, version: int
+    ) -> Optional[Tuple[List[Entity], List[Relation]]]:
+        """Entities and edges modified after `version`, current values.
+
+        Returns None when the change log no longer reaches back to `version`
+        (or the version is from the future), meaning a full resync is needed.
+        """
+        if version < self._change_floor or version > self.version:
+            return None
+        entities: Dict[int, None] = {}
+        edges: Dict[int, None] = {}
+        refs = self._change_refs
+        for pos in range(bisect_right(self._change_versions, version), len(refs)):
+            ref = refs[pos]
+            if ref & 1:
+                edges[ref >> 1] = None
+            else:
+                entities[ref >> 1] = None
+        return (
+            [self._entity(i) for i in entities if self._entity_ts[i] != ABSENT],
+            [self._relation(e) for e in edges if self._count[e]],
+        )
+
+    def removals_since(
+        self, version: int
+    ) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+        """Names of the entities and (source, target, type) of the edges removed
+        after `version`, oldest first.
+
+        Complete whenever changes_since(version) is not None. An item can be
+        both removed and, later, changed again: apply removals first.
+        """
+        nodes: List[str] = []
+        edges: List[Tuple[str, str, str]] = []
+        start = bisect_right(self._removal_versions, version)
+        for key in self._removals[start:]:
+            if isinstance(key, str):
+                nodes.append(key)
+            else:
+                edges.append(key)
+        return nodes, edges
+
+    def neighbors(
+        self,
+        name: str,
+        depth: int = 1,
+        min_weight: float = 0.0,
+        limit: Optional[int] = None,
+        direction: str = "both",
+        cutoff: Optional[datetime] = None,
+    ) -> Optional[Tuple[List[Entity], List[Relation]]]:
+        """The neighborhood of `name` within `depth` hops (breadth-first).
+
+        Only edges with weight >= `min_weight` (and, with `cutoff`, seen
+        since then with both endpoints inside the window) are followed; from
+        each node the strongest edges are taken first. At most `limit`
+        nodes besides `name` are returned, plus the edges among the visited
+        ones. Returns None when `name` is not an entity.
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Direction {direction} non supportata")
+        start = self._names.get(name)
+        if start is None or self._entity_ts[start] == ABSENT:
+            return None
+        c = to_micros(cutoff) if cutoff is not None else ABSENT
+
+        visited: Dict[int, None] = {start: None}
+        edges: Dict[int, None] = {}
+        frontier = [start]
+        for _ in range(depth):
+            next_frontier = []
+            for node in frontier:
+                for e in self._strongest(self._incident(node, direction), min_weight, c):
+                    other = self._target[e] if self._source[e] == node else self._source[e]
+                    if other not in visited:
+                        if limit is not None and len(visited) > limit:
+                            continue
+                        visited[other] = None
+                        next_frontier.append(other)
+                    edges[e] = None
+            if not next_frontier:
+                break
+            frontier = next_frontier
+
+        return (
+            [self._entity(i) for i in visited],
+            [self._relation(e) for e in edges],
+        )
+
+    def top_relations(
+        self,
+        type: Optional[str] = None,
+        source: Optional[str] = None,
+        target: Optional[str] = None,
+        limit: int = 20,
+        min_weight: float = 0.0,
+        cutoff: Optional[datetime] = None,
+    ) -> List[Relation]:
+        """The `limit` strongest edges, optionally of one type and/or endpoint.
+
+        With a source or target the candidates are its adjacency; otherwise
+        the weight ranking of the type (or the global one) is walked from the
+        top, so the cost follows the result, not the number of edges.
+        """
+        type_id = self._types.get(type) if type is not None else None
+        if type is not None and type_id is None:
+            return []
+        candidates: Iterable[int]
+        if source is not None or target is not None:
+            s = self._names.get(source) if source is not None else None
+            t = self._names.get(target) if target is not None else None
+            if (source is not None and s is None) or (target is not None and t is None):
+                return []
+            if s is not None:
+                candidates = (
+                    e for e in self._out_edges.get(s, ())
+                    if t is None or self._target[e] == t
+                )
+            else:
+                candidates = self._in_edges.get(t, ())
+            if type_id is not None:
+                candidates = (e for e in candidates if self._edge_type[e] == type_id)
+        else:
+            ranking = (
+                self._edges_by_weight
+                if type_id is None
+                else self._type_edge_rankings.get(type_id)
+            )
+            if ranking is None:
+                return []
+            c = to_micros(cutoff) if cutoff is not None else ABSENT
+            ranked = ranking.top(
+                limit,
+                accept=lambda e: any(True for _ in self._filter_edges((e,), min_weight, c)),
+                min_score=min_weight,
+            )
+            return [self._relation(e) for e, _ in ranked]
+        c = to_micros(cutoff) if cutoff is not None else ABSENT
+        top = heapq.nlargest(
+            limit,
+            self._filter_edges(candidates, min_weight, c),
+            key=self._weight.__getitem__,
+        )
+        return [self._relation(e) for e in top]
+
+    def top_entities(
+        self, type: Optional[str] = None, limit: int = 20
+    ) -> List[Tuple[Entity, int]]:
+        """The `limit` entities (of `type`, if given) with the highest degree.
+
+        The degree ranking of the type (or the global one) is walked from the top.
+        """
+        if type is None:
+            ranking: Optional[TopIndex] = self._rankings["degree"]
+        else:
+            type_id = self._types.get(type)
+            ranking = self._type_entity_rankings.get(type_id) if type_id is not None else None
+        if ranking is None:
+            return []
+        return [(self._entity(i), int(degree)) for i, degree in ranking.top(limit)]
+
+    def lod(
+        self,
+        center: Optional[str] = None,
+        max_nodes: int = 200,
+        rank: str = "degree",
+        depth: int = 2,
+        min_weight: float = 0.0,
+        cutoff: Optional[datetime] = None,
+    ) -> Optional[
+        Tuple[List[Tuple[Entity, float]], List[Relation], List[Tuple[str, str, int, float]]]
+    ]:
+        """A bounded level-of-detail view: (entities with score, relations, clusters).
+
+        Nodes are the `max_nodes` most central ones (by degree or by weighted
+        degree, both kept up to date on every write): with `center`, grown
+        best-first from it within `depth` hops, otherwise the global top read
+        from the write-maintained rankings, without visiting the other entities.
+        Edges are the ones among those nodes. The neighbors left out are
+        folded into clusters (owner name, entity type, hidden nodes, mean
+        weight), one per shown node and type, at most `max_nodes` of them.
+        Returns None when `center` is not an entity.
+        """
+        if rank not in CENTRALITY:
+            raise ValueError(f"Centralità {rank} non supportata")
+        if rank == "degree":
+            out_degree, in_degree = self._out_degree, self._in_degree
+            score = lambda i: out_degree[i] + in_degree[i]
+        else:
+            score = self._strength.__getitem__
+        c = to_micros(cutoff) if cutoff is not None else ABSENT
+
+        if center is None:
+            ranked = self._rankings[rank].top(
+                max_nodes, accept=lambda i: self._entity_ts[i] >= c
+            )
+            shown = dict.fromkeys(i for i, _ in ranked)
+        else:
+            i = self._names.get(center)
+            if i is None or self._entity_ts[i] == ABSENT:
+                return None
+            shown = {i: None}
+            hops = {i: 0}
+            frontier: List[Tuple[float, int]] = []
+            while True:
+                if hops[i] < depth:
+                    for e in self._filter_edges(self._incident(i, "both"), min_weight, c):
+                        other = self._target[e] if self._source[e] == i else self._source[e]
+                        if other not in hops:
+                            hops[other] = hops[i] + 1
+                            heapq.heappush(frontier, (-score(other), other))
+                if not frontier or len(shown) >= max_nodes:
+                    break
+                _, i = heapq.heappop(frontier)
+                shown[i] = None
+
+        edges: Dict[int, None] = {}
+        # (nodo mostrato, tipo) -> vicini nascosti con il peso più alto verso di loro
+        hidden: Dict[Tuple[int, int], Dict[int, float]] = {}
+        for i in shown:
+            for e in self._filter_edges(self._incident(i, "both"), min_weight, c):
+                source, target = self._source[e], self._target[e]
+                other = target if source == i else source
+                if other in shown:
+                    edges[e] = None
+                    continue
+                group = hidden.setdefault((i, self._entity_type[other]), {})
+                group[other] = max(group.get(other, 0.0), self._weight[e])
+        clusters = heapq.nlargest(
+            max_nodes,
+            (
+                (owner, type_id, len(group), sum(group.values()) / len(group))
+                for (owner, type_id), group in hidden.items()
+            ),
+            key=lambda cluster: cluster[2],
+        )
+        return (
+            [(self._entity(i), score(i)) for i in shown],
+            [self._relation(e) for e in edges],
+            [
+                (self._names[owner], self._types[type_id], count, weight)
+                for owner, type_id, count, weight in clusters
+            ],
+        )
+
+    def history(
+        self,
+        start: datetime,
+        end: datetime,
+        bucket: str = "hour",
+        entity_type: Optional[str] = None,
+        relation_type: Optional[str] = None,
+        edge: Optional[Tuple[str, str, str]] = None,
+    ) -> List[Dict]:
+        """Per-bucket activity between `start` and `end`, from the rollups.
+
+        Each bucket with data has its start (microseconds), the entity
+        mentions per entity type and the relation observations per relation
+        type (restricted to `entity_type`/`relation_type` if given). With
+        `edge` = (source, target, type) it also has that edge's observations
+        and mean weight in the bucket.
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"Bucket {bucket} non supportato")
+        rollup = self.rollups[bucket]
+        entity_filter = self._types.get(entity_type) if entity_type is not None else None
+        relation_filter = (
+            self._types.get(relation_type) if relation_type is not None else None
+        )
+        e = self._edge_id(*edge) if edge is not None else None
+
+        types = self._types
+        result = []
+        for b in rollup.buckets(to_micros(start), to_micros(end)):
+            entities = rollup.entities.get(b, {})
+            relations = rollup.relations.get(b, {})
+            item = {
+                "start": bucket_start(b, bucket),
+                "entities": {
+                    types[k]: n for k, n in entities.items()
+                    if entity_type is None or k == entity_filter
+                },
+                "relations": {
+                    types[k]: n for k, n in relations.items()
+                    if relation_type is None or k == relation_filter
+                },
+            }
+            if edge is not None:
+                count, total = rollup.edges.get(b, {}).get(e) or (0, 0.0)
+                item["edge"] = {
+                    "count": count,
+                    "mean_weight": total / count if count else None,
+                }
+            result.append(item)
+        return result
+
+    def rollup_rows(self) -> Iterator[Tuple]:
+        """Rollup rows with names instead of ids, for snapshots.
+
+        Rows are (bucket, index, kind, type, source, target, count, weight
+        sum); source and target are set only for "edge" rows.
+        """
+        names, types = self._names, self._types
+        for bucket, index, kind, id, count, weight in self.rollups.rows():
+            if kind == "edge":
+                yield (
+                    bucket, index, kind, types[self._edge_type[id]],
+                    names[self._source[id]], names[self._target[id]], count, weight,
+                )
+            else:
+                yield bucket, index, kind, types[id], None, None, count, weight
+
+    def restore_rollup(
+        self,
+        bucket: str,
+        index: int,
+        kind: str,
+        type: str,
+        source: Optional[str],
+        target: Optional[str],
+        count: int,
+        weight: float,
+    ) -> None:
+        """Add back a row of rollup_rows() (edges must be restored first)."""
+        if kind == "edge":
+            e = self._edge_id(source, target, type)
+            if e is not None:
+                self.rollups.restore(bucket, index, kind, e, count, weight)
+        else:
+            self.rollups.restore(bucket, index, kind, self._types.intern(type), count, weight)
+
+    def remove_relation(self, source: str, target: str, type: str) -> bool:
+        """Delete an edge and its rollup history; False if there is no such edge."""
+        e = self._edge_id(source, target, type)
+        if e is None:
+            return False
+        self._remove_edge(e)
+        return True
+
+    def remove_entity(self, name: str) -> bool:
+        """Delete an entity and every edge incident to it; False if absent."""
+        i = self._names.get(name)
+        if i is None or self._entity_ts[i] == ABSENT:
+            return False
+        self._remove_entity(i)
+        return True
+
+    def evict(
+        self, now: Optional[datetime] = None, max_steps: Optional[int] = None
+    ) -> int:
+        """Run up to `max_steps` steps of the retention policy; return the items removed.
+
+        Each step looks at the top of one heap: a stale entry (the item was
+        restated or removed since) is re-pushed or dropped, an expired item
+        or the next victim of a budget overrun is removed. Stops early when
+        nothing is expired and the graph is within budget.
+        """
+        policy = self.retention
+        if policy is None:
+            return 0
+        now_us = to_micros(now or get_utc_now())
+        steps = policy.steps_per_write if max_steps is None else max_steps
+        removed = 0
+
+        heap = self._edge_heap
+        while steps > 0 and heap:
+            deadline, last_seen, e, gen = heap[0]
+            over = policy.max_edges and self._edge_total > policy.max_edges
+            if not over and deadline > now_us:
+                break
+            heapq.heappop(heap)
+            steps -= 1
+            if self._edge_gen[e] != gen or not self._count[e]:
+                continue
+            key = self._edge_heap_key(e)
+            if key != (deadline, last_seen):
+                heapq.heappush(heap, (*key, e, gen))
+                continue
+            endpoints = (self._source[e], self._target[e])
+            self._remove_edge(e)
+            reason = "expired" if deadline <= now_us else "budget"
+            GRAPH_EVICTIONS.inc(kind="edge", reason=reason)
+            removed += 1 + self._collect_orphans(endpoints)
+
+        heap = self._node_heap
+        while steps > 0 and heap:
+            deadline, ts, i, gen = heap[0]
+            over = policy.max_nodes and self._entity_count > policy.max_nodes
+            if not over and deadline > now_us:
+                break
+            heapq.heappop(heap)
+            steps -= 1
+            if self._entity_gen[i] != gen or self._entity_ts[i] == ABSENT:
+                continue
+            key = policy.node_key(self._entity_ts[i])
+            if key != (deadline, ts):
+                heapq.heappush(heap, (*key, i, gen))
+                continue
+            neighbors = [
+                *(self._target[e] for e in self._out_edges.get(i, ())),
+                *(self._source[e] for e in self._in_edges.get(i, ())),
+            ]
+            edges = self._remove_entity(i)
+            reason = "expired" if deadline <= now_us else "budget"
+            GRAPH_EVICTIONS.inc(kind="node", reason=reason)
+            GRAPH_EVICTIONS.inc(edges, kind="edge", reason="node")
+            removed += 1 + edges + self._collect_orphans(neighbors)
+
+        # Le voci degli elementi rimossi per altre vie (a cascata, come orfani)
+        # restano negli heap: quando superano quelle vive le si elimina a passi
+        if steps > 0 and len(self._edge_heap) > 2 * self._edge_total + 64:
+            self._edge_scan = self._prune(
+                self._edge_heap, self._edge_scan, steps,
+                lambda e, gen: self._edge_gen[e] == gen and self._count[e] > 0,
+            )
+        if steps > 0 and len(self._node_heap) > 2 * self._entity_count + 64:
+            self._node_scan = self._prune(
+                self._node_heap, self._node_scan, steps,
+                lambda i, gen: (
+                    self._entity_gen[i] == gen and self._entity_ts[i] != ABSENT
+                ),
+            )
+        return removed
+
+    @staticmethod
+    def _prune(heap: List, pos: int, steps: int, alive) -> int:
+        """Drop the dead entries among `steps` slots of `heap` from `pos`.
+
+        Returns the position to resume from on the next call.
+        """
+        for _ in range(steps):
+            if not heap:
+                return 0
+            if pos >= len(heap):
+                pos = 0
+            _, _, i, gen = heap[pos]
+            if alive(i, gen):
+                pos += 1
+            else:
+                # Al posto della voce rimossa ne arriva un'altra: si riesamina pos
+                heap_delete(heap, pos)
+        return pos
+
+    def _collect_orphans(self, nodes: Iterable[int]) -> int:
+        """Remove the entities among `nodes` left without edges by an eviction."""
+        collected = 0
+        for i in dict.fromkeys(nodes):
+            if self._entity_ts[i] != ABSENT and not (
+                self._out_degree[i] + self._in_degree[i]
+            ):
+                self._remove_entity(i)
+                GRAPH_EVICTIONS.inc(kind="node", reason="orphan")
+                collected += 1
+        return collected
+
+    def degree(self, name: str) -> int:
+        i = self._names.get(name)
+        if i is None:
+            return 0
+        return self._out_degree[i] + self._in_degree[i]
+
+    def attach_journal(self, journal: GraphJournal) -> None:
+        """Load the persisted graph from `journal`, then log new writes to it."""
+        self.journal = None
+        journal.load(self)
+        self.journal = journal
+        # Ogni modifica produce un record di log: la sequenza del journal è
+        # quindi una versione coerente anche tra un riavvio e l'altro
+        self.version = journal.seq
+        self._change_versions = array("q")
+        self._change_refs = array("q")
+        self._change_floor = self.version
+        self._removal_versions = array("q")
+        self._removals = []
+        self._publish(full=True)
+
+    def commit(self) -> None:
+        """Mark the end of a logical write: one retention step, expiry of
+        old rollup buckets, publish the new snapshot, then flush the journal
+        (which snapshots to disk from the published version)."""
+        if self.retention is not None:
+            self.evict()
+        if self.history_keep:
+            self.rollups.expire(to_micros(get_utc_now()))
+        self._publish()
+        if self.journal is not None:
+            self.journal.commit(self)
+
+    def clear(self) -> None:
+        self.version += 1
+        self._reset_indexes()
+        self._publish(full=True)
+        if self.journal is not None:
+            self.journal.log_reset()
+            self.journal.snapshot(self)
+
+    def _publish(self, full: bool = False) -> None:
+        """Swap in the snapshot of the current version.
+
+        Built from the previous snapshot and the change log when it still
+        reaches back to it, from scratch otherwise.
+        """
+        snapshot = self.snapshot
+        if (
+            full
+            or snapshot is None
+            or snapshot.version < self._change_floor
+            or snapshot.types is not self._types.strings
+        ):
+            self.snapshot = GraphSnapshot.build(
+                self.version,
+                self._types.strings,
+                [self._entity_record(i) for i in range(len(self._entity_ts))],
+                [self._edge_record(e) for e in range(len(self._source))],
+            )
+            return
+        if snapshot.version == self.version:
+            return
+        entities: Dict[int, Optional[EntityRecord]] = {}
+        edges: Dict[int, Optional[EdgeRecord]] = {}
+        refs = self._change_refs
+        for pos in range(bisect_right(self._change_versions, snapshot.version), len(refs)):
+            ref = refs[pos]
+            if ref & 1:
+                edges[ref >> 1] = None
+            else:
+                entities[ref >> 1] = None
+        # Un solo assegnamento: i lettori vedono la versione vecchia o quella nuova
+        self.snapshot = snapshot.evolve(
+            self.version,
+            {i: self._entity_record(i) for i in entities},
+            len(self._entity_ts),
+            {e: self._edge_record(e) for e in edges},
+            len(self._source),
+        )
+
+    def _entity_record(self, i: int) -> Optional[EntityRecord]:
+        ts = self._entity_ts[i]
+        if ts == ABSENT:
+            return None
+        return self._names[i], self._entity_type[i], ts, self._entity_attrs[i]
+
+    def _edge_record(self, e: int) -> Optional[EdgeRecord]:
+        if not self._count[e]:
+            return None
+        return (
+            self._source[e],
+            self._target[e],
+            self._edge_type[e],
+            self._weight[e],
+            self._count[e],
+            self._last_seen[e],
+            self._first_seen[e],
+        )
+
+    def _intern_name(self, name: str) -> int:
+        i = self._names.intern(name)
+        if i == len(self._entity_ts):
+            self._entity_type.append(-1)
+            self._entity_ts.append(ABSENT)
+            self._entity_attrs.append(None)
+            self._entity_gen.append(0)
+            self._out_degree.append(0)
+            self._in_degree.append(0)
+            self._strength.append(0.0)
+        return i
+
+    def _edge_id(self, source: str, target: str, type: str) -> Optional[int]:
+        s, t, ty = self._names.get(source), self._names.get(target), self._types.get(type)
+        if s is None or t is None or ty is None:
+            return None
+        return self._edge_ids.get(self._edge_key(s, t, ty))
+
+    @staticmethod
+    def _edge_key(source: int, target: int, type_id: int) -> int:
+        return (source << (2 * ID_BITS)) | (target << ID_BITS) | type_id
+
+    def _insert_edge(
+        self,
+        source: int,
+        target: int,
+        type_id: int,
+        weight: float,
+        last_seen: int,
+        first_seen: int,
+        count: int,
+    ) -> int:
+        if self._free_edges:
+            e = self._free_edges.pop()
+            self._source[e] = source
+            self._target[e] = target
+            self._edge_type[e] = type_id
+            self._weight[e] = weight
+            self._last_seen[e] = last_seen
+            self._first_seen[e] = first_seen
+            self._count[e] = count
+        else:
+            e = len(self._source)
+            self._source.append(source)
+            self._target.append(target)
+            self._edge_type.append(type_id)
+            self._weight.append(weight)
+            self._last_seen.append(last_seen)
+            self._first_seen.append(first_seen)
+            self._count.append(count)
+            self._edge_gen.append(0)
+        self._edge_gen[e] += 1
+        self._edge_total += 1
+        self._edge_ids[self._edge_key(source, target, type_id)] = e
+        self._index(self._time_keys, self._time_edges, last_seen, e)
+
+        self._out_edges.setdefault(source, array("i")).append(e)
+        self._in_edges.setdefault(target, array("i")).append(e)
+        self._out_degree[source] += 1
+        self._in_degree[target] += 1
+        self._strength[source] += weight
+        self._strength[target] += weight
+        self._rank_edge(e)
+        self._rank_entity(source)
+        self._rank_entity(target)
+        self._type_edges.setdefault(type_id, {})[e] = None
+        if self.retention is not None:
+            self._push_edge(e)
+        return e
+
+    def _remove_edge(self, e: int) -> None:
+        source, target, type_id = self._source[e], self._target[e], self._edge_type[e]
+        key = (self._names[source], self._names[target], self._types[type_id])
+        del self._edge_ids[self._edge_key(source, target, type_id)]
+        self._unindex(self._time_keys, self._time_edges, self._last_seen[e], e)
+        for adjacency, node in ((self._out_edges, source), (self._in_edges, target)):
+            edges = adjacency[node]
+            edges.remove(e)
+            if not edges:
+                del adjacency[node]
+        self._out_degree[source] -= 1
+        self._in_degree[target] -= 1
+        self._strength[source] -= self._weight[e]
+        self._strength[target] -= self._weight[e]
+        self._rank_entity(source)
+        self._rank_entity(target)
+        self._type_edges[type_id].pop(e, None)
+        self.rollups.drop_edge(e, self._first_seen[e], self._last_seen[e])
+        self._count[e] = 0
+        self._free_edges.append(e)
+        self._edge_total -= 1
+        self._touch(e, 1)
+        self._record_removal(key)
+        if self.journal is not None:
+            self.journal.log_remove_relation(*key)
+
+    def _remove_entity(self, i: int) -> int:
+        """Remove entity `i` and its edges; return how many edges went with it."""
+        incident = dict.fromkeys(
+            [*self._out_edges.get(i, ()), *self._in_edges.get(i, ())]
+        )
+        for e in incident:
+            self._remove_edge(e)
+        name = self._names[i]
+        self._unindex(
+            self._entity_time_keys, self._entity_time_ids, self._entity_ts[i], i
+        )
+        self._type_entities[self._entity_type[i]].pop(i, None)
+        self._entity_type[i] = -1
+        self._entity_ts[i] = ABSENT
+        self._entity_attrs[i] = None
+        self._strength[i] = 0.0  # azzera gli scarti di arrotondamento
+        self._entity_count -= 1
+        self._touch(i, 0)
+        self._record_removal(name)
+        self._names.release(i)
+        if self.journal is not None:
+            self.journal.log_remove_entity(name)
+        return len(incident)
+
+    def _rank_edge(self, e: int) -> None:
+        self._edges_by_weight.push(e, self._weight[e])
+        type_id = self._edge_type[e]
+        ranking = self._type_edge_rankings.get(type_id)
+        if ranking is None:
+            ranking = self._type_edge_rankings[type_id] = TopIndex(
+                lambda e: self._count[e] and self._edge_type[e] == type_id,
+                shared=self._edges_by_weight,
+                size=lambda: len(self._type_edges.get(type_id, ())),
+            )
+        ranking.push(e, self._weight[e])
+
+    def _rank_entity(self, i: int) -> None:
+        degree = self._out_degree[i] + self._in_degree[i]
+        self._rankings["degree"].push(i, degree)
+        self._rankings["weight"].push(i, self._strength[i])
+        if self._entity_ts[i] == ABSENT:
+            return
+        type_id = self._entity_type[i]
+        ranking = self._type_entity_rankings.get(type_id)
+        if ranking is None:
+            ranking = self._type_entity_rankings[type_id] = TopIndex(
+                lambda i: (
+                    self._entity_ts[i] != ABSENT and self._entity_type[i] == type_id
+                ),
+                shared=self._rankings["degree"],
+                size=lambda: len(self._type_entities.get(type_id, ())),
+            )
+        ranking.push(i, degree)
+
+    def _record_removal(self, key: Union[str, Tuple[str, str, str]]) -> None:
+        self._removal_versions.append(self.version)
+        self._removals.append(key)
+
+    def _edge_heap_key(self, e: int) -> Tuple[int, int]:
+        return self.retention.edge_key(self._last_seen[e], self._weight[e])
+
+    def _push_edge(self, e: int) -> None:
+        heapq.heappush(self._edge_heap, (*self._edge_heap_key(e), e, self._edge_gen[e]))
+
+    def _push_node(self, i: int) -> None:
+        key = self.retention.node_key(self._entity_ts[i])
+        heapq.heappush(self._node_heap, (*key, i, self._entity_gen[i]))
+
+    def _touch(self, i: int, kind: int) -> None:
+        self.version += 1
+        self._change_versions.append(self.version)
+        self._change_refs.append(i * 2 + kind)
+        if len(self._change_refs) > CHANGE_LOG_LIMIT:
+            # Teniamo la metà più recente; le delta più vecchie richiedono un resync
+            drop = len(self._change_refs) // 2
+            self._change_floor = self._change_versions[drop - 1]
+            del self._change_versions[:drop]
+            del self._change_refs[:drop]
+            drop = bisect_right(self._removal_versions, self._change_floor)
+            del self._removal_versions[:drop]
+            del self._removals[:drop]
+
+    def _aggregate_weight(self, e: int, weight: float) -> float:
+        current = self._weight[e]
+        if self.aggregate == "max":
+            return max(current, weight)
+        elif self.aggregate == "decay":
+            return (1 - self.decay_alpha) * current + self.decay_alpha * weight
+        return current + (weight - current) / (self._count[e] + 1)
+
+    def _entity(self, i: int) -> Entity:
+        return Entity(
+            name=self._names[i],
+            type=self._types[self._entity_type[i]],
+            attributes=self._entity_attrs[i] or {},
+            timestamp=from_micros(self._entity_ts[i]),
+        )
+
+    def _relation(self, e: int) -> Relation:
+        return Relation(
+            source=self._names[self._source[e]],
+            target=self._names[self._target[e]],
+            type=self._types[self._edge_type[e]],
+            weight=self._weight[e],
+            timestamp=from_micros(self._last_seen[e]),
+            count=self._count[e],
+            first_seen=from_micros(self._first_seen[e]),
+        )
+
+    def _incident(self, node: int, direction: str) -> Iterable[int]:
+        if direction == "out":
+            return self._out_edges.get(node, ())
+        if direction == "in":
+            return self._in_edges.get(node, ())
+        return [*self._out_edges.get(node, ()), *self._in_edges.get(node, ())]
+
+    def _filter_edges(
+        self, edges: Iterable[int], min_weight: float, cutoff: int
+    ) -> Iterator[int]:
+        weight, last_seen, entity_ts = self._weight, self._last_seen, self._entity_ts
+        source, target = self._source, self._target
+        for e in edges:
+            if weight[e] < min_weight or last_seen[e] < cutoff:
+                continue
+            # Come in window(): anche gli estremi devono essere nella finestra
+            if entity_ts[source[e]] < cutoff or entity_ts[target[e]] < cutoff:
+                continue
+            if entity_ts[source[e]] == ABSENT or entity_ts[target[e]] == ABSENT:
+                continue
+            yield e
+
+    def _strongest(self, edges: Iterable[int], min_weight: float, cutoff: int) -> List[int]:
+        return sorted(
+            self._filter_edges(edges, min_weight, cutoff),
+            key=self._weight.__getitem__,
+            reverse=True,
+        )
+
+    @staticmethod
+    def _index(keys: array, ids: array, ts: int, i: int) -> None:
+        pos = bisect_right(keys, ts)
+        keys.insert(pos, ts)
+        ids.insert(pos, i)
+
+    @staticmethod
+    def _unindex(keys: array, ids: array, ts: int, i: int) -> None:
+        # Tra le voci con lo stesso timestamp cerchiamo quella con l'id giusto
+        lo = bisect_left(keys, ts)
+        hi = bisect_right(keys, ts, lo=lo)
+        for pos in range(lo, hi):
+            if ids[pos] == i:
+                del keys[pos]
+                del ids[pos]
+                return
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_content(text: str) -> str:
+    """Unicode (NFKC) and whitespace normalization used for cache keys."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(
+    provider: str, model: str, temperature: float, system: str, content: str
+) -> str:
+    """Content address of an LLM request (sha256 over the parts that shape the reply)."""
+    payload = json.dumps(
+        [provider, model, temperature, system, normalize_content(content)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of raw LLM responses keyed by `cache_key`.
+
+    The first tier is an in-memory LRU; the optional second tier is a SQLite
+    file with TTL and size-based eviction, so hits survive restarts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        directory: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_disk_entries: int = 100000,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0}
+
+        self._db = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(directory, "responses.sqlite3"), check_same_thread=False
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT, created REAL, accessed REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+            self._db.commit()
+
+    @classmethod
+    def from_config(cls, settings: Dict[str, Any], directory: Optional[str] = None):
+        disk = settings.get("disk") or {}
+        return cls(
+            max_entries=settings.get("max_entries", 1024),
+            directory=directory if disk.get("enabled") else None,
+            ttl_seconds=disk.get("ttl_seconds"),
+            max_disk_entries=disk.get("max_entries", 100000),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return response
+
+            if self._db is not None:
+                response = self._disk_get(key)
+                if response is not None:
+                    self._remember(key, response)
+                    self.counters["disk_hits"] += 1
+                    return response
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        with self._lock:
+            self._remember(key, response)
+            self.counters["puts"] += 1
+            if self._db is not None:
+                now = time.time()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, response, now, now),
+                )
+                # Eviction ammortizzata: controlliamo la dimensione ogni 100 inserimenti
+                if self.counters["puts"] % 100 == 0:
+                    self._disk_evict(now)
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hits": hits,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._db is not None,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def _remember(self, key: str, response: str) -> None:
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT response, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created = row
+        now = time.time()
+        if self.ttl_seconds is not None and now - created > self.ttl_seconds:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        return response
+
+    def _disk_evict(self, now: float) -> None:
+        if self.ttl_seconds is not None:
+            self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)
+            )
+        (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_disk_entries:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self.max_disk_entries,),
+            )
@@ -0,0 +1,58 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def get_utc_now() -> datetime:
+    """Helper function to get current UTC time."""
+    return datetime.now(timezone.utc)
+
+
+def to_micros(timestamp: datetime) -> int:
+    """Exact integer microseconds since the epoch (no float rounding)."""
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+@dataclass(frozen=True)
+class Entity:
+    name: str
+    type: str
+    attributes: Dict[str, str] = field(default_factory=dict)
+    timestamp: datetime = field(default_factory=get_utc_now)
+
+    def __hash__(self):
+        return hash((self.name, self.type))
+
+    def __eq__(self, other):
+        if not isinstance(other, Entity):
+            return NotImplemented
+        return self.name == other.name and self.type == other.type
+
+
+@dataclass(slots=True)
+class Relation:
+    """An edge of the graph.
+
+    As extracted from a message it is a single observation; inside the
+    GraphStore it is the aggregate of every restatement of the same
+    (source, target, type): `weight` is the aggregated weight, `count` the
+    number of observations and `timestamp` the last time it was seen.
+    """
+
+    source: str
+    target: str
+    type: str
+    weight: float = 1.0
+    timestamp: datetime = field(default_factory=get_utc_now)
+    count: int = 1
+    first_seen: Optional[datetime] = None
+
+    def __post_init__(self):
+        if self.first_seen is None:
+            self.first_seen = self.timestamp
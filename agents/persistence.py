@@ -0,0 +1,375 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from agents.models import Entity, Relation, from_micros, to_micros
+
+if TYPE_CHECKING:
+    from agents.graph_store import GraphStore
+    from agents.rollups import TemporalRollups
+    from agents.snapshot import GraphSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class GraphJournal:
+    """Durable storage for a GraphStore: append-only log plus SQLite snapshots.
+
+    Every mutation is appended to `wal.jsonl` as one JSON line with a
+    sequence number. Every `snapshot_every` records the whole graph is written
+    to `snapshot.sqlite3` (atomically, via a temp file) and the log is
+    truncated, so startup loads the snapshot and replays only the log tail.
+    The snapshot also holds the store's time rollups, which cannot be
+    recomputed from the aggregated edges.
+
+    The periodic snapshot does not block writers: commit() moves the log to
+    `wal.old.jsonl` and a background thread writes the snapshot from the
+    store's published GraphSnapshot, which never changes; new records go to
+    a fresh `wal.jsonl`. The old log is deleted once the snapshot is in
+    place, and replayed before the new one if the process dies first.
+    """
+
+    WAL_FILE = "wal.jsonl"
+    OLD_WAL_FILE = "wal.old.jsonl"
+    SNAPSHOT_FILE = "snapshot.sqlite3"
+
+    def __init__(self, directory: str, snapshot_every: int = 10000, fsync: bool = False):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.wal_path = os.path.join(directory, self.WAL_FILE)
+        self.old_wal_path = os.path.join(directory, self.OLD_WAL_FILE)
+        self.snapshot_path = os.path.join(directory, self.SNAPSHOT_FILE)
+        self.seq = 0
+        self.records_since_snapshot = 0
+        os.makedirs(directory, exist_ok=True)
+        self._wal = None
+        self._writer: Optional[threading.Thread] = None
+
+    def load(self, store: "GraphStore") -> None:
+        """Rebuild `store` from the latest snapshot and the log tail."""
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            snapshot_seq = self._load_snapshot(store)
+        self.seq = snapshot_seq
+
+        replayed = 0
+        # Il log vecchio esiste solo se il processo è morto durante uno snapshot
+        for path in (self.old_wal_path, self.wal_path):
+            if os.path.exists(path):
+                replayed += self._replay(store, path, snapshot_seq)
+        self.records_since_snapshot = replayed
+
+        logger.info(
+            f"Loaded graph from {self.directory}: {len(store.entities)} entities, "
+            f"{len(store.relations)} relations ({replayed} log records replayed)"
+        )
+
+    def log_entity(self, entity: Entity, mention: bool = True) -> None:
+        record = {
+            "op": "entity",
+            "name": entity.name,
+            "type": entity.type,
+            "attributes": entity.attributes,
+            "ts": to_micros(entity.timestamp),
+        }
+        if not mention:
+            record["mention"] = False
+        self._append(record)
+
+    def log_relation(self, relation: Relation) -> None:
+        self._append(
+            {
+                "op": "relation",
+                "source": relation.source,
+                "target": relation.target,
+                "type": relation.type,
+                "weight": relation.weight,
+                "ts": to_micros(relation.timestamp),
+            }
+        )
+
+    def log_remove_entity(self, name: str) -> None:
+        self._append({"op": "remove_entity", "name": name})
+
+    def log_remove_relation(self, source: str, target: str, type: str) -> None:
+        self._append(
+            {"op": "remove_relation", "source": source, "target": target, "type": type}
+        )
+
+    def log_reset(self) -> None:
+        self._append({"op": "reset"})
+
+    def commit(self, store: "GraphStore") -> None:
+        """Flush the records of one logical write; start a snapshot when due.
+
+        `store.snapshot` must be the committed version (GraphStore.commit
+        publishes it first).
+        """
+        if self._wal is not None:
+            self._wal.flush()
+            if self.fsync:
+                os.fsync(self._wal.fileno())
+        writing = self._writer is not None and self._writer.is_alive()
+        # Uno snapshot alla volta: se il precedente non ha finito si riprova al prossimo commit
+        if self.records_since_snapshot >= self.snapshot_every and not writing:
+            self._start_snapshot(store)
+
+    def snapshot(self, store: "GraphStore") -> None:
+        """Write the whole graph to a new snapshot and truncate the log, now."""
+        self.wait()
+        if self._wal is not None:
+            self._wal.flush()
+        self._start_snapshot(store)
+        self.wait()
+
+    def wait(self) -> None:
+        """Block until the snapshot being written in the background, if any, is done."""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def _start_snapshot(self, store: "GraphStore") -> None:
+        # Sotto il lock dello scrittore: si fissano la versione e una copia dei
+        # rollup (il GraphSnapshot è immutabile, i rollup no) e si ruota il log
+        snapshot = store.snapshot
+        rollups = store.rollups.copy()
+        seq = self.seq
+        if self._wal is not None:
+            self._wal.close()
+        if os.path.exists(self.old_wal_path):
+            # Uno snapshot precedente è fallito: il suo log va tenuto, in coda il nuovo
+            if os.path.exists(self.wal_path):
+                with open(self.old_wal_path, "ab") as old, open(self.wal_path, "rb") as wal:
+                    old.write(wal.read())
+                os.remove(self.wal_path)
+        elif os.path.exists(self.wal_path):
+            os.replace(self.wal_path, self.old_wal_path)
+        self._wal = open(self.wal_path, "a", encoding="utf-8")
+        self.records_since_snapshot = 0
+        self._writer = threading.Thread(
+            target=self._write_snapshot,
+            args=(snapshot, rollups, seq),
+            name="graph-snapshot",
+            daemon=True,
+        )
+        self._writer.start()
+
+    def _write_snapshot(
+        self, snapshot: "GraphSnapshot", rollups: "TemporalRollups", seq: int
+    ) -> None:
+        try:
+            self._write_sqlite(snapshot, rollups, seq)
+        except Exception as e:
+            # Il log vecchio resta: il prossimo snapshot (o l'avvio) lo recupera
+            logger.error(f"Error writing graph snapshot at seq {seq}: {str(e)}")
+            return
+        if os.path.exists(self.old_wal_path):
+            os.remove(self.old_wal_path)
+        logger.info(f"Wrote graph snapshot at seq {seq} to {self.snapshot_path}")
+
+    def _write_sqlite(
+        self, snapshot: "GraphSnapshot", rollups: "TemporalRollups", seq: int
+    ) -> None:
+        """Write `snapshot` (the store at `seq`) to the snapshot file, atomically."""
+        tmp_path = self.snapshot_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(
+                """
+                PRAGMA journal_mode = OFF;
+                PRAGMA synchronous = OFF;
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE entities (
+                    name TEXT PRIMARY KEY, type TEXT, attributes TEXT, ts INTEGER
+                );
+                CREATE TABLE relations (
+                    source TEXT, target TEXT, type TEXT, weight REAL, ts INTEGER,
+                    count INTEGER, first_seen INTEGER
+                );
+                CREATE TABLE rollups (
+                    bucket TEXT, idx INTEGER, kind TEXT, type TEXT,
+                    source TEXT, target TEXT, count INTEGER, weight REAL
+                );
+                """
+            )
+            conn.executemany(
+                "INSERT INTO entities VALUES (?, ?, ?, ?)",
+                (
+                    (e.name, e.type, json.dumps(e.attributes), to_micros(e.timestamp))
+                    for e in snapshot.entities()
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO relations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        r.source,
+                        r.target,
+                        r.type,
+                        r.weight,
+                        to_micros(r.timestamp),
+                        r.count,
+                        to_micros(r.first_seen),
+                    )
+                    for r in snapshot.relations()
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                snapshot.rollup_rows(rollups.rows()),
+            )
+            conn.execute("INSERT INTO meta VALUES ('seq', ?)", (str(seq),))
+            conn.commit()
+        finally:
+            conn.close()
+
+        if self.fsync:
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def close(self) -> None:
+        self.wait()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        if self._wal is None:
+            self._wal = open(self.wal_path, "a", encoding="utf-8")
+        self.seq += 1
+        self.records_since_snapshot += 1
+        record["seq"] = self.seq
+        self._wal.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _replay(self, store: "GraphStore", path: str, after: int) -> int:
+        """Apply the records of the log at `path` with seq > `after`; return how many.
+
+        A crash can cut the last line short: it is dropped and the file
+        truncated after the last complete record, so the next append starts
+        on a line of its own.
+        """
+        replayed = 0
+        complete = 0
+        with open(path, "r+b") as wal:
+            for line in wal:
+                if not line.endswith(b"\n"):
+                    logger.warning(f"Dropping torn record at the end of {path}")
+                    break
+                complete += len(line)
+                record = self._parse(line)
+                if record is None:
+                    logger.warning(f"Skipping unreadable record in {path}")
+                    continue
+                if record["seq"] <= after:
+                    continue
+                self._apply(store, record)
+                self.seq = record["seq"]
+                replayed += 1
+            wal.truncate(complete)
+        return replayed
+
+    @staticmethod
+    def _parse(line: bytes) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(line)
+        except ValueError:
+            pass
+        # Prima di questa correzione un append dopo una riga troncata finiva sulla
+        # stessa riga: il record completo è quello che comincia per ultimo
+        start = line.rfind(b'{"op":')
+        if start > 0:
+            try:
+                return json.loads(line[start:])
+            except ValueError:
+                pass
+        return None
+
+    def _load_snapshot(self, store: "GraphStore") -> int:
+        conn = sqlite3.connect(self.snapshot_path)
+        # I record dello snapshot non sono nuove osservazioni per i rollup
+        store.record_history = False
+        try:
+            (seq,) = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+            for name, type_, attributes, ts in conn.execute(
+                "SELECT name, type, attributes, ts FROM entities ORDER BY ts"
+            ):
+                store.add_entity(
+                    Entity(
+                        name=name,
+                        type=type_,
+                        attributes=json.loads(attributes),
+                        timestamp=from_micros(ts),
+                    )
+                )
+            # rowid order = ordine temporale dello store al momento dello snapshot;
+            # le relazioni sono già aggregate, quindi non vanno ri-osservate
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(relations)")}
+            aggregated = "count" in columns
+            query = (
+                "SELECT source, target, type, weight, ts, count, first_seen "
+                if aggregated
+                else "SELECT source, target, type, weight, ts, 1, ts "
+            ) + "FROM relations ORDER BY rowid"
+            for source, target, type_, weight, ts, count, first_seen in conn.execute(
+                query
+            ):
+                relation = Relation(
+                    source=source,
+                    target=target,
+                    type=type_,
+                    weight=weight,
+                    timestamp=from_micros(ts),
+                    count=count,
+                    first_seen=from_micros(first_seen),
+                )
+                if aggregated:
+                    store.restore_relation(relation)
+                else:
+                    store.add_relation(relation)
+
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+            if "rollups" in tables:
+                for row in conn.execute("SELECT * FROM rollups"):
+                    store.restore_rollup(*row)
+        finally:
+            store.record_history = True
+            conn.close()
+        return int(seq)
+
+    @staticmethod
+    def _apply(store: "GraphStore", record: Dict[str, Any]) -> None:
+        op = record["op"]
+        if op == "entity":
+            store.add_entity(
+                Entity(
+                    name=record["name"],
+                    type=record["type"],
+                    attributes=record["attributes"],
+                    timestamp=from_micros(record["ts"]),
+                ),
+                mention=record.get("mention", True),
+            )
+        elif op == "relation":
+            store.add_relation(
+                Relation(
+                    source=record["source"],
+                    target=record["target"],
+                    type=record["type"],
+                    weight=record["weight"],
+                    timestamp=from_micros(record["ts"]),
+                )
+            )
+        elif op == "remove_entity":
+            store.remove_entity(record["name"])
+        elif op == "remove_relation":
+            store.remove_relation(record["source"], record["target"], record["type"])
+        elif op == "reset":
+            store.clear()
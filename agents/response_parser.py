@@ -0,0 +1,289 @@
+import json
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from agents.metrics import EXTRACTION_PARSE_FAILURES
+from agents.models import Entity, Relation
+
+logger = logging.getLogger(__name__)
+
+Item = Union[Entity, Relation]
+
+# Formati di risposta dell'estrazione (agent.output_format in config.yaml)
+OUTPUT_FORMATS = ("text", "json")
+
+# Recinto ```json ... ``` che alcuni modelli aggiungono anche in modalità JSON
+CODE_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+
+class ExtractionStreamParser:
+    """Incremental parser for the ENTITIES/RELATIONS reply format.
+
+    Text is fed in arbitrary chunks (as tokens arrive from a streaming call)
+    and each line is looked at once. An entity is emitted when the next
+    block or section starts, since its attributes are open-ended; a relation
+    is emitted as soon as it has source, target, type and weight. Blocks
+    missing a required field are dropped on their own instead of failing the
+    whole reply.
+    """
+
+    def __init__(self, timestamp: datetime):
+        self.timestamp = timestamp
+        self.section: Optional[str] = None  # None -> "entities" -> "relations"
+        self.seen_entities_section = False
+        self.entities: List[Entity] = []
+        self.relations: List[Relation] = []
+        self._buffer = ""
+        self._block: Optional[Dict] = None
+        self._in_attributes = False
+        self._emitted = False
+
+    def feed(self, chunk: str) -> List[Item]:
+        """Consume a chunk of text; return the blocks it completed."""
+        self._buffer += chunk
+        if "\n" not in self._buffer:
+            return []
+        *lines, self._buffer = self._buffer.split("\n")
+        items: List[Item] = []
+        for line in lines:
+            self._line(line, items)
+        return items
+
+    def close(self) -> List[Item]:
+        """Flush the trailing line and the last open block."""
+        items: List[Item] = []
+        if self._buffer:
+            self._line(self._buffer, items)
+            self._buffer = ""
+        self._finish_block(items)
+        if not self.seen_entities_section:
+            logger.warning("No ENTITIES section found in response")
+            EXTRACTION_PARSE_FAILURES.inc(format="text")
+        return items
+
+    def result(self) -> Tuple[List[Entity], List[Relation]]:
+        return self.entities, self.relations
+
+    def _line(self, raw: str, items: List[Item]) -> None:
+        line = raw.strip()
+        if not line:
+            return
+        if "ENTITIES:" in line:
+            self._finish_block(items)
+            self.section = "entities"
+            self.seen_entities_section = True
+            return
+        if "RELATIONS:" in line:
+            self._finish_block(items)
+            self.section = "relations" if self.seen_entities_section else None
+            return
+
+        if self.section == "entities":
+            if line.startswith("- name:"):
+                self._finish_block(items)
+                self._block = {"name": self._value(line), "attributes": {}}
+                self._in_attributes = False
+            elif self._block is None:
+                return
+            elif line.startswith("type:"):
+                self._block["type"] = self._value(line)
+            elif line.startswith("attributes:"):
+                self._in_attributes = True
+            elif self._in_attributes and ":" in line:
+                key, value = [x.strip() for x in line.split(":", 1)]
+                self._block["attributes"][key] = value
+
+        elif self.section == "relations":
+            if line.startswith("- source:"):
+                self._finish_block(items)
+                self._block = {"source": self._value(line)}
+                self._emitted = False
+            elif self._block is None or self._emitted:
+                return
+            elif line.startswith("target:"):
+                self._block["target"] = self._value(line)
+            elif line.startswith("type:"):
+                self._block["type"] = self._value(line)
+            elif line.startswith("weight:"):
+                try:
+                    self._block["weight"] = float(self._value(line))
+                except ValueError:
+                    self._block["weight"] = 1.0
+            if self._block.keys() >= {"source", "target", "type", "weight"}:
+                self._emit_relation(self._block, items)
+                self._emitted = True
+
+    def _finish_block(self, items: List[Item]) -> None:
+        block, self._block = self._block, None
+        if block is None:
+            return
+        if "name" in block:
+            if "type" not in block:
+                logger.warning(f"Skipping entity without type: {block['name']}")
+                return
+            entity = Entity(**block, timestamp=self.timestamp)
+            self.entities.append(entity)
+            items.append(entity)
+        elif not self._emitted:
+            # Relazione senza weight: vale il default di Relation
+            self._emit_relation(block, items)
+        self._emitted = False
+
+    def _emit_relation(self, block: Dict, items: List[Item]) -> None:
+        if not block.keys() >= {"source", "target", "type"}:
+            logger.warning(f"Skipping incomplete relation: {block}")
+            return
+        relation = Relation(**block, timestamp=self.timestamp)
+        self.relations.append(relation)
+        items.append(relation)
+
+    @staticmethod
+    def _value(line: str) -> str:
+        return line.split(":", 1)[1].strip()
+
+
+def parse_extraction(
+    response: str, timestamp: datetime
+) -> Tuple[List[Entity], List[Relation]]:
+    """Parse a complete reply in a single pass."""
+    parser = ExtractionStreamParser(timestamp)
+    parser.feed(response)
+    parser.close()
+    return parser.result()
+
+
+class JsonExtractionStreamParser:
+    """Parser for the compact JSON reply format, with the stream interface.
+
+    A JSON document cannot be decoded before it is complete, so chunks are
+    only buffered and every item is emitted by close().
+    """
+
+    def __init__(self, timestamp: datetime):
+        self.timestamp = timestamp
+        self.entities: List[Entity] = []
+        self.relations: List[Relation] = []
+        self._chunks: List[str] = []
+
+    def feed(self, chunk: str) -> List[Item]:
+        self._chunks.append(chunk)
+        return []
+
+    def close(self) -> List[Item]:
+        self.entities, self.relations = parse_json_extraction(
+            "".join(self._chunks), self.timestamp
+        )
+        self._chunks = []
+        return [*self.entities, *self.relations]
+
+    def result(self) -> Tuple[List[Entity], List[Relation]]:
+        return self.entities, self.relations
+
+
+def stream_parser(output_format: str, timestamp: datetime):
+    """Incremental parser for replies in `output_format`."""
+    if output_format == "json":
+        return JsonExtractionStreamParser(timestamp)
+    return ExtractionStreamParser(timestamp)
+
+
+def decode_json_reply(response: str) -> Any:
+    """Decode a JSON reply (tolerating a code fence); None if it is not JSON."""
+    match = CODE_FENCE_RE.match(response)
+    try:
+        return json.loads(match.group(1) if match else response)
+    except ValueError:
+        return None
+
+
+def parse_json_extraction(
+    response: str, timestamp: datetime
+) -> Tuple[List[Entity], List[Relation]]:
+    """Parse a reply in the compact JSON format with a single decode.
+
+    The format is {"e": [{"n": name, "t": type, "a": {attributes}}],
+    "r": [{"s": source, "o": target, "t": type, "w": weight}]}, where the
+    relation endpoints are indexes into "e" (names are accepted too).
+    Malformed entries are dropped one by one; only a reply that is not a
+    JSON object fails as a whole.
+    """
+    data = decode_json_reply(response)
+    if not isinstance(data, dict):
+        logger.warning("Response is not a JSON object")
+        EXTRACTION_PARSE_FAILURES.inc(format="json")
+        return [], []
+    return extraction_from_json(data, timestamp)
+
+
+def extraction_from_json(
+    data: Dict[str, Any], timestamp: datetime
+) -> Tuple[List[Entity], List[Relation]]:
+    """Entities and relations of one decoded extraction object."""
+    entities: List[Entity] = []
+    # Nome per indice di "e" (None per le voci scartate, per non spostare gli indici)
+    names: List[Optional[str]] = []
+    for item in _as_list(data.get("e")):
+        name, type_ = _text(item, "n"), _text(item, "t")
+        if name is None or type_ is None:
+            logger.warning(f"Skipping malformed entity: {item}")
+            names.append(None)
+            continue
+        attributes = item.get("a")
+        if not isinstance(attributes, dict):
+            attributes = {}
+        entities.append(
+            Entity(
+                name=name,
+                type=type_,
+                attributes={str(k): str(v) for k, v in attributes.items()},
+                timestamp=timestamp,
+            )
+        )
+        names.append(name)
+
+    relations: List[Relation] = []
+    for item in _as_list(data.get("r")):
+        if not isinstance(item, dict):
+            continue
+        source = _endpoint(item.get("s"), names)
+        target = _endpoint(item.get("o"), names)
+        type_ = _text(item, "t")
+        if source is None or target is None or type_ is None:
+            logger.warning(f"Skipping malformed relation: {item}")
+            continue
+        weight = item.get("w", 1.0)
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+            weight = 1.0
+        relations.append(
+            Relation(
+                source=source,
+                target=target,
+                type=type_,
+                weight=float(weight),
+                timestamp=timestamp,
+            )
+        )
+    return entities, relations
+
+
+def _as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else []
+
+
+def _text(item: Any, key: str) -> Optional[str]:
+    if not isinstance(item, dict):
+        return None
+    value = item.get(key)
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()
+
+
+def _endpoint(value: Any, names: List[Optional[str]]) -> Optional[str]:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return names[value] if 0 <= value < len(names) else None
+    if isinstance(value, str) and value.strip():
+        return value.strip()
+    return None
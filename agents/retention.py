@@ -0,0 +1,68 @@
+import math
+from typing import Any, Dict, Tuple
+
+DAY = 86400 * 10**6
+# Scadenza di ciò che non scade mai per tempo (resta ordinato per ultimo avvistamento)
+NEVER = 2**62
+
+
+class RetentionPolicy:
+    """Size and age limits of a GraphStore.
+
+    Every edge gets a deadline when it is written: the earlier of
+    `max_age` after it was last seen and the time at which its weight,
+    halving every `half_life`, falls below `min_confidence`. Both only move
+    when the edge is restated, so the store can keep edges in a heap by
+    deadline and evict the expired ones from the top in a few steps per
+    write, never sweeping the graph. Over `max_edges` (or `max_nodes`),
+    the edges (entities) closest to expiring, then least recently seen,
+    go first. Times are in microseconds since the epoch.
+    """
+
+    def __init__(
+        self,
+        max_nodes: int = 0,
+        max_edges: int = 0,
+        max_age_days: float = 0,
+        half_life_days: float = 0,
+        min_confidence: float = 0.0,
+        steps_per_write: int = 64,
+    ):
+        self.max_nodes = max_nodes
+        self.max_edges = max_edges
+        self.max_age = int(max_age_days * DAY)
+        self.half_life = int(half_life_days * DAY)
+        self.min_confidence = min_confidence
+        self.steps_per_write = steps_per_write
+
+    @classmethod
+    def from_config(cls, settings: Dict[str, Any]) -> "RetentionPolicy":
+        return cls(
+            max_nodes=settings.get("max_nodes") or 0,
+            max_edges=settings.get("max_edges") or 0,
+            max_age_days=settings.get("max_age_days") or 0,
+            half_life_days=settings.get("half_life_days") or 0,
+            min_confidence=settings.get("min_confidence") or 0.0,
+            steps_per_write=settings.get("steps_per_write", 64),
+        )
+
+    def decay(self, weight: float, elapsed: int) -> float:
+        """`weight` after `elapsed` microseconds of exponential decay."""
+        if not self.half_life or elapsed <= 0:
+            return weight
+        return weight * 0.5 ** (elapsed / self.half_life)
+
+    def edge_key(self, last_seen: int, weight: float) -> Tuple[int, int]:
+        """(deadline, last seen) heap key of an edge; deadline NEVER if it does not expire."""
+        deadline = last_seen + self.max_age if self.max_age else NEVER
+        if self.min_confidence > 0:
+            if weight < self.min_confidence:
+                deadline = last_seen
+            elif self.half_life:
+                life = self.half_life * math.log2(weight / self.min_confidence)
+                deadline = min(deadline, last_seen + int(life))
+        return deadline, last_seen
+
+    def node_key(self, timestamp: int) -> Tuple[int, int]:
+        """(deadline, last mention) heap key of an entity."""
+        return (timestamp + self.max_age if self.max_age else NEVER), timestamp
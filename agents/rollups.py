@@ -0,0 +1,176 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Ampiezza dei bucket in microsecondi
+BUCKETS = {
+    "hour": 3600 * 10**6,
+    "day": 86400 * 10**6,
+    "week": 7 * 86400 * 10**6,
+}
+# L'epoca (1970-01-01) è un giovedì: con 3 giorni di scarto le settimane partono dal lunedì
+BUCKET_OFFSETS = {"hour": 0, "day": 0, "week": 3 * 86400 * 10**6}
+
+
+def bucket_index(ts: int, bucket: str) -> int:
+    return (ts + BUCKET_OFFSETS[bucket]) // BUCKETS[bucket]
+
+
+def bucket_start(index: int, bucket: str) -> int:
+    """Start of bucket `index`, in microseconds since the epoch."""
+    return index * BUCKETS[bucket] - BUCKET_OFFSETS[bucket]
+
+
+class Rollup:
+    """Per-bucket counters at one granularity.
+
+    `entities` counts entity mentions per entity type id, `relations` counts
+    relation observations per relation type id, and `edges` keeps
+    (observations, weight sum) per edge id, so the mean weight of an edge in
+    a bucket is sum / count. `filled` lists the buckets with data in order.
+    Every value is immutable, so copy() only copies dicts.
+    """
+
+    __slots__ = ("bucket", "entities", "relations", "edges", "filled")
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+        self.entities: Dict[int, Dict[int, int]] = {}
+        self.relations: Dict[int, Dict[int, int]] = {}
+        self.edges: Dict[int, Dict[int, Tuple[int, float]]] = {}
+        self.filled: List[int] = []
+
+    def table(self, rows: Dict[int, Dict], b: int) -> Dict:
+        """The row of bucket `b` in `rows` (entities, relations or edges), created if missing."""
+        row = rows.get(b)
+        if row is None:
+            row = rows[b] = {}
+            filled = self.filled
+            # Quasi sempre il bucket nuovo è l'ultimo: append senza bisect
+            if not filled or filled[-1] < b:
+                filled.append(b)
+            else:
+                pos = bisect_left(filled, b)
+                if filled[pos] != b:
+                    filled.insert(pos, b)
+        return row
+
+    def add_entity(self, ts: int, type_id: int) -> None:
+        counts = self.table(self.entities, bucket_index(ts, self.bucket))
+        counts[type_id] = counts.get(type_id, 0) + 1
+
+    def add_relation(self, ts: int, type_id: int, edge: int, weight: float) -> None:
+        b = bucket_index(ts, self.bucket)
+        counts = self.table(self.relations, b)
+        counts[type_id] = counts.get(type_id, 0) + 1
+        edges = self.table(self.edges, b)
+        count, total = edges.get(edge, (0, 0.0))
+        edges[edge] = (count + 1, total + weight)
+
+    def copy(self) -> "Rollup":
+        rollup = Rollup(self.bucket)
+        for name in ("entities", "relations", "edges"):
+            setattr(rollup, name, {b: row.copy() for b, row in getattr(self, name).items()})
+        rollup.filled = self.filled.copy()
+        return rollup
+
+    def buckets(self, start: int, end: int) -> List[int]:
+        """Bucket indexes with data between the `start` and `end` timestamps.
+
+        Two bisects on `filled`: the cost is the number of buckets returned,
+        however wide the range or long the history.
+        """
+        filled = self.filled
+        return filled[
+            bisect_left(filled, bucket_index(start, self.bucket)) :
+            bisect_right(filled, bucket_index(end, self.bucket))
+        ]
+
+    def expire(self, before: int) -> int:
+        """Drop the buckets that end before the `before` timestamp; return how many."""
+        filled = self.filled
+        cut = bisect_left(filled, bucket_index(before, self.bucket))
+        for b in filled[:cut]:
+            self.entities.pop(b, None)
+            self.relations.pop(b, None)
+            self.edges.pop(b, None)
+        del filled[:cut]
+        return cut
+
+
+class TemporalRollups:
+    """Incrementally updated hour/day/week rollups of a GraphStore.
+
+    `keep` is how long (microseconds) each granularity keeps its buckets;
+    a missing or zero entry keeps them forever.
+    """
+
+    def __init__(self, keep: Optional[Dict[str, int]] = None):
+        self.rollups = {bucket: Rollup(bucket) for bucket in BUCKETS}
+        self.keep = {bucket: age for bucket, age in (keep or {}).items() if age}
+
+    def __getitem__(self, bucket: str) -> Rollup:
+        return self.rollups[bucket]
+
+    def add_entity(self, ts: int, type_id: int) -> None:
+        for rollup in self.rollups.values():
+            rollup.add_entity(ts, type_id)
+
+    def add_relation(self, ts: int, type_id: int, edge: int, weight: float) -> None:
+        for rollup in self.rollups.values():
+            rollup.add_relation(ts, type_id, edge, weight)
+
+    def drop_edge(self, edge: int, first: int, last: int) -> None:
+        """Forget the per-bucket stats of an edge seen between `first` and `last`.
+
+        Only the filled buckets of that span are visited (see Rollup.buckets),
+        so the cost follows the edge's lifetime, not the whole history.
+        """
+        for rollup in self.rollups.values():
+            for b in rollup.buckets(first, last):
+                edges = rollup.edges.get(b)
+                if edges is not None and edges.pop(edge, None) is not None and not edges:
+                    del rollup.edges[b]
+
+    def copy(self) -> "TemporalRollups":
+        """An independent copy, e.g. to serialize off the writer's thread."""
+        rollups = TemporalRollups()
+        rollups.rollups = {bucket: r.copy() for bucket, r in self.rollups.items()}
+        rollups.keep = dict(self.keep)
+        return rollups
+
+    def expire(self, now: int) -> int:
+        """Drop the buckets older than their granularity's `keep`; return how many."""
+        return sum(
+            self.rollups[bucket].expire(now - age) for bucket, age in self.keep.items()
+        )
+
+    def rows(self) -> Iterator[Tuple[str, int, str, int, int, float]]:
+        """(bucket, index, kind, id, count, weight sum) rows for snapshots.
+
+        `id` is a type id for "entity"/"relation" rows and an edge id for
+        "edge" rows; the caller translates ids to names.
+        """
+        for bucket, rollup in self.rollups.items():
+            for b, counts in rollup.entities.items():
+                for type_id, count in counts.items():
+                    yield bucket, b, "entity", type_id, count, 0.0
+            for b, counts in rollup.relations.items():
+                for type_id, count in counts.items():
+                    yield bucket, b, "relation", type_id, count, 0.0
+            for b, edges in rollup.edges.items():
+                for edge, (count, weight) in edges.items():
+                    yield bucket, b, "edge", edge, count, weight
+
+    def restore(
+        self, bucket: str, index: int, kind: str, id: int, count: int, weight: float
+    ) -> None:
+        """Add back one row produced by rows()."""
+        rollup = self.rollups[bucket]
+        rows = {"entity": rollup.entities, "relation": rollup.relations}.get(kind)
+        if rows is not None:
+            counts = rollup.table(rows, index)
+            counts[id] = counts.get(id, 0) + count
+        else:
+            edges = rollup.table(rollup.edges, index)
+            previous, total = edges.get(id, (0, 0.0))
+            edges[id] = (previous + count, total + weight)
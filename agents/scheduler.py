@@ -0,0 +1,465 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from agents.base_agent import estimate_tokens
+from agents.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LLM_RETRIES = REGISTRY.counter(
+    "iotmag_llm_retries_total",
+    "Failed LLM attempts that were retried, by provider and reason.",
+    labels=("provider", "reason"),
+)
+LLM_FAILOVERS = REGISTRY.counter(
+    "iotmag_llm_failovers_total",
+    "Calls answered by a provider other than the preferred one.",
+    labels=("provider",),
+)
+LLM_HEDGES = REGISTRY.counter(
+    "iotmag_llm_hedges_total", "Hedged requests sent to a secondary provider."
+)
+LLM_THROTTLE_SECONDS = REGISTRY.counter(
+    "iotmag_llm_throttle_seconds_total",
+    "Time spent waiting for a provider's RPM/TPM budget.",
+    labels=("provider",),
+)
+
+
+class Budget:
+    """Token bucket refilled continuously at `per_minute` / 60 units per second."""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.per_minute = per_minute
+        self.available = float(per_minute or 0)
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 when unlimited)."""
+        if not self.per_minute:
+            return 0.0
+        self._refill()
+        # Una richiesta più grande del budget intero aspetta solo il bucket pieno
+        amount = min(amount, self.per_minute)
+        missing = amount - self.available
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def consume(self, amount: float) -> None:
+        if self.per_minute:
+            self._refill()
+            self.available -= amount
+
+    def exhaust(self) -> None:
+        if self.per_minute:
+            self.available = min(self.available, 0.0)
+            self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            float(self.per_minute),
+            self.available + (now - self.updated) * self.per_minute / 60,
+        )
+        self.updated = now
+
+
+class ProviderState:
+    """One provider client with its rate budgets and recent health."""
+
+    def __init__(self, name: str, client: BaseChatModel, settings: Dict[str, Any], window: int):
+        self.name = name
+        self.client = client
+        self.requests = Budget(settings.get("rpm"))
+        self.tokens = Budget(settings.get("tpm"))
+        self.expected_output = settings.get("expected_output_tokens", 400)
+        # Esiti recenti: (ok, latenza in secondi)
+        self.outcomes: deque = deque(maxlen=window)
+        self.cooldown_until = 0.0
+        self.lock = threading.Lock()
+
+    def wait_time(self, tokens: int) -> float:
+        with self.lock:
+            cooldown = max(0.0, self.cooldown_until - time.monotonic())
+            return max(
+                cooldown,
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens + self.expected_output),
+            )
+
+    def reserve(self, tokens: int) -> None:
+        with self.lock:
+            self.requests.consume(1)
+            self.tokens.consume(tokens + self.expected_output)
+
+    def settle(self, reserved: int, used: Optional[int]) -> None:
+        """Correct the token budget with the actual usage of a call."""
+        if used is not None:
+            with self.lock:
+                self.tokens.consume(used - reserved - self.expected_output)
+
+    def record(self, ok: bool, latency: float) -> None:
+        with self.lock:
+            self.outcomes.append((ok, latency))
+
+    def throttle(self, retry_after: Optional[float]) -> None:
+        with self.lock:
+            self.requests.exhaust()
+            self.tokens.exhaust()
+            if retry_after:
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+
+    def healthy(self, max_error_rate: float, max_latency: Optional[float]) -> bool:
+        with self.lock:
+            outcomes = list(self.outcomes)
+        if len(outcomes) < 5:
+            return True
+        errors = sum(1 for ok, _ in outcomes if not ok)
+        if errors / len(outcomes) > max_error_rate:
+            return False
+        if max_latency:
+            latencies = sorted(latency for ok, latency in outcomes if ok)
+            if latencies and latencies[len(latencies) // 2] > max_latency:
+                return False
+        return True
+
+
+def _retry_reason(error: Exception) -> Optional[str]:
+    """Why `error` is worth retrying (None when it is not: bad request, auth...)."""
+    status = getattr(error, "status_code", None)
+    if status == 429:
+        return "rate_limit"
+    if status is not None and status >= 500:
+        return "server_error"
+    if status is None and not isinstance(error, (ValueError, TypeError, KeyError)):
+        # Errori di rete e timeout non hanno uno status HTTP
+        return "connection"
+    return None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderScheduler(BaseChatModel):
+    """Chat model that spreads calls over the configured providers.
+
+    Providers are tried in preference order. A provider is passed over while
+    its RPM/TPM budget (from `rpm`/`tpm` in its config block) is exhausted,
+    while it is cooling down after a 429, or while its recent error rate or
+    median latency is above the thresholds; if every provider is busy the
+    call waits for the first budget to free up. Retryable errors (429, 5xx,
+    network) are retried with full-jitter exponential backoff, moving on to
+    the next provider. With `hedge_after_ms`, an async call that has not
+    answered in time is also sent to the next provider and the first reply
+    wins. Call options (e.g. `response_format`) are passed to every provider.
+    """
+
+    max_retries: int = 4
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    max_wait: float = 60.0
+    hedge_after_ms: Optional[float] = None
+    max_error_rate: float = 0.5
+    max_latency_ms: Optional[float] = None
+    _providers: List[ProviderState] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def from_config(
+        cls,
+        names: List[str],
+        providers: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        build_client: Callable[[str], BaseChatModel],
+    ) -> "ProviderScheduler":
+        scheduler = cls(
+            **{
+                key: settings[key]
+                for key in (
+                    "max_retries", "backoff_base", "backoff_max", "max_wait",
+                    "hedge_after_ms", "max_error_rate", "max_latency_ms",
+                )
+                if key in settings
+            }
+        )
+        window = settings.get("health_window", 20)
+        for i, name in enumerate(names):
+            try:
+                client = build_client(name)
+            except ValueError as e:
+                if i == 0:
+                    raise
+                # Un secondario senza API key non blocca l'avvio
+                logger.warning(f"Provider {name} not available for failover: {e}")
+                continue
+            scheduler._providers.append(
+                ProviderState(name, client, providers.get(name) or {}, window)
+            )
+        return scheduler
+
+    @property
+    def _llm_type(self) -> str:
+        return "provider-scheduler"
+
+    @property
+    def provider_names(self) -> List[str]:
+        return [p.name for p in self._providers]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "provider": p.name,
+                "healthy": self._healthy(p),
+                "wait_s": round(p.wait_time(0), 3),
+                "recent_errors": sum(1 for ok, _ in p.outcomes if not ok),
+                "recent_calls": len(p.outcomes),
+            }
+            for p in self._providers
+        ]
+
+    # --- scelta del provider -------------------------------------------------
+
+    def _healthy(self, provider: ProviderState) -> bool:
+        max_latency = self.max_latency_ms / 1000 if self.max_latency_ms else None
+        return provider.healthy(self.max_error_rate, max_latency)
+
+    def _pick(self, tokens: int, exclude: List[ProviderState]) -> tuple:
+        """Best provider for a call of `tokens` and the seconds to wait for it."""
+        candidates = [p for p in self._providers if p not in exclude] or self._providers
+        ranked = sorted(
+            candidates,
+            key=lambda p: (not self._healthy(p), p.wait_time(tokens) > 0, p.wait_time(tokens)),
+        )
+        provider = ranked[0]
+        return provider, min(provider.wait_time(tokens), self.max_wait)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _on_error(self, provider: ProviderState, error: Exception, attempt: int) -> float:
+        """Record a failed attempt; return the backoff before the next one (raise if final)."""
+        reason = _retry_reason(error)
+        if reason is None or attempt >= self.max_retries:
+            raise error
+        if reason == "rate_limit":
+            provider.throttle(_retry_after(error))
+        LLM_RETRIES.inc(provider=provider.name, reason=reason)
+        logger.warning(
+            f"{provider.name} call failed ({reason}, attempt {attempt + 1}): {error}"
+        )
+        return self._backoff(attempt)
+
+    def _answered(self, provider: ProviderState, message: BaseMessage) -> BaseMessage:
+        # Nei chunk di uno stream va solo sul primo: i metadata dei chunk si concatenano
+        if provider is not self._providers[0]:
+            LLM_FAILOVERS.inc(provider=provider.name)
+        message.response_metadata = {**message.response_metadata, "provider": provider.name}
+        return message
+
+    @staticmethod
+    def _used_tokens(message: BaseMessage) -> Optional[int]:
+        usage = getattr(message, "usage_metadata", None) or {}
+        return usage.get("total_tokens")
+
+    # --- chiamate sincrone ---------------------------------------------------
+
+    def _call(
+        self, messages: List[BaseMessage], stop: Optional[List[str]], **kwargs: Any
+    ) -> BaseMessage:
+        tokens = estimate_tokens(messages)
+        tried: List[ProviderState] = []
+        attempt = 0
+        while True:
+            provider, wait = self._pick(tokens, tried)
+            if wait:
+                LLM_THROTTLE_SECONDS.inc(wait, provider=provider.name)
+                time.sleep(wait)
+            provider.reserve(tokens)
+            start = time.monotonic()
+            try:
+                message = provider.client.invoke(messages, stop=stop, **kwargs)
+            except Exception as e:
+                provider.record(False, time.monotonic() - start)
+                time.sleep(self._on_error(provider, e, attempt))
+                tried.append(provider)
+                attempt += 1
+                continue
+            provider.record(True, time.monotonic() - start)
+            provider.settle(tokens, self._used_tokens(message))
+            return self._answered(provider, message)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._call(messages, stop, **kwargs))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        tokens = estimate_tokens(messages)
+        tried: List[ProviderState] = []
+        attempt = 0
+        while True:
+            provider, wait = self._pick(tokens, tried)
+            if wait:
+                LLM_THROTTLE_SECONDS.inc(wait, provider=provider.name)
+                time.sleep(wait)
+            provider.reserve(tokens)
+            start = time.monotonic()
+            started = False
+            try:
+                for chunk in provider.client.stream(messages, stop=stop, **kwargs):
+                    if not started:
+                        chunk = self._answered(provider, chunk)
+                    started = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                provider.record(False, time.monotonic() - start)
+                # A stream già iniziato non si può ripetere senza duplicare l'output
+                if started:
+                    raise
+                time.sleep(self._on_error(provider, e, attempt))
+                tried.append(provider)
+                attempt += 1
+                continue
+            provider.record(True, time.monotonic() - start)
+            return
+
+    # --- chiamate asincrone --------------------------------------------------
+
+    async def _acall_once(
+        self,
+        provider: ProviderState,
+        messages: List[BaseMessage],
+        stop,
+        tokens: int,
+        **kwargs: Any,
+    ) -> BaseMessage:
+        provider.reserve(tokens)
+        start = time.monotonic()
+        try:
+            message = await provider.client.ainvoke(messages, stop=stop, **kwargs)
+        except Exception:
+            provider.record(False, time.monotonic() - start)
+            raise
+        provider.record(True, time.monotonic() - start)
+        provider.settle(tokens, self._used_tokens(message))
+        return self._answered(provider, message)
+
+    async def _ahedged(
+        self,
+        provider: ProviderState,
+        messages: List[BaseMessage],
+        stop,
+        tokens: int,
+        **kwargs: Any,
+    ) -> BaseMessage:
+        """Call `provider`; past `hedge_after_ms`, race it against the next provider."""
+        primary = asyncio.ensure_future(
+            self._acall_once(provider, messages, stop, tokens, **kwargs)
+        )
+        if not self.hedge_after_ms or len(self._providers) < 2:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after_ms / 1000)
+        if done:
+            return primary.result()
+
+        backup, wait = self._pick(tokens, [provider])
+        if backup is provider or wait:
+            return await primary
+        LLM_HEDGES.inc()
+        secondary = asyncio.ensure_future(
+            self._acall_once(backup, messages, stop, tokens, **kwargs)
+        )
+        pending = {primary, secondary}
+        error: Optional[Exception] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = estimate_tokens(messages)
+        tried: List[ProviderState] = []
+        attempt = 0
+        while True:
+            provider, wait = self._pick(tokens, tried)
+            if wait:
+                LLM_THROTTLE_SECONDS.inc(wait, provider=provider.name)
+                await asyncio.sleep(wait)
+            try:
+                message = await self._ahedged(provider, messages, stop, tokens, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._on_error(provider, e, attempt))
+                tried.append(provider)
+                attempt += 1
+                continue
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = estimate_tokens(messages)
+        tried: List[ProviderState] = []
+        attempt = 0
+        while True:
+            provider, wait = self._pick(tokens, tried)
+            if wait:
+                LLM_THROTTLE_SECONDS.inc(wait, provider=provider.name)
+                await asyncio.sleep(wait)
+            provider.reserve(tokens)
+            start = time.monotonic()
+            started = False
+            try:
+                async for chunk in provider.client.astream(messages, stop=stop, **kwargs):
+                    if not started:
+                        chunk = self._answered(provider, chunk)
+                    started = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                provider.record(False, time.monotonic() - start)
+                if started:
+                    raise
+                await asyncio.sleep(self._on_error(provider, e, attempt))
+                tried.append(provider)
+                attempt += 1
+                continue
+            provider.record(True, time.monotonic() - start)
+            return
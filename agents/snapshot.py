@@ -0,0 +1,356 @@
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from agents.models import Entity, Relation, from_micros, to_micros
+
+# Elementi per blocco: una nuova versione copia solo i blocchi che cambiano
+CHUNK = 256
+# Chiave dell'indice temporale: ultimo avvistamento << EDGE_BITS | id dell'arco
+EDGE_BITS = 32
+EDGE_MASK = (1 << EDGE_BITS) - 1
+
+# Record di un'entità: (nome, id del tipo, timestamp, attributi)
+EntityRecord = Tuple[str, int, int, Optional[Dict[str, str]]]
+# Record di un arco: (sorgente, destinazione, id del tipo, peso, conteggio,
+# ultimo avvistamento, primo avvistamento)
+EdgeRecord = Tuple[int, int, int, float, int, int, int]
+
+
+class ChunkedVector:
+    """Immutable sequence stored as fixed-size blocks.
+
+    `evolve` returns a new vector sharing every block it does not modify,
+    so a version with k changed items costs O(k * CHUNK + len / CHUNK)
+    instead of a full copy.
+    """
+
+    __slots__ = ("_chunks", "_len")
+
+    def __init__(self, chunks: Tuple[Tuple, ...] = (), length: int = 0):
+        self._chunks = chunks
+        self._len = length
+
+    @classmethod
+    def build(cls, items: Sequence) -> "ChunkedVector":
+        chunks = tuple(
+            tuple(items[k : k + CHUNK]) + (None,) * max(0, k + CHUNK - len(items))
+            for k in range(0, len(items), CHUNK)
+        )
+        return cls(chunks, len(items))
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> Any:
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        return self._chunks[i // CHUNK][i % CHUNK]
+
+    def __iter__(self) -> Iterator:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def evolve(self, updates: Dict[int, Any], length: int) -> "ChunkedVector":
+        """A new vector of `length` items (not shorter) with `updates` applied."""
+        chunks = list(self._chunks)
+        empty = (None,) * CHUNK
+        while len(chunks) * CHUNK < length:
+            chunks.append(empty)
+        touched: Dict[int, List] = {}
+        for i, value in updates.items():
+            block = touched.get(i // CHUNK)
+            if block is None:
+                block = touched[i // CHUNK] = list(chunks[i // CHUNK])
+            block[i % CHUNK] = value
+        for c, block in touched.items():
+            chunks[c] = tuple(block)
+        return ChunkedVector(tuple(chunks), max(length, self._len))
+
+
+class SortedKeys:
+    """Immutable sorted set of integers stored as sorted blocks.
+
+    Like ChunkedVector, `evolve` copies only the blocks that receive or
+    lose a key; blocks are split when they outgrow CHUNK and merged with
+    the previous one when both fit in a block.
+    """
+
+    __slots__ = ("_chunks", "_maxes")
+
+    def __init__(
+        self, chunks: Tuple[Tuple[int, ...], ...] = (), maxes: Tuple[int, ...] = ()
+    ):
+        self._chunks = chunks
+        self._maxes = maxes
+
+    @classmethod
+    def build(cls, keys: Iterable[int]) -> "SortedKeys":
+        keys = sorted(keys)
+        chunks = tuple(tuple(keys[k : k + CHUNK]) for k in range(0, len(keys), CHUNK))
+        return cls(chunks, tuple(chunk[-1] for chunk in chunks))
+
+    def __len__(self) -> int:
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def evolve(self, removed: Iterable[int], added: Iterable[int]) -> "SortedKeys":
+        """A new set without the `removed` keys (all present) and with the `added` ones."""
+        chunks, maxes = list(self._chunks), list(self._maxes)
+        touched: Dict[int, List[int]] = {}
+
+        def block(c: int) -> List[int]:
+            keys = touched.get(c)
+            if keys is None:
+                keys = touched[c] = list(chunks[c])
+            return keys
+
+        # I massimi restano quelli vecchi (>= dei reali): bastano per trovare il blocco
+        for key in removed:
+            keys = block(bisect_left(maxes, key))
+            del keys[bisect_left(keys, key)]
+        for key in added:
+            if not chunks:
+                chunks.append(())
+                maxes.append(key)
+            c = min(bisect_left(maxes, key), len(chunks) - 1)
+            insort(block(c), key)
+            maxes[c] = max(maxes[c], key)
+
+        # I tratti di blocchi non toccati si copiano per slice
+        new_chunks: List[Tuple[int, ...]] = []
+        new_maxes: List[int] = []
+        previous = 0
+        for c in sorted(touched):
+            new_chunks += chunks[previous:c]
+            new_maxes += maxes[previous:c]
+            previous = c + 1
+            keys = touched[c]
+            if new_chunks and len(new_chunks[-1]) + len(keys) <= CHUNK:
+                keys = [*new_chunks.pop(), *keys]
+                new_maxes.pop()
+            for k in range(0, len(keys), CHUNK):
+                piece = tuple(keys[k : k + CHUNK])
+                new_chunks.append(piece)
+                new_maxes.append(piece[-1])
+        new_chunks += chunks[previous:]
+        new_maxes += maxes[previous:]
+        return SortedKeys(tuple(new_chunks), tuple(new_maxes))
+
+    def __iter__(self) -> Iterator[int]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def irange(self, low: int, high: Optional[int] = None) -> Iterator[int]:
+        """Keys k with low <= k (<= high), in order."""
+        chunks = self._chunks
+        c = bisect_left(self._maxes, low)
+        if c == len(chunks):
+            return
+        pos = bisect_left(chunks[c], low)
+        for c in range(c, len(chunks)):
+            chunk = chunks[c]
+            for k in range(pos, len(chunk)):
+                key = chunk[k]
+                if high is not None and key > high:
+                    return
+                yield key
+            pos = 0
+
+
+class GraphSnapshot:
+    """An immutable, versioned view of a GraphStore for lock-free reads.
+
+    The store publishes a new snapshot at every commit, built from the
+    previous one and the change log: the entity and edge records of the
+    ids that changed are replaced, everything else is shared. Readers take
+    `store.snapshot` once and see a consistent graph however many writes
+    happen meanwhile; nothing in a published snapshot is ever modified.
+
+    `views` is a cache owned by the snapshot: results computed from it
+    (see EntityExtractionAgent.get_graph_data) stay valid as long as it is
+    the current version and die with it.
+    """
+
+    __slots__ = ("version", "types", "_entities", "_edges", "_time", "views")
+
+    def __init__(
+        self,
+        version: int,
+        types: List[str],
+        entities: ChunkedVector,
+        edges: ChunkedVector,
+        time: SortedKeys,
+    ):
+        self.version = version
+        # Tabella dei tipi dello store: non rilascia mai id, le voci lette restano valide
+        self.types = types
+        self._entities = entities
+        self._edges = edges
+        self._time = time
+        self.views: Dict[Any, Any] = {}
+
+    @classmethod
+    def build(
+        cls,
+        version: int,
+        types: List[str],
+        entities: Sequence[Optional[EntityRecord]],
+        edges: Sequence[Optional[EdgeRecord]],
+    ) -> "GraphSnapshot":
+        return cls(
+            version,
+            types,
+            ChunkedVector.build(entities),
+            ChunkedVector.build(edges),
+            SortedKeys.build(
+                time_key(r[5], e) for e, r in enumerate(edges) if r is not None
+            ),
+        )
+
+    def evolve(
+        self,
+        version: int,
+        entities: Dict[int, Optional[EntityRecord]],
+        entity_count: int,
+        edges: Dict[int, Optional[EdgeRecord]],
+        edge_count: int,
+    ) -> "GraphSnapshot":
+        """The next version: these entity and edge records replaced, the rest shared."""
+        removed, added = [], []
+        for e, record in edges.items():
+            old = self._edges[e] if e < len(self._edges) else None
+            if old is not None:
+                removed.append(time_key(old[5], e))
+            if record is not None:
+                added.append(time_key(record[5], e))
+        return GraphSnapshot(
+            version,
+            self.types,
+            self._entities.evolve(entities, entity_count),
+            self._edges.evolve(edges, edge_count),
+            self._time.evolve(removed, added) if removed or added else self._time,
+        )
+
+    def window_ids(
+        self,
+        cutoff: datetime,
+        after: Optional[Tuple[int, int]] = None,
+        limit: Optional[int] = None,
+        end: Optional[datetime] = None,
+    ) -> Tuple[List[int], List[int], Optional[Tuple[int, int]]]:
+        """Same as GraphStore.window_ids, on this version."""
+        c = to_micros(cutoff)
+        low = time_key(c, 0)
+        if after is not None:
+            low = max(low, time_key(*after) + 1)
+        high = time_key(to_micros(end), EDGE_MASK) if end is not None else None
+        entities, edges = self._entities, self._edges
+        nodes: Dict[int, None] = {}
+        page: List[int] = []
+        for key in self._time.irange(low, high):
+            e = key & EDGE_MASK
+            s, t = edges[e][0], edges[e][1]
+            source, target = entities[s], entities[t]
+            if source is None or target is None or source[2] < c or target[2] < c:
+                continue
+            if limit is not None and len(page) == limit:
+                last = page[-1]
+                return list(nodes), page, (edges[last][5], last)
+            page.append(e)
+            nodes[s] = None
+            nodes[t] = None
+        return list(nodes), page, None
+
+    def oldest(self, node_ids: List[int], edge_ids: List[int]) -> Optional[int]:
+        """Earliest timestamp (µs) among these nodes and edges, None if there are none.
+
+        A time-filtered result stays exact, on this version, until the
+        cutoff passes it.
+        """
+        if not edge_ids:
+            return None
+        entities, edges = self._entities, self._edges
+        return min(
+            min(edges[e][5] for e in edge_ids), min(entities[i][2] for i in node_ids)
+        )
+
+    def columns(
+        self, node_ids: List[int], edge_ids: List[int], attributes: bool = False
+    ) -> Dict:
+        """Same as GraphStore.columns, on this version."""
+        strings: Dict[str, int] = {}
+        intern = lambda value: strings.setdefault(value, len(strings))
+        position = {i: pos for pos, i in enumerate(node_ids)}
+        types = self.types
+        nodes = [self._entities[i] for i in node_ids]
+        edges = [self._edges[e] for e in edge_ids]
+        node_columns = {
+            "name": [intern(n[0]) for n in nodes],
+            "type": [intern(types[n[1]]) for n in nodes],
+            "timestamp": [n[2] // 1000 for n in nodes],
+        }
+        if attributes:
+            node_columns["attributes"] = [n[3] or {} for n in nodes]
+        edge_columns = {
+            "source": [position[r[0]] for r in edges],
+            "target": [position[r[1]] for r in edges],
+            "type": [intern(types[r[2]]) for r in edges],
+            "weight": [r[3] for r in edges],
+            "count": [r[4] for r in edges],
+            "first_seen": [r[6] // 1000 for r in edges],
+            "timestamp": [r[5] // 1000 for r in edges],
+        }
+        return {"strings": list(strings), "nodes": node_columns, "edges": edge_columns}
+
+    def entities(self) -> Iterator[Entity]:
+        """Every entity of this version."""
+        for i, record in enumerate(self._entities):
+            if record is not None:
+                yield self.entity_at(i)
+
+    def relations(self) -> Iterator[Relation]:
+        """Every edge of this version, least recently seen first."""
+        for key in self._time:
+            yield self.relation_at(key & EDGE_MASK)
+
+    def rollup_rows(self, rows: Iterable[Tuple]) -> Iterator[Tuple]:
+        """TemporalRollups.rows() taken at this version, with names instead of ids.
+
+        Same rows as GraphStore.rollup_rows(), for writers that must not
+        hold the store while they serialize.
+        """
+        types, entities, edges = self.types, self._entities, self._edges
+        for bucket, index, kind, id, count, weight in rows:
+            if kind == "edge":
+                source, target, type_id = edges[id][:3]
+                yield (
+                    bucket, index, kind, types[type_id],
+                    entities[source][0], entities[target][0], count, weight,
+                )
+            else:
+                yield bucket, index, kind, types[id], None, None, count, weight
+
+    def entity_at(self, i: int) -> Entity:
+        name, type_id, ts, attributes = self._entities[i]
+        return Entity(
+            name=name,
+            type=self.types[type_id],
+            attributes=attributes or {},
+            timestamp=from_micros(ts),
+        )
+
+    def relation_at(self, e: int) -> Relation:
+        source, target, type_id, weight, count, last_seen, first_seen = self._edges[e]
+        return Relation(
+            source=self._entities[source][0],
+            target=self._entities[target][0],
+            type=self.types[type_id],
+            weight=weight,
+            timestamp=from_micros(last_seen),
+            count=count,
+            first_seen=from_micros(first_seen),
+        )
+
+
+def time_key(last_seen: int, e: int) -> int:
+    return (last_seen << EDGE_BITS) | e
@@ -0,0 +1,181 @@
+import importlib
+import logging
+import random
+import re
+import threading
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from agents.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TRIAGE_MESSAGES = REGISTRY.counter(
+    "iotmag_triage_messages_total",
+    "Messages seen by the local triage, by decision and reason.",
+    labels=("decision", "reason"),
+)
+
+WORD_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+# Saluti, ringraziamenti e formule di assenso (italiano e inglese). Solo parole
+# che da sole non portano informazione: verbi e parole di contenuto ("fare",
+# "think", "done", "all") renderebbero "vuoti" messaggi che non lo sono
+GREETINGS = frozenset(
+    """
+    hello hi hey hiya yo morning evening afternoon night good goodbye bye
+    thanks thank thx cheers welcome please sorry ok okay k yes yeah yep no nope
+    sure great cool nice agree agreed exactly lol haha everyone everybody guys
+    folks
+    ciao salve buongiorno buonasera buonanotte buon giorno sera notte arrivederci
+    grazie prego scusa scusate ok va bene benissimo certo sì si esatto
+    d'accordo daccordo perfetto ottimo tutti ragazzi ciaooo
+    """.split()
+)
+
+STOPWORDS = frozenset(
+    """
+    a an the and or but if then so of to in on at by for with from about as
+    is are was were be been being am do does did have has had will would can
+    could should may might must shall it its this that these those there here
+    i me my we us our you your he him his she her they them their what which
+    who whom when where why how not just very too also really some any more
+    il lo la i gli le un uno una di da in con su per tra fra e ed o ma se
+    che chi cui non più come dove quando perché anche ancora già molto poco
+    è sono era sei siamo siete ho hai ha abbiamo avete hanno mi ti ci vi si
+    del della dei delle dello degli al alla ai alle allo agli nel nella nei
+    nelle sul sulla questo questa questi queste quello quella mio mia tuo tua
+    suo sua nostro vostro loro lei lui noi voi tu io
+    """.split()
+)
+
+
+@dataclass
+class TriageDecision:
+    skip: bool
+    reason: Optional[str] = None
+    # Scartato dalle euristiche ma inviato comunque all'LLM per misurare i falsi scarti
+    audit: bool = False
+
+
+PASS = TriageDecision(skip=False)
+
+
+class MessageTriage:
+    """Cheap local check that skips the LLM call for low-information messages.
+
+    A message is skipped when it is short with no content word, when every
+    word is a greeting or stopword, when it has too few content words or too
+    high a stopword ratio, or when the optional classifier scores it below
+    its threshold.
+    A random `audit_rate` share of would-be skips is extracted anyway and
+    recorded, so the false-skip rate can be measured.
+    """
+
+    def __init__(
+        self,
+        min_chars: int = 8,
+        min_content_words: int = 1,
+        max_stopword_ratio: float = 0.85,
+        classifier: Optional[Callable[[str], float]] = None,
+        classifier_threshold: float = 0.2,
+        audit_rate: float = 0.0,
+        audit_samples: int = 100,
+        seed: Optional[int] = None,
+    ):
+        self.min_chars = min_chars
+        self.min_content_words = min_content_words
+        self.max_stopword_ratio = max_stopword_ratio
+        self.classifier = classifier
+        self.classifier_threshold = classifier_threshold
+        self.audit_rate = audit_rate
+        self.false_skip_samples: deque = deque(maxlen=audit_samples)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"checked": 0, "passed": 0, "skipped": 0, "audited": 0, "false_skips": 0}
+        self.reasons: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, settings: Dict[str, Any]) -> "MessageTriage":
+        classifier = settings.get("classifier")
+        return cls(
+            min_chars=settings.get("min_chars", 8),
+            min_content_words=settings.get("min_content_words", 1),
+            max_stopword_ratio=settings.get("max_stopword_ratio", 0.85),
+            classifier=load_classifier(classifier) if classifier else None,
+            classifier_threshold=settings.get("classifier_threshold", 0.2),
+            audit_rate=settings.get("audit_rate", 0.0),
+            audit_samples=settings.get("audit_samples", 100),
+        )
+
+    def check(self, content: str) -> TriageDecision:
+        """Decide whether `content` is worth an LLM call."""
+        reason = self._skip_reason(content)
+        with self._lock:
+            self.counters["checked"] += 1
+            if reason is None:
+                self.counters["passed"] += 1
+                TRIAGE_MESSAGES.inc(decision="pass", reason="")
+                return PASS
+            if self.audit_rate and self._random.random() < self.audit_rate:
+                self.counters["audited"] += 1
+                TRIAGE_MESSAGES.inc(decision="audit", reason=reason)
+                return TriageDecision(skip=False, reason=reason, audit=True)
+            self.counters["skipped"] += 1
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        TRIAGE_MESSAGES.inc(decision="skip", reason=reason)
+        return TriageDecision(skip=True, reason=reason)
+
+    def record_audit(
+        self, decision: TriageDecision, message: str, extracted: List[str]
+    ) -> None:
+        """Record the outcome of an audited message (`extracted`: entity names found)."""
+        if not extracted:
+            return
+        with self._lock:
+            self.counters["false_skips"] += 1
+            self.false_skip_samples.append(
+                {"message": message, "reason": decision.reason, "extracted": extracted}
+            )
+        logger.info(f"Triage false skip ({decision.reason}): {message!r} -> {extracted}")
+
+    def stats(self) -> Dict[str, Any]:
+        checked = self.counters["checked"] or 1
+        audited = self.counters["audited"]
+        return {
+            **self.counters,
+            "skip_rate": self.counters["skipped"] / checked,
+            "false_skip_rate": self.counters["false_skips"] / audited if audited else None,
+            "reasons": dict(self.reasons),
+            "false_skip_samples": list(self.false_skip_samples),
+        }
+
+    def _skip_reason(self, content: str) -> Optional[str]:
+        text = unicodedata.normalize("NFKC", content).strip().lower()
+        words = WORD_RE.findall(text)
+        content_words = sum(
+            1 for w in words if len(w) > 2 and w not in STOPWORDS and w not in GREETINGS
+        )
+        # La lunghezza da sola non basta: "Uso SQL" è corto ma informativo
+        if len(text) < self.min_chars and not content_words:
+            return "too_short"
+        if not words:
+            return "no_words"
+        if all(w in GREETINGS or w in STOPWORDS for w in words):
+            return "greeting"
+        stopwords = sum(1 for w in words if w in STOPWORDS)
+        if content_words < self.min_content_words:
+            return "no_content"
+        if len(words) > 3 and stopwords / len(words) > self.max_stopword_ratio:
+            return "stopwords"
+        if self.classifier is not None and self.classifier(text) < self.classifier_threshold:
+            return "classifier"
+        return None
+
+
+def load_classifier(path: str) -> Callable[[str], float]:
+    """Import a "module:function" returning the probability that a message has entities."""
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
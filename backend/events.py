@@ -0,0 +1,51 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Dict, Set
+
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+# Evento inviato a un client troppo lento per seguire le delta
+RESYNC = "event: resync\ndata: {}\n\n"
+
+
+class GraphEvents:
+    """Fan-out of graph change events to Server-Sent Events subscribers.
+
+    Each event is JSON-encoded once and queued for every subscriber. A
+    subscriber whose queue fills up has its backlog dropped and receives a
+    `resync` event instead, so one slow client never holds back the others.
+    """
+
+    def __init__(self, queue_size: int = 100, keepalive: float = 15.0):
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.subscribers: Set[asyncio.Queue] = set()
+        # Ultima versione del grafo già pubblicata
+        self.version = 0
+
+    def publish(self, event: str, data: Dict) -> None:
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+    async def stream(self, request: Request) -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        logger.info(f"Graph stream subscriber connected ({len(self.subscribers)})")
+        try:
+            yield f"event: hello\ndata: {json.dumps({'version': self.version})}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.subscribers.discard(queue)
@@ -0,0 +1,322 @@
+"""Backfill a graph from exported chat logs.
+
+The input is JSONL, one message per line:
+    {"sender": "Luigi", "text": "...", "timestamp": "2024-05-01T10:00:00+00:00"}
+(timestamp may also be epoch seconds or milliseconds).
+
+Lines are streamed, LLM calls run concurrently up to --concurrency, replies
+are parsed in a process pool and results are merged in timestamp order
+(within --reorder-window messages) exactly as process_message would merge
+them. Progress is checkpointed next to the input, so an interrupted run
+resumes where it stopped. Do not run it on a graph the backend is serving.
+
+Usage: python -m backend.ingest chat.jsonl --graph-id team-42 --concurrency 8
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.entity_extraction_agent import EntityExtractionAgent
+from agents.models import Entity, Relation
+from agents.response_parser import parse_extraction
+from backend.shards import DEFAULT_SHARD, shard_config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Record:
+    seq: int
+    offset: int  # offset in byte di inizio e fine riga, per il checkpoint
+    end: int
+    sender: str
+    text: str
+    timestamp: datetime
+
+
+def parse_timestamp(value: Any) -> datetime:
+    """ISO string or epoch (seconds or milliseconds) to an aware UTC datetime."""
+    if isinstance(value, (int, float)):
+        # Oltre 1e11 secondi saremmo nel 5138: è un valore in millisecondi
+        seconds = value / 1000 if value > 1e11 else value
+        return datetime.fromtimestamp(seconds, tz=timezone.utc)
+    timestamp = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def read_records(
+    path: str, start: int = 0, skip: Optional[Set[int]] = None
+) -> Iterator[Record]:
+    """Yield the messages of a JSONL log from byte offset `start`.
+
+    Lines whose offset is in `skip` (already merged before a restart) and
+    malformed lines are left out.
+    """
+    skip = skip or set()
+    seq = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            line_offset, offset = offset, offset + len(line)
+            if line_offset in skip or not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                record = Record(
+                    seq=seq,
+                    offset=line_offset,
+                    end=offset,
+                    sender=str(data["sender"]).strip() or "Unknown",
+                    text=str(data["text"]).strip(),
+                    timestamp=parse_timestamp(data["timestamp"]),
+                )
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Skipping malformed line at offset {line_offset}: {e}")
+                continue
+            seq += 1
+            yield record
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {"offset": 0, "merged": [], "messages": 0}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class Ingestor:
+    """Concurrent extraction with ordered merge and resumable progress.
+
+    Results are reordered in two steps: completed extractions are released
+    in input order, then held in a heap of `reorder_window` messages and
+    merged oldest timestamp first. The checkpoint stores the offset of the
+    first message not yet merged, plus the offsets of messages after it that
+    were already merged, so a resumed run merges every message exactly once.
+    """
+
+    def __init__(
+        self,
+        agent: EntityExtractionAgent,
+        concurrency: int = 8,
+        parse_workers: int = 2,
+        reorder_window: int = 256,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = 1,
+        report_every: float = 10.0,
+    ):
+        self.agent = agent
+        self.concurrency = concurrency
+        self.parse_workers = parse_workers
+        self.reorder_window = reorder_window
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.report_every = report_every
+        self.stats = {"messages": 0, "skipped": 0, "failed": 0, "entities": 0, "relations": 0}
+
+        self._heap: List[Tuple[datetime, int, Record, List[Entity], List[Relation]]] = []
+        self._completed: Dict[int, Tuple] = {}
+        self._unreleased: Dict[int, Record] = {}
+        self._next_seq = 0
+        self._merged_offsets: Set[int] = set()
+        self._read_offset = 0
+        self._since_checkpoint = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def run(self, records: Iterator[Record], state: Dict[str, Any]) -> Dict[str, Any]:
+        self._merged_offsets = set(state.get("merged", []))
+        self._read_offset = state.get("offset", 0)
+        self.stats["messages"] = state.get("messages", 0)
+        start_messages = self.stats["messages"]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        in_flight: Set[asyncio.Task] = set()
+        started = last_report = time.perf_counter()
+
+        if self.parse_workers:
+            self._pool = ProcessPoolExecutor(self.parse_workers)
+        try:
+            for record in records:
+                self._unreleased[record.seq] = record
+                self._read_offset = record.end
+                in_flight.add(asyncio.create_task(self._extract(record, semaphore)))
+                # Finestra limitata di lavori aperti: la memoria non cresce col file
+                if len(in_flight) >= self.concurrency * 4:
+                    done, in_flight = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    self._complete(done)
+                if time.perf_counter() - last_report >= self.report_every:
+                    self._report(started, start_messages, len(in_flight))
+                    last_report = time.perf_counter()
+
+            if in_flight:
+                done, _ = await asyncio.wait(in_flight)
+                self._complete(done)
+            while self._heap:
+                self._merge(heapq.heappop(self._heap))
+            self._checkpoint()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        processed = self.stats["messages"] - start_messages
+        return {
+            **self.stats,
+            "elapsed_s": round(elapsed, 3),
+            "messages_per_s": round(processed / elapsed, 1) if elapsed else None,
+            "llm": self.agent.get_token_usage(),
+        }
+
+    async def _extract(self, record: Record, semaphore: asyncio.Semaphore) -> Tuple:
+        decision = self.agent._triage_check(record.text)
+        try:
+            async with semaphore:
+                response = await self.agent.afetch_response(
+                    record.sender, record.text, decision
+                )
+        except Exception as e:
+            logger.error(f"Extraction failed at offset {record.offset}: {str(e)}")
+            self.stats["failed"] += 1
+            return record, [], []
+        if response is None:
+            self.stats["skipped"] += 1
+            return record, [], []
+
+        if self._pool is not None:
+            loop = asyncio.get_running_loop()
+            entities, relations = await loop.run_in_executor(
+                self._pool, parse_extraction, response, record.timestamp
+            )
+        else:
+            entities, relations = parse_extraction(response, record.timestamp)
+        self.agent._record_audit(decision, record.sender, record.text, entities)
+        return record, entities, relations
+
+    def _complete(self, done: Set[asyncio.Task]) -> None:
+        """Release finished extractions in input order, merging the overflow of the heap."""
+        for task in done:
+            record, entities, relations = task.result()
+            self._completed[record.seq] = (record, entities, relations)
+        while self._next_seq in self._completed:
+            record, entities, relations = self._completed.pop(self._next_seq)
+            del self._unreleased[self._next_seq]
+            heapq.heappush(
+                self._heap, (record.timestamp, record.seq, record, entities, relations)
+            )
+            self._next_seq += 1
+            if len(self._heap) > self.reorder_window:
+                self._merge(heapq.heappop(self._heap))
+
+    def _merge(self, item: Tuple) -> None:
+        _, _, record, entities, relations = item
+        entities, relations = self.agent._merge_extraction(
+            record.sender, record.timestamp, entities, relations
+        )
+        self._merged_offsets.add(record.offset)
+        self.stats["messages"] += 1
+        self.stats["entities"] += len(entities)
+        self.stats["relations"] += len(relations)
+        # Il checkpoint segue subito il commit del grafo: dopo un crash si
+        # ripetono al più gli ultimi `checkpoint_every` messaggi
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_every:
+            self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        self._since_checkpoint = 0
+        if self.checkpoint_path is None:
+            return
+        pending = [item[2].offset for item in self._heap]
+        if self._unreleased:
+            pending.append(self._unreleased[min(self._unreleased)].offset)
+        offset = min(pending) if pending else self._read_offset
+        self._merged_offsets = {o for o in self._merged_offsets if o >= offset}
+        save_checkpoint(
+            self.checkpoint_path,
+            {
+                "offset": offset,
+                "merged": sorted(self._merged_offsets),
+                "messages": self.stats["messages"],
+            },
+        )
+
+    def _report(self, started: float, start_messages: int, in_flight: int) -> None:
+        elapsed = time.perf_counter() - started
+        rate = (self.stats["messages"] - start_messages) / elapsed if elapsed else 0
+        logger.info(
+            f"{self.stats['messages']} messages merged ({rate:.1f} msg/s), "
+            f"{in_flight} in flight, {self.stats['skipped']} skipped, "
+            f"{self.stats['failed']} failed"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("path", help="JSONL chat log")
+    parser.add_argument("--graph-id", default=DEFAULT_SHARD)
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM calls in flight")
+    parser.add_argument("--parse-workers", type=int, default=2, help="0 parses inline")
+    parser.add_argument("--reorder-window", type=int, default=256)
+    parser.add_argument(
+        "--checkpoint-every", type=int, default=1,
+        help="merges between checkpoints (larger is faster, may repeat more after a crash)",
+    )
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    parser.add_argument("--limit", type=int, help="stop after this many messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    config = EntityExtractionAgent.load_config()
+    agent = EntityExtractionAgent(config=shard_config(config, args.graph_id))
+
+    checkpoint_path = args.path + ".checkpoint.json"
+    state = {"offset": 0, "merged": [], "messages": 0}
+    if not args.restart:
+        state = load_checkpoint(checkpoint_path)
+        if state["offset"]:
+            logger.info(f"Resuming {args.path} from offset {state['offset']}")
+
+    records = read_records(args.path, state["offset"], set(state["merged"]))
+    if args.limit:
+        records = itertools.islice(records, args.limit)
+
+    ingestor = Ingestor(
+        agent,
+        concurrency=args.concurrency,
+        parse_workers=args.parse_workers,
+        reorder_window=args.reorder_window,
+        checkpoint_path=checkpoint_path,
+        checkpoint_every=args.checkpoint_every,
+    )
+    try:
+        summary = asyncio.run(ingestor.run(records, state))
+    finally:
+        agent.close()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the ingest queue has no room for another job."""
+
+
+@dataclass
+class Job:
+    id: str
+    payload: Dict[str, Any]
+    status: str = "queued"  # queued -> running -> done | failed
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """Bounded ingest queue drained by a fixed pool of async workers.
+
+    `submit` never blocks: when the queue is full it raises QueueFullError so
+    the API can answer 429 instead of piling up requests. Finished jobs are
+    kept (up to `history`) so their status can be polled.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        workers: int = 4,
+        max_size: int = 100,
+        history: int = 1000,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.history = history
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        logger.info(
+            f"Started {self.workers} extraction workers (queue size {self.max_size})"
+        )
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(self, payload: Dict[str, Any]) -> Job:
+        if self._queue is None:
+            raise RuntimeError("JobQueue not started")
+        job = Job(id=uuid.uuid4().hex, payload=payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Ingest queue is full ({self.max_size} jobs)")
+        self.jobs[job.id] = job
+        self._trim_history()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _trim_history(self) -> None:
+        # Scarta i job terminati più vecchi, mai quelli ancora in coda
+        while len(self.jobs) > self.history:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest.status not in ("done", "failed"):
+                break
+            del self.jobs[oldest_id]
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = datetime.now(timezone.utc)
+            try:
+                job.result = await self.handler(job.payload)
+                job.status = "done"
+            except Exception as e:
+                logger.error(f"Job {job.id} failed in worker {index}: {str(e)}")
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = datetime.now(timezone.utc)
+                job.done.set()
+                self._queue.task_done()
@@ -2,14 +2,26 @@ import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from agents.entity_extraction_agent import EntityExtractionAgent
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from agents.entity_extraction_agent import Entity, EntityExtractionAgent
+from agents.graph_store import CENTRALITY, DIRECTIONS
+from agents.rollups import BUCKETS
+from agents.metrics import REGISTRY
+from backend.jobs import JobQueue, QueueFullError
+from backend.shards import DEFAULT_SHARD, InvalidShardError, Shard, ShardLimitError, ShardManager
 from pydantic import BaseModel
-from typing import Dict, Optional
-from datetime import datetime
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+import asyncio
 import logging
 
+try:
+    import msgpack
+except ImportError:  # opzionale, serve solo per /graph?format=msgpack
+    msgpack = None
+
 app = FastAPI()
 
 # Configura CORS
@@ -28,50 +40,511 @@ class Message(BaseModel):
     timestamp: Optional[str] = None
 
 
-# Inizializza l'agente
-agent = EntityExtractionAgent()
+class MessageBatch(BaseModel):
+    messages: List[Message]
 
 
-@app.post("/process-message")
-async def process_message(message: Message) -> Dict:
+TIME_FILTERS = ("now", "1h", "1d", "1w", "1m")
+# Limiti delle query sul grafo: il costo cresce con la profondità
+MAX_DEPTH = 4
+MAX_TOP = 1000
+WIRE_FORMATS = ("json", "columnar", "msgpack")
+MAX_PAGE = 100_000
+# "lod": vista limitata per il rendering di grafi grandi
+GRAPH_VIEWS = ("full", "lod")
+MAX_LOD_NODES = 2000
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Convert an ISO string to a UTC datetime (400 if malformed)."""
+    if not value:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid timestamp format: {str(e)}"
+        )
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+config = EntityExtractionAgent.load_config()
+
+# Il livello di log si sceglie in config.yaml: a INFO i log per elemento non costano nulla
+logging.basicConfig(
+    level=(config.get("logging") or {}).get("level", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
+# Un grafo isolato (agente, cronologia, store, stream) per ogni graph_id
+shards = ShardManager.from_config(config)
+# Shard "default": quello usato quando la richiesta non indica un graph_id
+agent = shards.get(DEFAULT_SHARD).agent
+
+
+def get_shard(graph_id: str) -> Shard:
+    try:
+        return shards.get(graph_id)
+    except InvalidShardError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ShardLimitError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def publish_changes(shard: Shard) -> None:
+    """Push the changes committed since the last event to stream subscribers."""
+    events, agent = shard.events, shard.agent
+    if not events.subscribers:
+        events.version = agent.graph.version
+        return
+    delta = agent.get_graph_delta(events.version, time_filter="all")
+    events.version = delta["version"]
+    if delta["full"]:
+        events.publish("resync", {"version": delta["version"]})
+    elif any(delta[k] for k in ("nodes", "edges", "removed_nodes", "removed_edges")):
+        events.publish("delta", delta)
+
+
+async def run_extraction(payload: Dict[str, Any]) -> Dict:
+    shard = shards.get(payload["graph_id"])
     try:
-        # Convert ISO string to UTC datetime if provided
-        if message.timestamp:
+        return await extract(shard, payload)
+    finally:
+        shard.pending -= 1
+
+
+async def extract(shard: Shard, payload: Dict[str, Any]) -> Dict:
+    agent = shard.agent
+    if "batch" in payload:
+        results = await agent.aprocess_messages(
+            [m["text"] for m in payload["batch"]],
+            [m["timestamp"] for m in payload["batch"]],
+        )
+        publish_changes(shard)
+        return {
+            "results": [
+                {"entities": len(entities), "relations": len(relations)}
+                for entities, relations in results
+            ],
+            "version": agent.graph.version,
+        }
+
+    if agent.streaming:
+        # Ogni blocco viene pubblicato appena unito, prima della fine della risposta
+        entities, relations = [], []
+        async for item in agent.aprocess_message_stream(
+            payload["text"], payload["timestamp"]
+        ):
+            (entities if isinstance(item, Entity) else relations).append(item)
+            publish_changes(shard)
+    else:
+        entities, relations = await agent.aprocess_message(
+            message=payload["text"], timestamp=payload["timestamp"]
+        )
+        publish_changes(shard)
+    return {
+        "entities": len(entities),
+        "relations": len(relations),
+        "version": agent.graph.version,
+    }
+
+
+backend_settings = config.get("backend") or {}
+jobs = JobQueue(
+    run_extraction,
+    workers=backend_settings.get("workers", 4),
+    max_size=backend_settings.get("queue_size", 100),
+    history=backend_settings.get("job_history", 1000),
+)
+sweep_interval = (config.get("sharding") or {}).get("sweep_interval", 60)
+sweeper: Optional[asyncio.Task] = None
+retention_settings = (config.get("graph_settings") or {}).get("retention") or {}
+retention_task: Optional[asyncio.Task] = None
+
+REGISTRY.gauge(
+    "iotmag_job_queue_depth", "Jobs waiting for an extraction worker.",
+    function=lambda: jobs.depth,
+)
+REGISTRY.gauge(
+    "iotmag_shards_loaded", "Graph shards held in memory.", function=lambda: len(shards)
+)
+REGISTRY.gauge(
+    "iotmag_graph_nodes", "Entities in the loaded graphs.",
+    function=lambda: sum(len(s.agent.graph.entities) for s in shards),
+)
+REGISTRY.gauge(
+    "iotmag_graph_edges", "Relations in the loaded graphs.",
+    function=lambda: sum(len(s.agent.graph) for s in shards),
+)
+REGISTRY.gauge(
+    "iotmag_graph_version", "Current version of the default graph.",
+    function=lambda: agent.graph.version,
+)
+REGISTRY.gauge(
+    "iotmag_stream_subscribers", "Connected /graph/stream clients.",
+    function=lambda: sum(len(s.events.subscribers) for s in shards),
+)
+
+
+async def sweep_idle_shards():
+    while True:
+        await asyncio.sleep(sweep_interval)
+        try:
+            shards.sweep()
+        except Exception as e:
+            logging.error(f"Error spilling idle shards: {str(e)}")
+
+
+async def enforce_retention():
+    # Scadenze e budget anche senza scritture, a passi limitati per shard
+    interval = retention_settings.get("sweep_interval", 60)
+    steps = retention_settings.get("sweep_steps", 1000)
+    while True:
+        await asyncio.sleep(interval)
+        for shard in shards:
             try:
-                timestamp = datetime.fromisoformat(message.timestamp)
-                if timestamp.tzinfo is None:
-                    timestamp = timestamp.replace(tzinfo=timezone.utc)
-            except ValueError as e:
-                raise HTTPException(
-                    status_code=400, detail=f"Invalid timestamp format: {str(e)}"
-                )
-        else:
-            timestamp = None
+                if shard.agent.enforce_retention(steps):
+                    publish_changes(shard)
+            except Exception as e:
+                logging.error(f"Error enforcing retention on {shard.id}: {str(e)}")
+
+
+@app.on_event("startup")
+async def start_workers():
+    global sweeper, retention_task
+    await jobs.start()
+    sweeper = asyncio.create_task(sweep_idle_shards())
+    if retention_settings.get("enabled") and retention_settings.get("sweep_interval", 60):
+        retention_task = asyncio.create_task(enforce_retention())
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    for task in (sweeper, retention_task):
+        if task is not None:
+            task.cancel()
+    await jobs.stop()
+    shards.close()
+
+
+@app.post("/process-message")
+async def process_message(
+    message: Message, wait: bool = True, graph_id: str = DEFAULT_SHARD
+) -> Dict:
+    """Queue a message for extraction.
 
-        agent.process_message(message=message.text, timestamp=timestamp)
-        return {"success": True}
+    With wait=true (default) the response is sent once the graph has been
+    updated; with wait=false the job id is returned immediately (202) and can
+    be polled on /jobs/{job_id}. Messages for different `graph_id`s go to
+    isolated graphs and are extracted concurrently.
+    """
+    try:
+        timestamp = parse_timestamp(message.timestamp)
+        return await submit_job(
+            graph_id, {"text": message.text, "timestamp": timestamp}, wait
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in process_message: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/process-messages")
+async def process_messages(
+    batch: MessageBatch, wait: bool = True, graph_id: str = DEFAULT_SHARD
+) -> Dict:
+    """Queue a burst of messages as one job, extracted with batched LLM calls."""
+    try:
+        payload = {
+            "batch": [
+                {"text": m.text, "timestamp": parse_timestamp(m.timestamp)}
+                for m in batch.messages
+            ]
+        }
+        return await submit_job(graph_id, payload, wait)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error in process_messages: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def submit_job(graph_id: str, payload: Dict[str, Any], wait: bool):
+    shard = get_shard(graph_id)
+    # Lo shard resta in memoria finché il job non è terminato
+    shard.pending += 1
+    try:
+        job = jobs.submit({**payload, "graph_id": graph_id})
+    except QueueFullError as e:
+        shard.pending -= 1
+        raise HTTPException(status_code=429, detail=str(e))
+
+    if not wait:
+        return JSONResponse(
+            status_code=202,
+            content={"success": True, "job_id": job.id, "status": job.status},
+        )
+
+    await job.done.wait()
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    return {"success": True, "job_id": job.id, **job.result}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {**job.to_dict(), "queue_depth": jobs.depth}
+
+
+@app.get("/shards")
+async def get_shards() -> Dict:
+    """Graph shards currently in memory and load/spill counters."""
+    return {
+        **shards.stats(),
+        "shards": [
+            {
+                "graph_id": s.id,
+                "nodes": len(s.agent.graph.entities),
+                "edges": len(s.agent.graph),
+                "version": s.agent.graph.version,
+                "pending": s.pending,
+            }
+            for s in shards
+        ],
+    }
+
+
+@app.get("/cache/stats")
+async def get_cache_stats() -> Dict:
+    """Hit/miss counters of the LLM response cache (shared by all graphs)."""
+    if shards.response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **shards.response_cache.stats()}
+
+
+@app.get("/triage/stats")
+async def get_triage_stats(graph_id: str = DEFAULT_SHARD) -> Dict:
+    """Skip rate of the local triage and sampled false skips."""
+    agent = get_shard(graph_id).agent
+    if agent.triage is None:
+        return {"enabled": False}
+    return {"enabled": True, **agent.triage.stats()}
+
+
+@app.get("/resolution/stats")
+async def get_resolution_stats(graph_id: str = DEFAULT_SHARD) -> Dict:
+    """Canonical names, aliases and how mentions were resolved."""
+    resolver = get_shard(graph_id).agent.resolver
+    if resolver is None:
+        return {"enabled": False}
+    return {"enabled": True, **resolver.stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the stage timings, token counters and gauges."""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.get("/graph")
-async def get_graph(time_filter: str = "now"):
+async def get_graph(
+    time_filter: str = "now",
+    since: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    format: str = "json",
+    attributes: Optional[bool] = None,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    view: str = "full",
+    center: Optional[str] = None,
+    max_nodes: int = 200,
+    rank: str = "degree",
+    depth: int = 2,
+    min_weight: float = 0.0,
+    graph_id: str = DEFAULT_SHARD,
+):
+    """Return the graph, or only what changed after version `since`.
+
+    `from`/`to` (ISO timestamps) select an arbitrary range instead of
+    `time_filter`.
+
+    `limit` pages the edges (follow "next_cursor"). `format` is "json" (one
+    object per node/edge), "columnar" (parallel arrays and a string table,
+    epoch-ms timestamps) or "msgpack" (columnar, binary). Node attributes
+    are included by default only in the json format.
+
+    `view=lod` returns instead at most `max_nodes` entities, the most
+    central by `rank` ("degree" or "weight") within `depth` hops of
+    `center` (or overall), with the other neighbors folded into
+    "N more <type>" cluster nodes.
+    """
     try:
-        if time_filter not in ["now", "1h", "1d", "1w", "1m"]:
+        if time_filter not in TIME_FILTERS:
             raise HTTPException(status_code=400, detail="Invalid time filter")
-        return agent.get_graph_data(time_filter)
+        if format not in WIRE_FORMATS:
+            raise HTTPException(status_code=400, detail="Invalid format")
+        if format == "msgpack" and msgpack is None:
+            raise HTTPException(status_code=501, detail="msgpack is not installed")
+        if limit is not None and not 1 <= limit <= MAX_PAGE:
+            raise HTTPException(status_code=400, detail=f"limit must be in 1..{MAX_PAGE}")
+        if view not in GRAPH_VIEWS:
+            raise HTTPException(status_code=400, detail="Invalid view")
+        agent = get_shard(graph_id).agent
+        if view == "lod":
+            if format == "columnar":
+                raise HTTPException(
+                    status_code=400, detail="view=lod supports json and msgpack"
+                )
+            if rank not in CENTRALITY:
+                raise HTTPException(status_code=400, detail="rank must be degree or weight")
+            if not 1 <= max_nodes <= MAX_LOD_NODES:
+                raise HTTPException(
+                    status_code=400, detail=f"max_nodes must be in 1..{MAX_LOD_NODES}"
+                )
+            if not 1 <= depth <= MAX_DEPTH:
+                raise HTTPException(status_code=400, detail=f"depth must be in 1..{MAX_DEPTH}")
+            data = agent.get_graph_lod(
+                center, max_nodes, rank, depth, min_weight, time_filter
+            )
+            if data is None:
+                raise HTTPException(status_code=404, detail="Entity not found")
+        elif since is not None:
+            return agent.get_graph_delta(since, time_filter)
+        else:
+            if attributes is None:
+                attributes = format == "json"
+            try:
+                data = agent.get_graph_data(
+                    time_filter,
+                    cursor=cursor,
+                    limit=limit,
+                    format="json" if format == "json" else "columnar",
+                    attributes=attributes,
+                    start=parse_timestamp(start),
+                    end=parse_timestamp(end),
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        # Solo tipi JSON nativi: si salta jsonable_encoder, che ripercorre tutto
+        if format == "msgpack":
+            return Response(msgpack.packb(data), media_type="application/msgpack")
+        return JSONResponse(data)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in get_graph: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/graph/history")
+async def get_history(
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    bucket: str = "hour",
+    entity_type: Optional[str] = None,
+    relation_type: Optional[str] = None,
+    source: Optional[str] = None,
+    target: Optional[str] = None,
+    type: Optional[str] = None,
+    graph_id: str = DEFAULT_SHARD,
+):
+    """Entity mentions and relation observations per hour/day/week bucket.
+
+    With `source`, `target` and `type` the buckets also carry the trend of
+    that edge (observations and mean weight).
+    """
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail="bucket must be hour, day or week")
+    start_time, end_time = parse_timestamp(start), parse_timestamp(end)
+    if start_time and end_time and start_time > end_time:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    edge = None
+    if source or target or type:
+        if not (source and target and type):
+            raise HTTPException(
+                status_code=400, detail="source, target and type go together"
+            )
+        edge = (source, target, type)
+    return get_shard(graph_id).agent.get_history(
+        start_time, end_time, bucket, entity_type, relation_type, edge
+    )
+
+
+@app.get("/graph/node/{name}/neighbors")
+async def get_neighbors(
+    name: str,
+    depth: int = 1,
+    min_weight: float = 0.0,
+    limit: Optional[int] = 100,
+    direction: str = "both",
+    time_filter: Optional[str] = None,
+    graph_id: str = DEFAULT_SHARD,
+):
+    """Return the nodes within `depth` hops of `name` and the edges among them."""
+    if time_filter is not None and time_filter not in TIME_FILTERS:
+        raise HTTPException(status_code=400, detail="Invalid time filter")
+    if direction not in DIRECTIONS:
+        raise HTTPException(status_code=400, detail="Invalid direction")
+    if not 1 <= depth <= MAX_DEPTH:
+        raise HTTPException(status_code=400, detail=f"depth must be in 1..{MAX_DEPTH}")
+    result = get_shard(graph_id).agent.get_neighbors(
+        name, depth, min_weight, limit, direction, time_filter
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Entity not found")
+    return result
+
+
+@app.get("/graph/top")
+async def get_top(
+    type: Optional[str] = None,
+    entity_type: Optional[str] = None,
+    source: Optional[str] = None,
+    target: Optional[str] = None,
+    limit: int = 20,
+    min_weight: float = 0.0,
+    time_filter: Optional[str] = None,
+    graph_id: str = DEFAULT_SHARD,
+):
+    """Return the strongest relations (of `type`, from `source`, to `target`),
+    or the most connected entities of `entity_type`."""
+    if time_filter is not None and time_filter not in TIME_FILTERS:
+        raise HTTPException(status_code=400, detail="Invalid time filter")
+    if not 1 <= limit <= MAX_TOP:
+        raise HTTPException(status_code=400, detail=f"limit must be in 1..{MAX_TOP}")
+    return get_shard(graph_id).agent.get_top(
+        type, entity_type, source, target, limit, min_weight, time_filter
+    )
+
+
+@app.get("/graph/stream")
+async def stream_graph(request: Request, graph_id: str = DEFAULT_SHARD):
+    """Server-Sent Events stream of graph deltas, pushed as messages are merged."""
+    return StreamingResponse(
+        get_shard(graph_id).events.stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/reset")
-async def reset_graph():
+async def reset_graph(graph_id: str = DEFAULT_SHARD):
     """Reset the knowledge graph, removing all entities and relations."""
     try:
-        logging.info("Resetting knowledge graph")
-        agent.reset()
+        shard = get_shard(graph_id)
+        logging.info(f"Resetting knowledge graph {graph_id}")
+        shard.agent.reset()
+        shard.events.version = shard.agent.graph.version
+        shard.events.publish("reset", {"version": shard.agent.graph.version})
         return {"success": True, "message": "Graph reset successfully"}
     except Exception as e:
         logging.error(f"Error resetting graph: {str(e)}")
@@ -0,0 +1,190 @@
+import copy
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional
+
+from agents.entity_extraction_agent import EntityExtractionAgent
+from backend.events import GraphEvents
+
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD = "default"
+# L'id finisce nel path su disco: niente separatori né "..", lunghezza limitata
+SHARD_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+class InvalidShardError(ValueError):
+    """Raised for a graph id that cannot be used as a shard key."""
+
+
+class ShardLimitError(RuntimeError):
+    """Raised for a new graph id when `max_shards` are loaded and none can be spilled."""
+
+
+def shard_config(config: Dict[str, Any], shard_id: str) -> Dict[str, Any]:
+    """Agent config for `shard_id`: same settings, its own persistence directory."""
+    if shard_id == DEFAULT_SHARD:
+        return config
+    if not SHARD_ID_RE.match(shard_id):
+        raise InvalidShardError(f"Invalid graph id: {shard_id!r}")
+    directory = (config.get("sharding") or {}).get("directory", "data/shards")
+    shard = copy.copy(config)
+    shard["persistence"] = {
+        **(config.get("persistence") or {}),
+        "directory": os.path.join(
+            EntityExtractionAgent._resolve_path(directory), shard_id
+        ),
+    }
+    return shard
+
+
+@dataclass
+class Shard:
+    id: str
+    agent: EntityExtractionAgent
+    events: GraphEvents
+    last_used: float = field(default_factory=time.monotonic)
+    # Job in coda o in esecuzione: uno shard occupato non viene mai scaricato
+    pending: int = 0
+
+    @property
+    def idle(self) -> bool:
+        return self.pending == 0 and not self.events.subscribers
+
+
+class ShardManager:
+    """Isolated graphs (agent, history, store, event stream) keyed by graph id.
+
+    Shards are created on first use. At most `max_shards` stay in memory:
+    the least recently used idle shard is spilled to disk (final snapshot of
+    its journal, under `sharding.directory`) to make room, and shards idle
+    for longer than `idle_seconds` are spilled by `sweep`. A spilled shard is loaded back
+    from its snapshot on the next request. When no shard can be spilled
+    (all busy, or persistence off: dropping one would lose its graph) a new
+    graph id is refused with ShardLimitError.
+
+    The LLM client and the response cache are shared by all shards; the
+    `default` shard keeps the top-level persistence directory.
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        max_shards: int = 64,
+        idle_seconds: Optional[float] = 900,
+    ):
+        self.config = config
+        self.max_shards = max_shards
+        self.idle_seconds = idle_seconds
+        self.persistent = bool((config.get("persistence") or {}).get("enabled"))
+        self.shards: "OrderedDict[str, Shard]" = OrderedDict()
+        self.counters = {"created": 0, "loaded": 0, "spilled": 0, "refused": 0}
+
+        default = self._create(DEFAULT_SHARD, EntityExtractionAgent(config=config))
+        self.default_agent = default.agent
+        self.response_cache = default.agent.response_cache
+
+    @property
+    def llm(self) -> "BaseChatModel":
+        # Creato alla prima chiamata dall'agente di default, poi condiviso
+        return self.default_agent.llm
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ShardManager":
+        settings = config.get("sharding") or {}
+        return cls(
+            config,
+            max_shards=settings.get("max_shards", 64),
+            idle_seconds=settings.get("idle_seconds", 900),
+        )
+
+    def get(self, shard_id: str = DEFAULT_SHARD) -> Shard:
+        """Return the shard for `shard_id`, loading or creating it if needed."""
+        shard = self.shards.get(shard_id)
+        if shard is None:
+            if not SHARD_ID_RE.match(shard_id):
+                raise InvalidShardError(f"Invalid graph id: {shard_id!r}")
+            self._make_room()
+            if len(self.shards) >= self.max_shards:
+                self.counters["refused"] += 1
+                raise ShardLimitError(
+                    f"Graph limit reached: {self.max_shards} loaded, none can be spilled"
+                )
+            shard = self._load(shard_id)
+        self.shards.move_to_end(shard_id)
+        shard.last_used = time.monotonic()
+        return shard
+
+    def __iter__(self) -> Iterator[Shard]:
+        return iter(list(self.shards.values()))
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def sweep(self) -> int:
+        """Spill every shard idle for longer than `idle_seconds`; return how many."""
+        if not self.persistent or not self.idle_seconds:
+            return 0
+        deadline = time.monotonic() - self.idle_seconds
+        expired = [
+            s for s in self.shards.values()
+            if s.id != DEFAULT_SHARD and s.idle and s.last_used < deadline
+        ]
+        for shard in expired:
+            self._spill(shard)
+        return len(expired)
+
+    def close(self) -> None:
+        for shard in list(self.shards.values()):
+            shard.agent.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": len(self.shards),
+            "max_shards": self.max_shards,
+            "persistent": self.persistent,
+            **{f"total_{k}": v for k, v in self.counters.items()},
+        }
+
+    def _load(self, shard_id: str) -> Shard:
+        config = shard_config(self.config, shard_id)
+        existed = self.persistent and os.path.exists(config["persistence"]["directory"])
+        agent = EntityExtractionAgent(
+            config=config, llm=self.llm, response_cache=self.response_cache
+        )
+        self.counters["loaded" if existed else "created"] += 1
+        logger.info(f"{'Loaded' if existed else 'Created'} graph shard {shard_id}")
+        return self._create(shard_id, agent)
+
+    def _create(self, shard_id: str, agent: EntityExtractionAgent) -> Shard:
+        events = GraphEvents()
+        events.version = agent.graph.version
+        shard = Shard(id=shard_id, agent=agent, events=events)
+        self.shards[shard_id] = shard
+        return shard
+
+    def _make_room(self) -> None:
+        """Spill idle shards until one more fits in `max_shards` (persistence only)."""
+        if not self.persistent:
+            return
+        excess = len(self.shards) - self.max_shards + 1
+        # Dal meno usato di recente; gli shard occupati restano caricati
+        for shard in list(self.shards.values()):
+            if excess <= 0:
+                break
+            if shard.id != DEFAULT_SHARD and shard.idle:
+                self._spill(shard)
+                excess -= 1
+
+    def _spill(self, shard: Shard) -> None:
+        shard.agent.close()
+        del self.shards[shard.id]
+        self.counters["spilled"] += 1
+        logger.info(f"Spilled idle graph shard {shard.id} to disk")
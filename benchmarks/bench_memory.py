@@ -0,0 +1,92 @@
+"""Memory per edge: object graph (one Relation/datetime/str set per edge) vs columnar GraphStore.
+
+Usage: python benchmarks/bench_memory.py --edges 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.graph_store import GraphStore
+from agents.models import Entity, Relation
+
+TYPES = ["uses", "knows", "interested_in", "learning", "expert_in"]
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def observations(n_edges: int, n_entities: int):
+    """Distinct (source, target, type) edges, with freshly built strings like the parser makes."""
+    for i in range(n_edges):
+        source = i % n_entities
+        target = (source + i // n_entities + 1) % n_entities
+        yield Relation(
+            source=f"entity_{source}",
+            target=f"entity_{target}",
+            type=TYPES[i % len(TYPES)],
+            weight=0.5,
+            timestamp=START + timedelta(seconds=i),
+        )
+
+
+def entities(n_entities: int):
+    for i in range(n_entities):
+        yield Entity(name=f"entity_{i}", type="topic", timestamp=START)
+
+
+def build_objects(n_edges: int, n_entities: int):
+    """The pre-columnar layout: dicts/lists of Entity and Relation objects."""
+    graph = {"entities": {}, "edges": {}, "times": [], "relations": [], "out": {}, "in": {}}
+    for entity in entities(n_entities):
+        graph["entities"][entity.name] = entity
+    for relation in observations(n_edges, n_entities):
+        graph["edges"][(relation.source, relation.target, relation.type)] = relation
+        graph["times"].append(relation.timestamp)
+        graph["relations"].append(relation)
+        graph["out"].setdefault(relation.source, []).append(relation)
+        graph["in"].setdefault(relation.target, []).append(relation)
+    return graph
+
+
+def build_columnar(n_edges: int, n_entities: int):
+    store = GraphStore()
+    for entity in entities(n_entities):
+        store.add_entity(entity)
+    for relation in observations(n_edges, n_entities):
+        store.add_relation(relation)
+    return store
+
+
+def measure(builder, n_edges: int, n_entities: int):
+    gc.collect()
+    tracemalloc.start()
+    graph = builder(n_edges, n_entities)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del graph
+    gc.collect()
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--edges", type=int, default=1_000_000)
+    parser.add_argument("--entities", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"edges: {args.edges:,}  entities: {args.entities:,}")
+    results = {}
+    for name, builder in (("objects", build_objects), ("columnar", build_columnar)):
+        current, peak = measure(builder, args.edges, args.entities)
+        results[name] = current
+        print(
+            f"{name:>9}: {current / args.edges:7.1f} bytes/edge retained, "
+            f"{peak / 2**20:8.1f} MiB peak"
+        )
+    print(f"reduction: {results['objects'] / results['columnar']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
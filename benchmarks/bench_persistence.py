@@ -0,0 +1,151 @@
+"""Benchmark the graph journal: write cost, write amplification and startup time.
+
+Usage: python benchmarks/bench_persistence.py --relations 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.graph_store import GraphStore
+from agents.models import Entity, Relation
+from agents.persistence import GraphJournal
+
+
+def generate(n_relations: int, n_entities: int, seed: int = 0):
+    """Yield (entities, relation) write batches shaped like real extractions."""
+    rng = random.Random(seed)
+    names = [f"entity_{i}" for i in range(n_entities)]
+    types = ["uses", "knows", "interested_in", "learning", "expert_in"]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(n_relations):
+        ts = start + timedelta(seconds=i)
+        # Coppie distinte finché i < n_entities * (n_entities - 1)
+        source = names[i % n_entities]
+        target = names[(i % n_entities + i // n_entities + 1) % n_entities]
+        entities = [
+            Entity(name=source, type="person", attributes={"role": "dev"}, timestamp=ts),
+            Entity(name=target, type="topic", attributes={"relevance": "high"}, timestamp=ts),
+        ]
+        yield entities, Relation(
+            source=source,
+            target=target,
+            type=rng.choice(types),
+            weight=round(rng.random(), 2),
+            timestamp=ts,
+        )
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def timed_load(directory: str):
+    start = time.perf_counter()
+    store = GraphStore()
+    journal = GraphJournal(directory)
+    store.attach_journal(journal)
+    elapsed = time.perf_counter() - start
+    journal.close()
+    return elapsed, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--relations", type=int, default=100_000)
+    parser.add_argument("--entities", type=int, default=5_000)
+    parser.add_argument("--snapshot-every", type=int, default=50_000)
+    parser.add_argument("--fsync", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 1. Scrittura con journal attivo (log + snapshot periodici)
+        directory = os.path.join(tmp, "graph")
+        journal = GraphJournal(
+            directory, snapshot_every=args.snapshot_every, fsync=args.fsync
+        )
+        store = GraphStore()
+        store.attach_journal(journal)
+
+        wal_bytes = 0
+        snapshot_bytes = 0
+        snapshots = 0
+        payload_bytes = 0
+        max_commit = 0.0
+        waited = 0.0
+        start = time.perf_counter()
+        for entities, relation in generate(args.relations, args.entities):
+            for entity in entities:
+                store.add_entity(entity)
+            store.add_relation(relation)
+            payload_bytes += len(relation.source) + len(relation.target)
+            payload_bytes += len(relation.type) + 16  # weight + timestamp
+            before = journal.records_since_snapshot
+            wal_size = os.path.getsize(journal.wal_path)
+            commit_start = time.perf_counter()
+            store.commit()
+            max_commit = max(max_commit, time.perf_counter() - commit_start)
+            if journal.records_since_snapshot < before:
+                # Lo snapshot si scrive in background: si aspetta solo per misurarlo
+                wait_start = time.perf_counter()
+                journal.wait()
+                waited += time.perf_counter() - wait_start
+                wal_bytes += wal_size
+                snapshot_bytes += os.path.getsize(journal.snapshot_path)
+                snapshots += 1
+        write_time = time.perf_counter() - start - waited
+        journal.close()
+        tail_bytes = os.path.getsize(journal.wal_path)
+        wal_bytes += tail_bytes
+
+        # 2. Avvio: snapshot + coda del log
+        load_time, loaded = timed_load(directory)
+        assert len(loaded.relations) == args.relations
+
+        # 3. Confronto: solo log, nessuno snapshot
+        wal_only = os.path.join(tmp, "wal_only")
+        journal = GraphJournal(wal_only, snapshot_every=args.relations * 10)
+        store = GraphStore()
+        store.attach_journal(journal)
+        for entities, relation in generate(args.relations, args.entities):
+            for entity in entities:
+                store.add_entity(entity)
+            store.add_relation(relation)
+            store.commit()
+        journal.close()
+        wal_only_load, _ = timed_load(wal_only)
+
+        # 4. Avvio da snapshot compatto appena scritto
+        journal = GraphJournal(wal_only)
+        store = GraphStore()
+        store.attach_journal(journal)
+        start = time.perf_counter()
+        journal.snapshot(store)
+        snapshot_time = time.perf_counter() - start
+        journal.close()
+        snapshot_load, _ = timed_load(wal_only)
+
+        print(f"relations:                 {args.relations}")
+        print(f"write throughput:          {args.relations / write_time:,.0f} relations/s")
+        print(f"snapshots taken:           {snapshots}")
+        print(f"slowest commit:            {max_commit * 1000:.1f}ms (snapshots off-thread)")
+        print(f"log bytes written:         {wal_bytes:,}")
+        print(f"snapshot bytes written:    {snapshot_bytes:,}")
+        print(
+            "write amplification:       "
+            f"{(wal_bytes + snapshot_bytes) / payload_bytes:.2f}x "
+            f"({(wal_bytes + snapshot_bytes) / args.relations:.0f} bytes/relation)"
+        )
+        print(f"on-disk size:              {dir_size(directory):,} bytes")
+        print(f"full snapshot write:       {snapshot_time:.2f}s")
+        print(f"startup (snapshot + tail): {load_time:.2f}s ({tail_bytes:,} log bytes)")
+        print(f"startup (snapshot only):   {snapshot_load:.2f}s")
+        print(f"startup (log only):        {wal_only_load:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
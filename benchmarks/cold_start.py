@@ -0,0 +1,112 @@
+"""Cold-start benchmark: time from launching the backend to its first response.
+
+Starts `uvicorn backend.main:app` in a fresh process, polls /shards until it
+answers and reports the time-to-ready, together with the import time of
+agents.base_agent and backend.main. Missing API keys are replaced by dummy
+values: clients are never asked to make a request.
+
+Usage: python benchmarks/cold_start.py --repeat 5 --provider groq
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_config(directory: str, provider: str) -> str:
+    """Copy config.yaml with the chosen provider and no disk state."""
+    with open(os.path.join(ROOT, "config", "config.yaml")) as f:
+        config = yaml.safe_load(f)
+    config["agent"]["provider"] = provider
+    config["persistence"]["enabled"] = False
+    config["cache"]["enabled"] = False
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_ready(env: dict, timeout: float = 60.0) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError("backend exited during startup")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/shards", timeout=1):
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"backend not ready after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def import_time(module: str, env: dict) -> float:
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], cwd=ROOT, env=env, stderr=subprocess.DEVNULL
+    )
+    return float(output.decode().split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--provider", default="groq", help="groq | openai | fake")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "IOTMAG_CONFIG": write_config(tmp, args.provider),
+            "PYTHONPATH": ROOT,
+        }
+        for key in ("GROQ_API_KEY", "OPENAI_API_KEY"):
+            env.setdefault(key, "dummy")
+
+        results = {"provider": args.provider}
+        for module in ("agents.base_agent", "backend.main"):
+            samples = [import_time(module, env) for _ in range(args.repeat)]
+            results[f"import {module}_s"] = round(statistics.median(samples), 3)
+        samples = [time_to_ready(env) for _ in range(args.repeat)]
+        results["time_to_ready_s"] = round(statistics.median(samples), 3)
+        results["time_to_ready_max_s"] = round(max(samples), 3)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""Offline benchmark suite for the extraction pipeline and the API.
+
+Runs against the deterministic `fake` provider, so no API key or network is
+needed and numbers are comparable across commits. Results are written as JSON
+to benchmarks/results/<commit>.json; pass --compare to print the ratio
+against an earlier run.
+
+Usage: python benchmarks/run.py --sizes 1000 10000 100000 --compare old.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from agents.fake_llm import fake_extraction, fake_extraction_json
+from agents.models import Entity, Relation, get_utc_now
+from agents.response_parser import parse_extraction, parse_json_extraction
+from config.config import load_config
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def write_config(
+    directory: str,
+    latency_ms: float,
+    streaming: bool = False,
+    output_format: str = "text",
+) -> str:
+    """Copy config.yaml with the fake provider and no disk state or cache."""
+    config = load_config()
+    config.pop("api_keys", None)
+    config["agent"] = {
+        "provider": "fake",
+        "streaming": streaming,
+        "output_format": output_format,
+    }
+    config["providers"]["fake"] = {"latency_ms": latency_ms, "max_entities": 3}
+    config["persistence"]["enabled"] = False
+    config["cache"]["enabled"] = False
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def summarize(samples, items: int = 1) -> dict:
+    """Throughput and latency percentiles (ms) from per-call durations (s)."""
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    total = sum(ordered)
+    return {
+        "calls": len(ordered),
+        "throughput": round(len(ordered) * items / total, 1) if total else None,
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+    }
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def messages(n: int):
+    words = ["python", "kubernetes", "sensors", "gardening", "football", "recipes"]
+    for i in range(n):
+        a, b = words[i % len(words)], words[(i // len(words)) % len(words)]
+        yield f"user_{i % 50}: I spent the weekend on {a} and some {b} topic_{i}"
+
+
+def bench_parse(agent, repeat: int) -> dict:
+    content = "learning kubernetes and rust with sensors"
+    if agent.output_format == "json":
+        text = json.dumps(fake_extraction_json("Alice", content, 5))
+    else:
+        text = fake_extraction("Alice", content, 5)
+    return summarize(timed(lambda: agent._parse_response(text, get_utc_now()), repeat))
+
+
+def token_counter():
+    """Exact token count with tiktoken if available, else the ~4 chars estimate."""
+    try:
+        import tiktoken
+
+        # Il vocabolario si scarica al primo uso: offline si ripiega sulla stima
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except (ImportError, OSError):
+        return lambda text: len(text) // 4
+    return lambda text: len(encoding.encode(text))
+
+
+def bench_output_formats(repeat: int, seed: int = 0) -> dict:
+    """Output tokens, parse time and failure rate of each extraction format.
+
+    Both formats answer the same messages with the same content (the fake
+    provider's). Failures are measured on the same replies cut at a random
+    point, as a max_tokens limit or a dropped connection would leave them:
+    "failed" is the share of replies that yield nothing and "recovered" the
+    share of items still parsed.
+    """
+    count = token_counter()
+    sample = [m.split(": ", 1) for m in messages(repeat)]
+    rng = random.Random(seed)
+    cuts = [rng.random() for _ in sample]
+    now = get_utc_now()
+    formats = {
+        "text": (fake_extraction, parse_extraction),
+        "json": (
+            lambda s, c: json.dumps(fake_extraction_json(s, c), separators=(",", ":")),
+            parse_json_extraction,
+        ),
+    }
+    results = {}
+    for name, (answer, parse) in formats.items():
+        replies = [answer(sender, content) for sender, content in sample]
+        items = sum(len(e) + len(r) for e, r in (parse(t, now) for t in replies))
+        samples = []
+        for text in replies:
+            start = time.perf_counter()
+            parse(text, now)
+            samples.append(time.perf_counter() - start)
+        truncated = [parse(t[: int(len(t) * cut)], now) for t, cut in zip(replies, cuts)]
+        results[name] = {
+            "output_tokens_per_message": round(
+                statistics.mean(count(t) for t in replies), 1
+            ),
+            "parse_p50_us": round(statistics.median(samples) * 10**6, 1),
+            "truncated_failed": round(
+                sum(1 for e, r in truncated if not e and not r) / len(replies), 3
+            ),
+            "truncated_recovered": round(
+                sum(len(e) + len(r) for e, r in truncated) / items, 3
+            ),
+        }
+        print(f"  output format {name}: {results[name]}")
+    return results
+
+
+def bench_process_message(agent, repeat: int) -> dict:
+    samples = []
+    for message in messages(repeat):
+        start = time.perf_counter()
+        agent.process_message(message)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def populate(agent, n_edges: int) -> None:
+    """Fill the graph directly (no LLM) with n_edges distinct recent relations."""
+    now = get_utc_now()
+    n_entities = max(2, int(n_edges ** 0.5) + 1)
+    graph = agent.graph
+    for i in range(n_entities):
+        graph.add_entity(
+            Entity(
+                name=f"entity_{i}",
+                type="person" if i % 10 == 0 else "topic",
+                attributes={"relevance": "high"},
+                timestamp=now - timedelta(seconds=n_entities - i),
+            )
+        )
+    for i in range(n_edges):
+        source = i % n_entities
+        target = (source + i // n_entities + 1) % n_entities
+        graph.add_relation(
+            Relation(
+                source=f"entity_{source}",
+                target=f"entity_{target}",
+                type="interested_in",
+                weight=0.8,
+                timestamp=now - timedelta(seconds=n_edges - i),
+            )
+        )
+    # Le letture passano dallo snapshot, pubblicato al commit
+    graph.commit()
+
+
+def graph_data(agent, *args, **kwargs) -> dict:
+    """get_graph_data computed from scratch (bypassing the view memoized on the snapshot)."""
+    agent.graph.snapshot.views.clear()
+    return agent.get_graph_data(*args, **kwargs)
+
+
+def bench_graph(agent, sizes, repeat: int) -> dict:
+    results = {}
+    for size in sizes:
+        agent.reset()
+        tracemalloc.start()
+        populate(agent, size)
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        graph_data(agent, "1m")
+        _, query_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        runs = max(1, repeat * 1000 // size)
+        results[str(size)] = {
+            "get_graph_data": summarize(timed(lambda: graph_data(agent, "1m"), runs)),
+            "get_graph_data_1h": summarize(timed(lambda: graph_data(agent, "1h"), runs)),
+            "get_graph_data_memoized": summarize(
+                timed(lambda: agent.get_graph_data("1m"), runs)
+            ),
+            "build_peak_mb": round(build_peak / 2**20, 2),
+            "query_peak_mb": round(query_peak / 2**20, 2),
+        }
+        print(f"  graph {size}: {results[str(size)]['get_graph_data']}")
+    agent.reset()
+    return results
+
+
+def bench_wire(agent, size: int, repeat: int) -> dict:
+    """Server CPU time and payload bytes of /graph for each wire format.
+
+    "json (encoder)" is the path the route used to take (FastAPI's
+    jsonable_encoder over the dicts, then json.dumps); the others are what
+    the route does now, serialization included.
+    """
+    from fastapi.encoders import jsonable_encoder
+
+    try:
+        import msgpack
+    except ImportError:
+        msgpack = None
+
+    def dumps(data) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode()
+
+    encoders = {
+        "json (encoder)": lambda: dumps(jsonable_encoder(graph_data(agent, "1m"))),
+        "json": lambda: dumps(graph_data(agent, "1m")),
+        "json, no attributes": lambda: dumps(
+            graph_data(agent, "1m", attributes=False)
+        ),
+        "columnar": lambda: dumps(
+            graph_data(agent, "1m", format="columnar", attributes=False)
+        ),
+        "json page of 1000": lambda: dumps(graph_data(agent, "1m", limit=1000)),
+    }
+    if msgpack is not None:
+        encoders["msgpack"] = lambda: msgpack.packb(
+            graph_data(agent, "1m", format="columnar", attributes=False)
+        )
+
+    agent.reset()
+    populate(agent, size)
+    runs = max(1, repeat * 100 // size)
+    results = {}
+    for name, encode in encoders.items():
+        payload = encode()
+        cpu = []
+        for _ in range(runs):
+            start = time.process_time()
+            encode()
+            cpu.append(time.process_time() - start)
+        results[name] = {
+            "cpu_ms": round(statistics.median(cpu) * 1000, 3),
+            "bytes": len(payload),
+        }
+        print(f"  wire {size} {name}: {results[name]}")
+    agent.reset()
+    return results
+
+
+def bench_endpoints(repeat: int, graph_size: int) -> dict:
+    # IOTMAG_CONFIG è già impostata: backend.main crea l'agente col provider fake
+    from fastapi.testclient import TestClient
+
+    from backend.main import agent, app
+
+    results = {}
+    with TestClient(app) as client:
+        stream = messages(repeat)
+
+        def post():
+            response = client.post("/process-message", json={"text": next(stream)})
+            response.raise_for_status()
+
+        results["POST /process-message"] = summarize(timed(post, repeat))
+        populate(agent, graph_size)
+        results[f"GET /graph ({graph_size} edges)"] = summarize(
+            timed(lambda: client.get("/graph?time_filter=1m").raise_for_status(), 20)
+        )
+        results["GET /graph?since"] = summarize(
+            timed(
+                lambda: client.get(
+                    f"/graph?time_filter=1m&since={agent.graph.version}"
+                ).raise_for_status(),
+                repeat,
+            )
+        )
+        client.post("/reset")
+    return results
+
+
+def commit_id() -> str:
+    try:
+        sha = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=ROOT)
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, prefix: str = "") -> None:
+    """Print metrics that differ from the baseline run as new/old ratios."""
+    for key, value in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            compare(value, old or {}, f"{prefix}{key} / ")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print(f"  {prefix}{key}: {old} -> {value} ({value / old:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--streaming", action="store_true", help="streaming extraction")
+    parser.add_argument("--output-format", default="text", help="text | json")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--output", help="default: benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="baseline results JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["IOTMAG_CONFIG"] = write_config(
+            tmp, args.latency_ms, args.streaming, args.output_format
+        )
+        from agents.entity_extraction_agent import EntityExtractionAgent
+
+        agent = EntityExtractionAgent()
+        results = {
+            "commit": commit_id(),
+            "python": sys.version.split()[0],
+            "streaming": args.streaming,
+            "output_format": args.output_format,
+            "output_formats": bench_output_formats(args.repeat),
+            "parse_response": bench_parse(agent, args.repeat * 10),
+            "process_message": bench_process_message(agent, args.repeat),
+        }
+        print(f"  parse_response: {results['parse_response']}")
+        print(f"  process_message: {results['process_message']}")
+        results["graph"] = bench_graph(agent, args.sizes, args.repeat)
+        results["wire"] = bench_wire(agent, max(args.sizes), args.repeat)
+        if not args.skip_api:
+            results["api"] = bench_endpoints(args.repeat, min(args.sizes))
+            for name, value in results["api"].items():
+                print(f"  {name}: {value}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline.get('commit')}:")
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
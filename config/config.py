@@ -1,10 +1,12 @@
 # config/config.py
 import os
+import threading
 import yaml
 from dotenv import load_dotenv
-from typing import Dict, Any
-from groq import Groq
-from openai import OpenAI
+from typing import Dict, Any, Optional
+
+_lock = threading.Lock()
+_shared: Optional[Dict[str, Any]] = None
 
 
 def load_config() -> Dict[str, Any]:
@@ -14,8 +16,10 @@ def load_config() -> Dict[str, Any]:
     # Carica le variabili d'ambiente dal file .env nella root
     load_dotenv(os.path.join(project_root, ".env"))
 
-    # Carica la configurazione YAML
-    config_path = os.path.join(project_root, "config", "config.yaml")
+    # Carica la configurazione YAML (IOTMAG_CONFIG permette di usarne un'altra)
+    config_path = os.getenv(
+        "IOTMAG_CONFIG", os.path.join(project_root, "config", "config.yaml")
+    )
     with open(config_path, "r") as file:
         config = yaml.safe_load(file)
 
@@ -26,3 +30,17 @@ def load_config() -> Dict[str, Any]:
     }
 
     return config
+
+
+def get_config() -> Dict[str, Any]:
+    """The configuration, parsed once per process and shared.
+
+    Callers must not modify the returned dict: derive variants from a copy.
+    """
+    global _shared
+    if _shared is None:
+        with _lock:
+            if _shared is None:
+                _shared = load_config()
+    return _shared
+
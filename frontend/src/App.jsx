@@ -1,6 +1,10 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import KnowledgeGraph from './components/KnowledgeGraph';
 
+const API_URL = 'http://localhost:8000';
+
+const edgeKey = (edge) => `${edge.source}|${edge.type}|${edge.target}`;
+
 function App() {
   const [graphData, setGraphData] = useState(null);
   const [message, setMessage] = useState('');
@@ -8,6 +12,9 @@ function App() {
   const [timeFilter, setTimeFilter] = useState('now');
   const [messageTime, setMessageTime] = useState('now');
   const [error, setError] = useState(null);
+  // Versione del grafo già ricevuta: le richieste successive chiedono solo le modifiche
+  const versionRef = useRef(null);
+  const timeFilterRef = useRef(timeFilter);
 
   const timeFilters = [
     { value: 'now', label: 'Current' },
@@ -35,16 +42,59 @@ function App() {
     }
   };
 
+  const getCutoff = (filter) => {
+    // Stessa finestra del backend: "now" include l'ultimo secondo
+    if (filter === 'now') {
+      return new Date(Date.now() - 1000);
+    }
+    return getTimestamp(filter);
+  };
+
+  // Applica una delta (nodi/archi rimossi, poi aggiunti o aggiornati) al grafo corrente
+  const applyDelta = (delta) => {
+    versionRef.current = delta.version;
+    if (delta.full) {
+      setGraphData({ nodes: delta.nodes, edges: delta.edges });
+      return;
+    }
+    setGraphData(current => {
+      const nodes = new Map((current?.nodes || []).map(node => [node.id, node]));
+      const edges = new Map((current?.edges || []).map(edge => [edgeKey(edge), edge]));
+      (delta.removed_nodes || []).forEach(name => nodes.delete(name));
+      (delta.removed_edges || []).forEach(edge => edges.delete(edgeKey(edge)));
+      delta.nodes.forEach(node => nodes.set(node.id, node));
+      delta.edges.forEach(edge => edges.set(edgeKey(edge), edge));
+
+      // Elimina ciò che è uscito dalla finestra temporale e i nodi rimasti senza archi
+      const cutoff = getCutoff(timeFilterRef.current);
+      const visibleNodes = new Map(
+        [...nodes].filter(([, node]) => new Date(node.timestamp) >= cutoff)
+      );
+      const visibleEdges = [...edges.values()].filter(edge =>
+        new Date(edge.timestamp) >= cutoff &&
+        visibleNodes.has(edge.source) &&
+        visibleNodes.has(edge.target)
+      );
+      const used = new Set(visibleEdges.flatMap(edge => [edge.source, edge.target]));
+      return {
+        nodes: [...visibleNodes.values()].filter(node => used.has(node.id)),
+        edges: visibleEdges,
+      };
+    });
+  };
+
   const fetchGraphData = async () => {
     try {
       setError(null);
-      console.log(`Fetching graph data with time_filter=${timeFilter}`);
-      const response = await fetch(`http://localhost:8000/graph?time_filter=${timeFilter}`);
+      const filter = timeFilterRef.current;
+      console.log(`Fetching graph data with time_filter=${filter}`);
+      const response = await fetch(`${API_URL}/graph?time_filter=${filter}`);
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data = await response.json();
       console.log('Received graph data:', data);
+      versionRef.current = data.version;
       setGraphData(data);
     } catch (error) {
       console.error('Error fetching graph data:', error);
@@ -52,6 +102,24 @@ function App() {
     }
   };
 
+  const fetchGraphDelta = async () => {
+    if (versionRef.current === null) {
+      return fetchGraphData();
+    }
+    try {
+      const response = await fetch(
+        `${API_URL}/graph?time_filter=${timeFilterRef.current}&since=${versionRef.current}`
+      );
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      applyDelta(await response.json());
+    } catch (error) {
+      console.error('Error fetching graph delta:', error);
+      setError(error.message);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     setLoading(true);
@@ -61,7 +129,7 @@ function App() {
       const timestamp = getTimestamp(messageTime).toISOString();
       console.log('Sending message with timestamp:', timestamp);
       
-      const response = await fetch('http://localhost:8000/process-message', {
+      const response = await fetch(`${API_URL}/process-message`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -77,7 +145,7 @@ function App() {
         throw new Error(errorData.detail || 'Failed to process message');
       }
 
-      await fetchGraphData();
+      await fetchGraphDelta();
       setMessage('');
     } catch (error) {
       console.error('Error sending message:', error);
@@ -90,9 +158,26 @@ function App() {
   // Aggiorniamo il grafo quando cambia il filtro temporale
   useEffect(() => {
     console.log('Time filter changed to:', timeFilter);
+    timeFilterRef.current = timeFilter;
     fetchGraphData();
   }, [timeFilter]);
 
+  // Le modifiche fatte da altri client arrivano come delta via Server-Sent Events
+  useEffect(() => {
+    const stream = new EventSource(`${API_URL}/graph/stream`);
+    stream.addEventListener('delta', (event) => {
+      const delta = JSON.parse(event.data);
+      if (versionRef.current !== null && delta.since === versionRef.current) {
+        applyDelta(delta);
+      } else {
+        fetchGraphDelta();
+      }
+    });
+    stream.addEventListener('reset', () => fetchGraphData());
+    stream.addEventListener('resync', () => fetchGraphData());
+    return () => stream.close();
+  }, []);
+
   return (
     <div className="min-h-screen bg-gray-100">
       <header className="bg-white shadow">
@@ -6,7 +6,8 @@ const KnowledgeGraph = ({ data }) => {
     nodes: data.nodes.map(node => ({
       ...node,
       color: getNodeColor(node.type),
-      size: 6
+      // I cluster "N more ..." della vista lod crescono con i nodi nascosti
+      size: node.cluster ? 4 + Math.log2(node.count + 1) : 6
     })),
     links: data.edges.map(edge => ({
       source: edge.source,
@@ -59,7 +60,7 @@ const KnowledgeGraph = ({ data }) => {
                 ctx.fill();
 
                 if (globalScale >= 1.5) {
-                  const label = `${node.name} (${node.type})`;
+                  const label = node.cluster ? node.name : `${node.name} (${node.type})`;
                   ctx.font = '4px sans-serif';
                   ctx.textAlign = 'center';
                   ctx.textBaseline = 'middle';
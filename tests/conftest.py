@@ -0,0 +1,16 @@
+import copy
+
+import pytest
+
+from config.config import load_config
+
+
+@pytest.fixture
+def config():
+    """config.yaml with no disk state, no response cache and no triage."""
+    config = copy.deepcopy(load_config())
+    config.pop("api_keys", None)
+    config["persistence"]["enabled"] = False
+    config["cache"]["enabled"] = False
+    config["triage"] = {"enabled": False}
+    return config
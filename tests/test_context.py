@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from agents.base_agent import CONTEXT_MODES
+from agents.entity_extraction_agent import EntityExtractionAgent
+from agents.fake_llm import FakeExtractionChatModel
+
+MESSAGES = [
+    f"user_{i % 3}: I spent the weekend on python and some sensors topic_{i}"
+    for i in range(8)
+]
+
+
+def contexts(config, run):
+    """The (type, content) of the messages sent in each LLM call."""
+    sent = []
+
+    class RecordingModel(FakeExtractionChatModel):
+        def _answer(self, messages, json_mode=False):
+            sent.append([(m.type, m.content) for m in messages])
+            return super()._answer(messages, json_mode)
+
+    agent = EntityExtractionAgent(config=config, llm=RecordingModel())
+    for message in MESSAGES:
+        run(agent, message)
+    return sent
+
+
+@pytest.mark.parametrize("mode", CONTEXT_MODES)
+def test_sync_and_async_send_the_same_context(config, mode):
+    # Budget basso: anche pochi messaggi fanno riassumere i turni vecchi
+    config["context"] = {**config["context"], "mode": mode, "max_tokens": 400}
+    sync = contexts(config, lambda agent, m: agent.process_message(m))
+    aio = contexts(config, lambda agent, m: asyncio.run(agent.aprocess_message(m)))
+    assert len(sync) == len(aio) == len(MESSAGES)
+    for call, (expected, actual) in enumerate(zip(sync, aio)):
+        assert actual == expected, f"call {call}: sync {len(expected)}, async {len(actual)}"
+
+
+def test_stateless_sends_only_the_current_turn(config):
+    config["context"] = {**config["context"], "mode": "stateless"}
+    sent = contexts(config, lambda agent, m: asyncio.run(agent.aprocess_message(m)))
+    assert [len(context) for context in sent] == [2] * len(MESSAGES)
@@ -0,0 +1,37 @@
+from agents.entity_extraction_agent import EntityExtractionAgent
+from agents.entity_resolution import EntityResolver
+
+
+def test_forget_drops_every_entry_of_the_name():
+    resolver = EntityResolver(
+        drop_tokens=["programming"], aliases={"ML": "Machine Learning"}, fuzzy=True
+    )
+    for name in ["Python", "python", "Python programming", "Machine Learning", "Rust"]:
+        resolver.resolve(name)
+
+    resolver.forget("Python")
+    resolver.forget("Machine Learning")
+
+    assert resolver.lookup("python") is None
+    assert "Python programming" not in resolver.aliases
+    assert "python" not in resolver._grams
+    lsh_keys = set().union(*resolver._lsh._buckets.values())
+    assert lsh_keys == {"rust"}
+    # Gli alias della configurazione restano
+    assert resolver.lookup("ML") == "Machine Learning"
+    assert resolver.resolve("python") == "python"
+
+
+def test_evicted_entities_leave_the_resolver(config):
+    config["context"] = {**config["context"], "mode": "stateless"}
+    config["graph_settings"]["retention"] = {
+        "enabled": True, "max_nodes": 15, "max_edges": 20, "steps_per_write": 64,
+    }
+    config["entity_resolution"] = {"enabled": True, "fuzzy": {"enabled": True}}
+    agent = EntityExtractionAgent(provider="fake", config=config)
+    for i in range(200):
+        agent.process_message(f"user_{i}: I love topic_{i} and skill_{i}")
+
+    resolver = agent.resolver
+    assert set(resolver.aliases.values()) <= set(agent.graph.entities)
+    assert len(resolver._grams) <= len(agent.graph.entities)
@@ -0,0 +1,111 @@
+import os
+from datetime import timedelta
+
+from agents.graph_store import GraphStore
+from agents.models import Entity, Relation, get_utc_now
+from agents.persistence import GraphJournal
+
+
+def open_store(directory, snapshot_every=10000):
+    store = GraphStore()
+    journal = GraphJournal(str(directory), snapshot_every=snapshot_every)
+    store.attach_journal(journal)
+    return store, journal
+
+
+def write(store, source, target, **kwargs):
+    store.add_entity(Entity(source, "person", **kwargs))
+    store.add_entity(Entity(target, "topic", **kwargs))
+    store.add_relation(Relation(source=source, target=target, type="LIKES", weight=0.5))
+    store.commit()
+
+
+def graph_state(store):
+    return (
+        {name: e.type for name, e in store.entities.items()},
+        sorted((r.source, r.target, r.type, r.weight, r.count) for r in store.relations),
+    )
+
+
+def test_torn_tail_does_not_swallow_later_writes(tmp_path):
+    store, journal = open_store(tmp_path)
+    for i in range(3):
+        write(store, f"a{i}", f"b{i}")
+    journal.close()
+    # Crash a metà dell'ultimo record
+    size = os.path.getsize(journal.wal_path)
+    with open(journal.wal_path, "r+b") as wal:
+        wal.truncate(size - 10)
+
+    store, journal = open_store(tmp_path)
+    assert len(store) == 2
+    write(store, "x", "y")
+    write(store, "z", "w")
+    expected = graph_state(store)
+    journal.close()
+
+    reloaded, journal = open_store(tmp_path)
+    assert graph_state(reloaded) == expected
+    journal.close()
+
+
+def test_salvages_a_record_appended_to_a_torn_line(tmp_path):
+    store, journal = open_store(tmp_path)
+    write(store, "a", "b")
+    journal.close()
+    with open(journal.wal_path, "rb") as wal:
+        lines = wal.readlines()
+    # Com'era prima della correzione: l'append continuava la riga troncata
+    with open(journal.wal_path, "wb") as wal:
+        wal.writelines(lines[:-1])
+        wal.write(lines[-1][:-10] + lines[-1])
+
+    reloaded, journal = open_store(tmp_path)
+    assert len(reloaded) == 1
+    journal.close()
+
+
+def test_background_snapshots_keep_every_write(tmp_path):
+    store, journal = open_store(tmp_path, snapshot_every=7)
+    for i in range(40):
+        write(store, f"a{i % 9}", f"b{i}")
+    expected = graph_state(store)
+    journal.close()
+    assert os.path.exists(journal.snapshot_path)
+    assert not os.path.exists(journal.old_wal_path)
+
+    reloaded, journal = open_store(tmp_path)
+    assert graph_state(reloaded) == expected
+    journal.close()
+
+
+def test_crash_during_snapshot_replays_the_rotated_log(tmp_path):
+    store, journal = open_store(tmp_path, snapshot_every=10**9)
+    write(store, "a", "b")
+    # Il log è stato ruotato ma lo snapshot non è mai arrivato su disco
+    journal.close()
+    os.replace(journal.wal_path, journal.old_wal_path)
+    store, journal = open_store(tmp_path)
+    write(store, "c", "d")
+    expected = graph_state(store)
+    journal.snapshot(store)
+    journal.close()
+    assert not os.path.exists(journal.old_wal_path)
+
+    reloaded, journal = open_store(tmp_path)
+    assert graph_state(reloaded) == expected
+    journal.close()
+
+
+def test_snapshot_keeps_history_rollups(tmp_path):
+    store, journal = open_store(tmp_path, snapshot_every=5)
+    now = get_utc_now()
+    for i in range(12):
+        write(store, "alice", f"topic_{i}", timestamp=now - timedelta(hours=i))
+    start, end = now - timedelta(days=1), now + timedelta(hours=1)
+    expected = store.history(start, end)
+    journal.close()
+
+    reloaded, journal = open_store(tmp_path)
+    assert reloaded.history(start, end) == expected
+    journal.close()
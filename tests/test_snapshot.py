@@ -0,0 +1,74 @@
+import random
+from datetime import timedelta
+
+from agents.graph_store import GraphStore
+from agents.models import Entity, Relation, get_utc_now
+from agents.snapshot import GraphSnapshot
+
+
+def contents(snapshot):
+    return (
+        sorted((e.name, e.type, e.timestamp) for e in snapshot.entities()),
+        sorted(
+            (r.source, r.target, r.type, r.weight, r.count, r.timestamp)
+            for r in snapshot.relations()
+        ),
+    )
+
+
+def random_writes(store, rng, steps):
+    now = get_utc_now()
+    names = [f"n{i}" for i in range(40)]
+    for _ in range(steps):
+        a, b = rng.choice(names), rng.choice(names)
+        ts = now - timedelta(minutes=rng.randint(0, 120))
+        op = rng.random()
+        if op < 0.6:
+            store.add_entity(Entity(a, "person", timestamp=ts))
+            store.add_entity(Entity(b, "topic", timestamp=ts))
+            store.add_relation(
+                Relation(source=a, target=b, type="LIKES", weight=rng.random(), timestamp=ts)
+            )
+        elif op < 0.8:
+            store.remove_relation(a, b, "LIKES")
+        else:
+            store.remove_entity(a)
+        store.commit()
+
+
+def test_published_snapshot_never_changes():
+    store = GraphStore()
+    rng = random.Random(1)
+    random_writes(store, rng, 200)
+    snapshot = store.snapshot
+    before = contents(snapshot)
+    cutoff = get_utc_now() - timedelta(hours=3)
+    window = snapshot.window_ids(cutoff)
+
+    random_writes(store, rng, 500)
+    assert store.snapshot is not snapshot
+    assert contents(snapshot) == before
+    assert snapshot.window_ids(cutoff) == window
+
+
+def test_evolved_snapshot_matches_a_full_build():
+    store = GraphStore()
+    rng = random.Random(2)
+    for _ in range(10):
+        random_writes(store, rng, 100)
+        snapshot = store.snapshot
+        assert snapshot.version == store.version
+        built = GraphSnapshot.build(
+            store.version,
+            store._types.strings,
+            [store._entity_record(i) for i in range(len(store._entity_ts))],
+            [store._edge_record(e) for e in range(len(store._source))],
+        )
+        assert contents(snapshot) == contents(built)
+        assert contents(snapshot) == (
+            sorted((e.name, e.type, e.timestamp) for e in store.entities.values()),
+            sorted(
+                (r.source, r.target, r.type, r.weight, r.count, r.timestamp)
+                for r in store.relations
+            ),
+        )